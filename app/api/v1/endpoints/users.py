@@ -0,0 +1,187 @@
+"""
+Keyset-paginated user listing.
+
+Usage:
+    python -m app.api.v1.endpoints.users bench --users 5000000
+"""
+
+import argparse
+import base64
+import json
+import statistics
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import MetaData, Select, or_, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.deps import get_current_superuser
+from app.core.database import get_db
+from app.models.user import User
+from app.schemas.user import UserOut, UserPage
+
+router = APIRouter()
+
+# Schema the benchmark seeds its synthetic users into, away from the real table
+BENCH_SCHEMA = "users_bench"
+
+
+def encode_cursor(created_at: datetime, user_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), user_id]).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, user_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(user_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def listing_query(
+    after: Optional[Tuple[datetime, int]] = None,
+    is_active: Optional[bool] = None,
+    is_superuser: Optional[bool] = None,
+    q: Optional[str] = None,
+) -> Select:
+    """Users newest first, starting after the (created_at, id) of the previous page's last row."""
+    query = select(User).order_by(User.created_at.desc(), User.id.desc())
+    if after is not None:
+        query = query.where(tuple_(User.created_at, User.id) < tuple_(*after))
+    if is_active is not None:
+        query = query.where(User.is_active == is_active)
+    if is_superuser is not None:
+        query = query.where(User.is_superuser == is_superuser)
+    if q:
+        prefix = f"{_escape_like(q)}%"
+        query = query.where(
+            or_(
+                User.email.ilike(prefix, escape="\\"),
+                User.full_name.ilike(prefix, escape="\\"),
+            )
+        )
+    return query
+
+
+@router.get("/users", response_model=UserPage)
+async def list_users(
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=200),
+    is_active: Optional[bool] = None,
+    is_superuser: Optional[bool] = None,
+    q: Optional[str] = Query(None, min_length=1, description="Email or full name prefix"),
+    db: AsyncSession = Depends(get_db),
+    _: dict = Depends(get_current_superuser),
+) -> UserPage:
+    """
+    List users newest first with keyset pagination over (created_at, id).
+
+    Each page is an index range scan that starts where the previous page
+    ended, so latency does not grow with depth the way OFFSET does.
+    """
+    query = listing_query(decode_cursor(cursor) if cursor else None, is_active, is_superuser, q)
+
+    # Fetch one extra row to learn whether another page exists
+    users = (await db.execute(query.limit(limit + 1))).scalars().all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].created_at, users[-1].id)
+    return UserPage(items=[UserOut.model_validate(user) for user in users], next_cursor=next_cursor)
+
+
+def _seed(connection: Any, users: int) -> None:
+    # Timestamps repeat in threes so pages also break ties on id
+    connection.execute(text(f"TRUNCATE {BENCH_SCHEMA}.users"))
+    connection.execute(
+        text(
+            f"INSERT INTO {BENCH_SCHEMA}.users "
+            "(email, hashed_password, full_name, is_active, is_superuser, created_at) "
+            "SELECT 'user' || n || '@example.com', 'x', 'User ' || n, n % 10 <> 0, n % 1000 = 0, "
+            "timestamptz '2020-01-01 00:00:00+00' + (n / 3) * interval '1 second' "
+            "FROM generate_series(1, :users) AS n"
+        ),
+        {"users": users},
+    )
+    connection.execute(text(f"ANALYZE {BENCH_SCHEMA}.users"))
+
+
+def _median_ms(connection: Any, query: Select, repeat: int) -> Tuple[float, List[int]]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        ids = [row.id for row in connection.execute(query)]
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 2), ids
+
+
+def benchmark(users: int, limit: int, pages: List[int], repeat: int) -> Dict[str, Any]:
+    """
+    Time pages at increasing depth, by keyset cursor and by OFFSET.
+
+    Synthetic users are seeded into BENCH_SCHEMA of the configured
+    database, with the same columns and indexes as the users table; the
+    seed is reused while it has the requested size.
+    """
+    from app.core.database import engine
+
+    table = User.__table__.to_metadata(MetaData(), schema=BENCH_SCHEMA)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA}"))
+        table.create(connection, checkfirst=True)
+        seeded = connection.execute(text(f"SELECT count(*) FROM {BENCH_SCHEMA}.users")).scalar_one()
+        if seeded != users:
+            _seed(connection, users)
+
+    result: Dict[str, Any] = {"users": users, "limit": limit}
+    bench_engine = engine.execution_options(schema_translate_map={None: BENCH_SCHEMA})
+    with bench_engine.connect() as connection:
+        for page in pages:
+            offset = page * limit
+            after = None
+            if offset:
+                # The last row of the previous page, which its next_cursor points at
+                boundary = connection.execute(listing_query().offset(offset - 1).limit(1)).one()
+                after = (boundary.created_at, boundary.id)
+            keyset_ms, keyset_ids = _median_ms(connection, listing_query(after).limit(limit), repeat)
+            offset_ms, offset_ids = _median_ms(connection, listing_query().offset(offset).limit(limit), repeat)
+            if keyset_ids != offset_ids:
+                raise RuntimeError(f"Keyset and OFFSET pages differ at page {page}")
+            result[f"page_{page}_keyset_ms"] = keyset_ms
+            result[f"page_{page}_offset_ms"] = offset_ms
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the user listing")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser(
+        "bench", help="Page latency by depth, keyset vs OFFSET, on synthetic users in the configured Postgres"
+    )
+    bench.add_argument("--users", type=int, default=5000000)
+    bench.add_argument("--limit", type=int, default=50)
+    bench.add_argument(
+        "--pages", default="0,10,100,1000,10000,99000", help="comma-separated zero-based page numbers"
+    )
+    bench.add_argument("--repeat", type=int, default=5, help="runs per query; the median is reported")
+    args = parser.parse_args()
+
+    pages = [int(page) for page in args.pages.split(",")]
+    if max(pages) * args.limit >= args.users:
+        parser.error("every page must start within --users")
+    result = benchmark(args.users, args.limit, pages, args.repeat)
+    for name, value in result.items():
+        print(f"{name}\t{value}")
+
+
+if __name__ == "__main__":
+    main()
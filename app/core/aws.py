@@ -0,0 +1,34 @@
+import threading
+from typing import Any, Dict
+
+import boto3
+
+from app.core.config import settings
+
+_clients: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name: str) -> Any:
+    """
+    Return a shared boto3 client, creating it on first use.
+
+    Region, endpoint and credentials come from Settings. Client construction
+    loads endpoint and credential metadata, so it is deferred until a
+    service actually needs AWS. boto3 clients are thread-safe and are
+    shared across the process.
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = boto3.client(
+                    service_name,
+                    region_name=settings.AWS_REGION,
+                    endpoint_url=settings.AWS_ENDPOINT_URL,
+                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                )
+                _clients[service_name] = client
+    return client
@@ -14,6 +14,10 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    PASSWORD_HASH_EXECUTOR: str = "thread"  # "thread" or "process"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64  # hashes queued or running before shedding with 503
+    SECURITY_EVENTS_CHANNEL: str = "security:events"  # Redis channel the backend counts security events from
 
     # Database
     DB_HOST: str
@@ -21,6 +25,12 @@ class Settings(BaseSettings):
     DB_USER: str
     DB_PASSWORD: str
     DB_NAME: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0  # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800  # seconds before a connection is replaced
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_TIMEOUT_MS: int = 30000
 
     @property
     def DATABASE_URL(self) -> PostgresDsn:
@@ -33,11 +43,28 @@ class Settings(BaseSettings):
             path=self.DB_NAME
         )
 
+    # Redis
+    REDIS_URL: Optional[str] = None
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_SOCKET_TIMEOUT: float = 0.25
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # seconds an idle connection waits before a PING
+
+    # User lookup cache
+    USER_CACHE_LOCAL_SIZE: int = 10000
+    USER_CACHE_LOCAL_TTL: float = 30.0  # seconds; bounds staleness if pub/sub is missed
+    USER_CACHE_REDIS_TTL: int = 300
+    USER_CACHE_NEGATIVE_TTL: int = 30  # seconds an unknown email stays cached as missing
+
+    # Health checks
+    HEALTH_CHECK_TIMEOUT: float = 1.0  # seconds per dependency probe
+    HEALTH_CHECK_CACHE_TTL: float = 2.0  # seconds a probe result is reused
+
     # AWS
     AWS_ACCESS_KEY_ID: Optional[str] = None
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
     AWS_REGION: str = "us-east-1"
     AWS_S3_BUCKET: Optional[str] = None
+    AWS_ENDPOINT_URL: Optional[str] = None  # local stand-in such as LocalStack
 
     # OpenAI
     OPENAI_API_KEY: Optional[str] = None
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.core.aws import get_client
+from app.core.config import settings
+from app.core.database import async_engine
+from app.core.redis import get_redis
+
+ProbeCheck = Callable[[], Awaitable[None]]
+
+
+class HealthProbe:
+    """
+    A dependency check whose result is cached for a short TTL.
+
+    Concurrent callers share a single in-flight check, so N probes per
+    second cost at most one real check per dependency per TTL.
+    """
+
+    def __init__(self, name: str, check: ProbeCheck, timeout: float, ttl: float):
+        self.name = name
+        self.check = check
+        self.timeout = timeout
+        self.ttl = ttl
+        self._result: Optional[Dict[str, Any]] = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def run(self) -> Dict[str, Any]:
+        if self._result is not None and time.monotonic() < self._expires_at:
+            return self._result
+        async with self._lock:
+            if self._result is not None and time.monotonic() < self._expires_at:
+                return self._result
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.check(), timeout=self.timeout)
+                status = "healthy"
+            except asyncio.TimeoutError:
+                status = f"error: timed out after {self.timeout}s"
+            except Exception as e:
+                status = f"error: {str(e)}"
+            self._result = {
+                "status": status,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+            self._expires_at = time.monotonic() + self.ttl
+            return self._result
+
+
+class HealthChecker:
+    """Runs every registered probe concurrently and summarises readiness."""
+
+    def __init__(self) -> None:
+        self.probes: List[HealthProbe] = []
+
+    def register(
+        self,
+        name: str,
+        check: ProbeCheck,
+        timeout: Optional[float] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.probes.append(
+            HealthProbe(
+                name,
+                check,
+                timeout=settings.HEALTH_CHECK_TIMEOUT if timeout is None else timeout,
+                ttl=settings.HEALTH_CHECK_CACHE_TTL if ttl is None else ttl,
+            )
+        )
+
+    async def check(self) -> Dict[str, Any]:
+        results = await asyncio.gather(*(probe.run() for probe in self.probes))
+        services = {probe.name: result for probe, result in zip(self.probes, results)}
+        healthy = all(result["status"] == "healthy" for result in results)
+        return {
+            "status": "healthy" if healthy else "unhealthy",
+            "services": services,
+        }
+
+
+async def check_postgresql() -> None:
+    # Uses the shared pool; pre-ping already discards dead connections
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+
+async def check_redis() -> None:
+    await get_redis().ping()
+
+
+async def check_kms() -> None:
+    await asyncio.to_thread(get_client("kms").list_aliases, Limit=1)
+
+
+async def check_secrets_manager() -> None:
+    await asyncio.to_thread(get_client("secretsmanager").list_secrets, MaxResults=1)
+
+
+health_checker = HealthChecker()
+health_checker.register("postgresql", check_postgresql)
+if settings.REDIS_URL:
+    health_checker.register("redis", check_redis)
+if settings.AWS_ACCESS_KEY_ID:
+    health_checker.register("kms", check_kms)
+    health_checker.register("secrets_manager", check_secrets_manager)
@@ -0,0 +1,48 @@
+from typing import Optional
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+
+_pool: Optional[redis.ConnectionPool] = None
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """Return a Redis client on the shared pool, or None when REDIS_URL is unset."""
+    global _pool
+    if not settings.REDIS_URL:
+        return None
+    if _pool is None:
+        _pool = redis.ConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+    return redis.Redis(connection_pool=_pool)
+
+
+def get_pubsub_redis() -> Optional[redis.Redis]:
+    """Return a client with its own connection for a long-lived pub/sub subscription.
+
+    Subscribers wait indefinitely for messages, so the connection has no
+    read timeout; liveness comes from TCP keepalive and the PING sent after
+    REDIS_HEALTH_CHECK_INTERVAL idle seconds. None when REDIS_URL is unset.
+    """
+    if not settings.REDIS_URL:
+        return None
+    return redis.Redis.from_url(
+        settings.REDIS_URL,
+        socket_timeout=None,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+
+
+async def close_redis() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.disconnect()
+        _pool = None
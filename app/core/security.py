@@ -1,13 +1,42 @@
+"""
+Password hashing and access tokens.
+
+Usage:
+    python -m app.core.security loadtest --logins 200
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from jose import jwt
 from passlib.context import CryptContext
+from redis.exceptions import RedisError
 
 from app.core.config import settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt takes 100-300 ms per call, so async callers run it on a dedicated,
+# size-limited executor instead of the event loop.
+_hash_executor: Optional[Executor] = None
+_pending_hashes = 0
+_pending_lock = threading.Lock()
+
+
+class HashingOverloaded(Exception):
+    """PASSWORD_HASH_MAX_PENDING hashes are already queued; the caller should retry shortly."""
+
 
 def create_access_token(
     subject: Union[str, Any], expires_delta: timedelta = None
@@ -30,4 +59,225 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password) 
\ No newline at end of file
+    return pwd_context.hash(password)
+
+
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """Verify a password, returning a new hash if the stored one is deprecated."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _get_hash_executor() -> Executor:
+    global _hash_executor
+    if _hash_executor is None:
+        if settings.PASSWORD_HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS
+            )
+        else:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                thread_name_prefix="password-hash",
+            )
+    return _hash_executor
+
+
+def _hash_finished(future: Optional[Future] = None) -> None:
+    global _pending_hashes
+    with _pending_lock:
+        _pending_hashes -= 1
+
+
+async def _run_hash(func, *args):
+    """
+    Run a hashing function off the event loop, shedding load when saturated.
+
+    A hash counts as pending until the executor job finishes, not until the
+    caller stops waiting: a disconnected client's hash still occupies a
+    worker, so it still counts against PASSWORD_HASH_MAX_PENDING.
+    """
+    global _pending_hashes
+    with _pending_lock:
+        if _pending_hashes >= settings.PASSWORD_HASH_MAX_PENDING:
+            raise HashingOverloaded("Authentication service is busy, please retry")
+        _pending_hashes += 1
+    try:
+        future = _get_hash_executor().submit(func, *args)
+    except BaseException:
+        _hash_finished()
+        raise
+    future.add_done_callback(_hash_finished)
+    return await asyncio.wrap_future(future)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hash(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hash(get_password_hash, password)
+
+
+async def verify_and_update_password_async(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    return await _run_hash(verify_and_update_password, plain_password, hashed_password)
+
+
+async def authenticate_password(
+    user: Any,
+    plain_password: str,
+    ip_address: Optional[str] = None,
+    user_agent: Optional[str] = None,
+) -> bool:
+    """
+    Verify a user's password without blocking the event loop.
+
+    If the stored hash uses a deprecated scheme or cost, the user's
+    hashed_password is replaced with a fresh hash; the caller's session
+    persists it on commit. A wrong password is reported as a login_failed
+    security event.
+    """
+    verified, new_hash = await verify_and_update_password_async(
+        plain_password, user.hashed_password
+    )
+    if verified and new_hash:
+        user.hashed_password = new_hash
+    if not verified:
+        await report_failed_login(str(user.id), ip_address, user_agent)
+    return verified
+
+
+async def report_failed_login(
+    user_id: Optional[str],
+    ip_address: Optional[str] = None,
+    user_agent: Optional[str] = None,
+) -> None:
+    """
+    Publish a login_failed security event on SECURITY_EVENTS_CHANNEL.
+
+    The backend counts these against its failed_login_attempts alarm
+    threshold. Callers that reject a login for an unknown email report it
+    with user_id None. Nothing is published when REDIS_URL is unset.
+    """
+    client = get_redis()
+    if client is None:
+        return
+    event = {
+        "event_type": "login_failed",
+        "user_id": user_id,
+        "action": "login",
+        "resource": "auth",
+        "changes": {"service": settings.APP_NAME},
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+    }
+    try:
+        await client.publish(settings.SECURITY_EVENTS_CHANNEL, json.dumps(event))
+    except RedisError:
+        logger.warning("Could not publish a login_failed security event")
+
+
+def shutdown_password_hasher() -> None:
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=True)
+        _hash_executor = None
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+async def _probe_health(client: Any, until: asyncio.Event, interval: float) -> List[float]:
+    # Latency counts from when each probe was due, so time the event loop
+    # spent blocked before serving it is included
+    latencies = []
+    due = time.perf_counter()
+    while True:
+        response = await client.get("/health/live")
+        latencies.append(time.perf_counter() - due)
+        response.raise_for_status()
+        if until.is_set():
+            return latencies
+        due = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+
+
+async def _login_storm(logins: int, probe_interval: float, blocking: bool) -> Dict[str, Any]:
+    """Measure /health/live latency alone and during a burst of concurrent logins"""
+    import httpx
+
+    from app.main import app
+
+    password = "correct horse battery staple"
+    hashed = get_password_hash(password)
+
+    async def login() -> bool:
+        if blocking:
+            # What a route calling the sync helper does: bcrypt on the event loop
+            await asyncio.sleep(0)
+            return verify_password(password, hashed)
+        return await verify_password_async(password, hashed)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        done = asyncio.Event()
+        probe = asyncio.create_task(_probe_health(client, done, probe_interval))
+        await asyncio.sleep(probe_interval * 50)
+        done.set()
+        idle = await probe
+
+        done = asyncio.Event()
+        probe = asyncio.create_task(_probe_health(client, done, probe_interval))
+        started = time.perf_counter()
+        results = await asyncio.gather(*(login() for _ in range(logins)), return_exceptions=True)
+        storm_seconds = time.perf_counter() - started
+        done.set()
+        during = await probe
+
+    shed = sum(1 for result in results if isinstance(result, HashingOverloaded))
+    failed = [
+        result for result in results
+        if isinstance(result, BaseException) and not isinstance(result, HashingOverloaded)
+    ]
+    if failed:
+        raise failed[0]
+    return {
+        "logins": logins,
+        "verified": sum(1 for result in results if result is True),
+        "shed_503": shed,
+        "storm_seconds": round(storm_seconds, 2),
+        "health_idle": _percentiles(idle),
+        "health_during_storm": _percentiles(during),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Password hashing load test")
+    commands = parser.add_subparsers(dest="command", required=True)
+    loadtest = commands.add_parser(
+        "loadtest", help="Probe /health/live latency while a login storm runs"
+    )
+    loadtest.add_argument("--logins", type=int, default=200)
+    loadtest.add_argument("--probe-interval", type=float, default=0.01, help="seconds between health probes")
+    loadtest.add_argument(
+        "--blocking", action="store_true", help="verify on the event loop, as the sync helpers would"
+    )
+    args = parser.parse_args()
+
+    result = asyncio.run(_login_storm(args.logins, args.probe_interval, args.blocking))
+    shutdown_password_hasher()
+    for name, value in result.items():
+        print(f"{name}\t{value}")
+
+
+if __name__ == "__main__":
+    main()
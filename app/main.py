@@ -1,13 +1,20 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
-from sqlalchemy import create_engine, text
-import os
 from dotenv import load_dotenv
 from typing import Dict, Any
 
+from app.api.v1.api import api_router
 from app.core.config import settings
+from app.core.database import async_engine
+from app.core.health import health_checker
+from app.core.redis import close_redis
+from app.core.security import HashingOverloaded, shutdown_password_hasher
+from app.services.user_cache import user_cache
 
 # Load environment variables
 load_dotenv()
@@ -21,8 +28,20 @@ To run this application locally:
 4. For API documentation, visit http://localhost:8000/docs
 """
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    invalidation_listener = asyncio.create_task(user_cache.listen_for_invalidations())
+    yield
+    invalidation_listener.cancel()
+    await user_cache.wait_for_invalidations()
+    shutdown_password_hasher()
+    await close_redis()
+    await async_engine.dispose()
+
+
 app = FastAPI(
     title=settings.APP_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_PREFIX}/openapi.json",
     docs_url=f"{settings.API_V1_PREFIX}/docs",
     redoc_url=f"{settings.API_V1_PREFIX}/redoc",
@@ -37,9 +56,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create database engine using settings
-engine = create_engine(str(settings.DATABASE_URL))
-
 # Exception handlers
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
@@ -48,6 +64,45 @@ async def validation_exception_handler(request, exc):
         content={"detail": exc.errors()},
     )
 
+@app.exception_handler(HashingOverloaded)
+async def hashing_overloaded_handler(request, exc):
+    # Load shedding: the client may retry once the hash queue drains
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
+
+@app.get("/health/live")
+async def liveness_check() -> Dict[str, Any]:
+    """
+    Liveness probe: the process is up and serving requests.
+
+    Never touches dependencies, so a slow database cannot get the
+    container restarted.
+    """
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness_check() -> JSONResponse:
+    """
+    Readiness probe: every dependency answered within its timeout.
+
+    Probes run concurrently and each result is cached for
+    HEALTH_CHECK_CACHE_TTL seconds. Returns 503 when any dependency is
+    unhealthy.
+
+    Returns:
+        Dict containing:
+        - status: Overall health status ("healthy" or "unhealthy")
+        - services: Status and latency of each dependency
+    """
+    health_status = await health_checker.check()
+    status_code = 200 if health_status["status"] == "healthy" else 503
+    return JSONResponse(status_code=status_code, content=health_status)
+
+
 @app.get("/health")
 async def health_check() -> Dict[str, Any]:
     """
@@ -59,24 +114,14 @@ async def health_check() -> Dict[str, Any]:
         - services: Status of individual services
             - postgresql: Database connection status
     """
-    health_status = {
-        "status": "healthy",
+    health_status = await health_checker.check()
+    return {
+        "status": health_status["status"],
         "services": {
-            "postgresql": "unhealthy"
-        }
+            name: result["status"]
+            for name, result in health_status["services"].items()
+        },
     }
-    
-    # Check PostgreSQL connection
-    try:
-        with engine.connect() as connection:
-            connection.execute(text("SELECT 1"))
-            health_status["services"]["postgresql"] = "healthy"
-    except Exception as e:
-        health_status["status"] = "unhealthy"
-        health_status["services"]["postgresql"] = f"error: {str(e)}"
-    
-    return health_status
 
 # Import and include routers
-# from app.api.v1.api import api_router
-# app.include_router(api_router, prefix=settings.API_V1_PREFIX) 
\ No newline at end of file
+app.include_router(api_router, prefix=settings.API_V1_PREFIX) 
\ No newline at end of file
@@ -0,0 +1,19 @@
+-- Indexes backing keyset-paginated user listing (GET /api/v1/users).
+-- CONCURRENTLY avoids locking the users table; run outside a transaction:
+--   psql "$DATABASE_URL" -f app/migrations/0001_user_listing_indexes.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Keyset order (created_at DESC, id DESC)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_created_at_id
+    ON users (created_at, id);
+
+-- Same order restricted by the is_active filter
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_is_active_created_at_id
+    ON users (is_active, created_at, id);
+
+-- Case-insensitive prefix search on email and full_name
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_email_trgm
+    ON users USING gin (email gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_full_name_trgm
+    ON users USING gin (full_name gin_trgm_ops);
@@ -0,0 +1,17 @@
+-- Make users.created_at NOT NULL; the keyset listing (GET /api/v1/users)
+-- orders and pages by it, and a NULL would break both.
+--   psql "$DATABASE_URL" -f app/migrations/0002_users_created_at_not_null.sql
+
+-- Rows without a creation time take their last update, or the epoch if
+-- there is none, so they list as the oldest users
+UPDATE users
+SET created_at = coalesce(updated_at, timestamptz '1970-01-01 00:00:00+00')
+WHERE created_at IS NULL;
+
+-- A validated CHECK lets SET NOT NULL skip its full-table scan, so the
+-- ACCESS EXCLUSIVE lock is only held briefly; VALIDATE scans under a
+-- lock that does not block reads or writes
+ALTER TABLE users ADD CONSTRAINT users_created_at_not_null CHECK (created_at IS NOT NULL) NOT VALID;
+ALTER TABLE users VALIDATE CONSTRAINT users_created_at_not_null;
+ALTER TABLE users ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE users DROP CONSTRAINT users_created_at_not_null;
@@ -0,0 +1,290 @@
+"""
+Streaming bulk import and export of users.
+
+Import reads CSV or JSONL, hashes passwords in a process pool, and upserts
+on the unique email in chunks through Postgres COPY. Rows that fail
+validation are written to a rejects file instead of aborting the run.
+Export streams the table to JSONL through a server-side cursor.
+
+Usage:
+    python -m app.services.user_bulk import users.csv --rejects rejects.jsonl
+    python -m app.services.user_bulk export users.jsonl
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from sqlalchemy import select
+
+from app.core.database import SessionLocal, engine
+from app.core.security import get_password_hash
+from app.models.user import User
+from app.services.user_cache import user_cache
+
+DEFAULT_CHUNK_SIZE = 5000
+_TRUE_VALUES = {"1", "true", "t", "yes", "y"}
+# Never written to the rejects file, whatever their case in the input
+_SECRET_FIELDS = {"password", "hashed_password"}
+_email_adapter = TypeAdapter(EmailStr)
+
+_UPSERT_SQL = """
+    INSERT INTO users (email, hashed_password, full_name, is_active, is_superuser)
+    SELECT email, hashed_password, full_name, is_active, is_superuser FROM users_import
+    ON CONFLICT (email) DO UPDATE SET
+        hashed_password = EXCLUDED.hashed_password,
+        full_name = EXCLUDED.full_name,
+        is_active = EXCLUDED.is_active,
+        is_superuser = EXCLUDED.is_superuser,
+        updated_at = now()
+    RETURNING id, email
+"""
+
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield rows from a CSV or JSONL file without loading it into memory."""
+    with open(path, newline="", encoding="utf-8") as source:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(source)
+
+
+def _parse_bool(value: Any, default: bool) -> bool:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in _TRUE_VALUES
+
+
+def validate_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalise an input row; raises ValueError with the rejection reason."""
+    try:
+        email = str(_email_adapter.validate_python((row.get("email") or "").strip()))
+    except ValidationError:
+        raise ValueError("invalid email")
+    password = row.get("password")
+    hashed_password = row.get("hashed_password")
+    if not password and not hashed_password:
+        raise ValueError("missing password")
+    return {
+        "email": email,
+        "password": password,
+        "hashed_password": hashed_password,
+        "full_name": row.get("full_name") or None,
+        "is_active": _parse_bool(row.get("is_active"), True),
+        "is_superuser": _parse_bool(row.get("is_superuser"), False),
+    }
+
+
+def _without_secrets(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in row.items() if str(key).lower() not in _SECRET_FIELDS}
+
+
+def _chunks(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _copy_field(value: Any) -> str:
+    # Strings are always quoted and None is an unquoted empty field, which is
+    # the only thing COPY's CSV format reads as NULL. csv.QUOTE_NONNUMERIC
+    # would quote None as "" and import it as an empty string.
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_buffer(users: List[Dict[str, Any]]) -> io.StringIO:
+    """Encode users as COPY CSV rows, in the users_import column order."""
+    buffer = io.StringIO()
+    for user in users:
+        fields = (user["email"], user["hashed_password"], user["full_name"], user["is_active"], user["is_superuser"])
+        buffer.write(",".join(_copy_field(value) for value in fields) + "\n")
+    buffer.seek(0)
+    return buffer
+
+
+def _copy_chunk(users: List[Dict[str, Any]]) -> List[Tuple[int, str]]:
+    """COPY a chunk into a temp table and upsert it on email in one transaction."""
+    buffer = _copy_buffer(users)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS users_import "
+            "(email text, hashed_password text, full_name text, "
+            "is_active boolean, is_superuser boolean) ON COMMIT DELETE ROWS"
+        )
+        cursor.copy_expert(
+            "COPY users_import (email, hashed_password, full_name, is_active, is_superuser) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+        cursor.execute(_UPSERT_SQL)
+        upserted = cursor.fetchall()
+        connection.commit()
+        return upserted
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def import_users(
+    rows: Iterator[Dict[str, Any]],
+    rejects: Optional[IO[str]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Upsert users from an iterator of rows.
+
+    Returns counts of processed, imported and rejected rows plus throughput.
+    Each chunk is committed on its own, so an interrupted run keeps the
+    chunks that finished.
+    """
+    stats = {"processed": 0, "imported": 0, "rejected": 0}
+    started = time.perf_counter()
+
+    def reject(row: Dict[str, Any], reason: str) -> None:
+        stats["rejected"] += 1
+        if rejects is not None:
+            rejects.write(json.dumps({"row": _without_secrets(row), "reason": reason}, default=str) + "\n")
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for chunk in _chunks(rows, chunk_size):
+            stats["processed"] += len(chunk)
+            # Last row wins for duplicate emails, as the upsert would
+            valid: Dict[str, Dict[str, Any]] = {}
+            for row in chunk:
+                try:
+                    user = validate_row(row)
+                except ValueError as e:
+                    reject(row, str(e))
+                    continue
+                if user["email"] in valid:
+                    reject(valid[user["email"]], "superseded by a later row")
+                valid[user["email"]] = user
+
+            users = list(valid.values())
+            to_hash = [user for user in users if not user["hashed_password"]]
+            hashes = pool.map(
+                get_password_hash,
+                [user["password"] for user in to_hash],
+                chunksize=max(1, len(to_hash) // (4 * (workers or os.cpu_count() or 1))),
+            )
+            for user, hashed_password in zip(to_hash, hashes):
+                user["hashed_password"] = hashed_password
+            if not users:
+                continue
+
+            try:
+                upserted = _copy_chunk(users)
+            except Exception as e:
+                for user in users:
+                    reject({"email": user["email"]}, f"database error: {str(e)}")
+                continue
+            stats["imported"] += len(upserted)
+            # Raw SQL bypasses the ORM events, so invalidate cached users here
+            user_cache.invalidate(
+                [user_id for user_id, _ in upserted], [email for _, email in upserted]
+            )
+
+    elapsed = time.perf_counter() - started
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["rows_per_second"] = round(stats["processed"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+def export_users(
+    output: IO[str],
+    include_password_hash: bool = False,
+    batch_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    """
+    Stream every user to output as JSONL through a server-side cursor.
+
+    Only batch_size rows are held in memory at a time. Returns the number
+    of rows written.
+    """
+    columns = [
+        User.id,
+        User.email,
+        User.full_name,
+        User.is_active,
+        User.is_superuser,
+        User.created_at,
+        User.updated_at,
+    ]
+    if include_password_hash:
+        columns.append(User.hashed_password)
+
+    written = 0
+    with SessionLocal() as db:
+        result = db.execute(
+            select(*columns)
+            .order_by(User.id)
+            .execution_options(stream_results=True, yield_per=batch_size)
+        )
+        for row in result.mappings():
+            record = {
+                key: value.isoformat() if isinstance(value, datetime) else value
+                for key, value in row.items()
+            }
+            output.write(json.dumps(record) + "\n")
+            written += 1
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import or export users")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Upsert users from CSV or JSONL")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--rejects", default="rejected_users.jsonl")
+    import_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    import_parser.add_argument("--workers", type=int, default=None)
+
+    export_parser = commands.add_parser("export", help="Stream users to JSONL")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--include-password-hash", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        with open(args.rejects, "w", encoding="utf-8") as rejects:
+            stats = import_users(
+                read_rows(args.path),
+                rejects=rejects,
+                chunk_size=args.chunk_size,
+                workers=args.workers,
+            )
+        print(json.dumps(stats))
+    else:
+        with open(args.path, "w", encoding="utf-8") as output:
+            written = export_users(output, args.include_password_hash)
+        print(json.dumps({"exported": written}))
+
+
+if __name__ == "__main__":
+    main()
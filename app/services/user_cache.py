@@ -0,0 +1,376 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import redis
+import redis.asyncio as aioredis
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.redis import get_pubsub_redis, get_redis
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "user-cache:invalidate"
+_NEGATIVE = "__missing__"
+_CACHED_COLUMNS = ("id", "email", "full_name", "is_active", "is_superuser")
+
+# Sets the cached keys only if the looked-up key's generation is still the
+# one read before the database query, so a fill that raced an invalidation
+# cannot put the superseded row back.
+# KEYS: generation key, keys to set; ARGV: expected generation, payload, ttl
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('SET', KEYS[i], ARGV[2], 'EX', ARGV[3])
+end
+return 1
+"""
+
+
+def _id_key(user_id: int) -> str:
+    return f"user:id:{user_id}"
+
+
+def _email_key(email: str) -> str:
+    return f"user:email:{email}"
+
+
+def _generation_key(key: str) -> str:
+    return f"{key}:generation"
+
+
+def _serialize(user: User) -> Dict[str, Any]:
+    return {column: getattr(user, column) for column in _CACHED_COLUMNS}
+
+
+class UserCache:
+    """
+    Two-tier cache of User rows keyed by id and by email.
+
+    The first tier is an in-process LRU with a short TTL, the second a shared
+    Redis tier. Committed writes to User invalidate both tiers and are
+    broadcast over Redis pub/sub so other workers drop their local copies.
+    Unknown emails are cached as misses for a short time to blunt account
+    enumeration load. The cached dict holds only the columns needed to
+    authorise a request, never the password hash.
+
+    Each key has a generation that invalidation bumps, locally for lookups
+    in flight and in Redis for every worker. A lookup only fills the cache
+    if the generation it read before querying the database is unchanged,
+    so a row read before a commit never overwrites its invalidation.
+    """
+
+    def __init__(
+        self,
+        local_size: int,
+        local_ttl: float,
+        redis_ttl: int,
+        negative_ttl: int,
+    ) -> None:
+        self.local = TTLCache(maxsize=local_size, ttl=local_ttl)
+        self.redis_ttl = redis_ttl
+        self.negative_ttl = negative_ttl
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._sync_redis: Optional[redis.Redis] = None
+        self._lock = threading.Lock()
+        # key -> [lookups in flight, local generation]
+        self._fills: Dict[str, List[int]] = {}
+        # Keys whose Redis delete is still in flight, and the tasks sending them
+        self._remote_pending: Dict[str, int] = {}
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self._fill_script: Optional[Any] = None
+        self._counters = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "negative_hits": 0,
+            "invalidations": 0,
+            "stale_fills": 0,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    async def get_by_id(self, db: AsyncSession, user_id: int) -> Optional[Dict[str, Any]]:
+        return await self._get(db, _id_key(user_id), User.id == user_id, negative=False)
+
+    async def get_by_email(self, db: AsyncSession, email: str) -> Optional[Dict[str, Any]]:
+        return await self._get(db, _email_key(email), User.email == email, negative=True)
+
+    async def _get(
+        self, db: AsyncSession, key: str, criterion: Any, negative: bool
+    ) -> Optional[Dict[str, Any]]:
+        cached = self.local.get(key)
+        if cached is not None:
+            if cached == _NEGATIVE:
+                self._count("negative_hits")
+                return None
+            self._count("local_hits")
+            return cached
+
+        generation = self._begin_fill(key)
+        try:
+            return await self._load(db, key, criterion, negative, generation)
+        finally:
+            self._end_fill(key)
+
+    async def _load(
+        self, db: AsyncSession, key: str, criterion: Any, negative: bool, generation: int
+    ) -> Optional[Dict[str, Any]]:
+        # Until this worker's own delete reaches Redis, Redis may still hold the old row
+        client = None if key in self._remote_pending else get_redis()
+        redis_generation: Optional[bytes] = None
+        if client is not None:
+            try:
+                raw, redis_generation = await client.mget(key, _generation_key(key))
+            except redis.RedisError:
+                client, raw = None, None
+            if raw is not None:
+                value = _NEGATIVE if raw == _NEGATIVE.encode() else json.loads(raw)
+                self._fill_local(key, generation, [key], value)
+                if value == _NEGATIVE:
+                    self._count("negative_hits")
+                    return None
+                self._count("redis_hits")
+                return value
+
+        self._count("misses")
+        user = (await db.execute(select(User).where(criterion))).scalar_one_or_none()
+        if user is None:
+            if negative:
+                await self._fill(
+                    key, generation, client, redis_generation, [key], _NEGATIVE, self.negative_ttl
+                )
+            return None
+
+        value = _serialize(user)
+        # Any change to a user invalidates both its keys, so the looked-up
+        # key's generation also guards the other one
+        keys = [_id_key(user.id), _email_key(user.email)]
+        await self._fill(key, generation, client, redis_generation, keys, value, self.redis_ttl)
+        return value
+
+    def _begin_fill(self, key: str) -> int:
+        with self._lock:
+            fill = self._fills.setdefault(key, [0, 0])
+            fill[0] += 1
+            return fill[1]
+
+    def _end_fill(self, key: str) -> None:
+        with self._lock:
+            fill = self._fills[key]
+            fill[0] -= 1
+            if not fill[0]:
+                del self._fills[key]
+
+    async def _fill(
+        self,
+        key: str,
+        generation: int,
+        client: Optional[aioredis.Redis],
+        redis_generation: Optional[bytes],
+        keys: List[str],
+        value: Any,
+        redis_ttl: int,
+    ) -> None:
+        """Cache value under keys unless key was invalidated since its lookup began."""
+        if client is not None:
+            if self._fill_script is None:
+                self._fill_script = client.register_script(_FILL_SCRIPT)
+            payload = value if value == _NEGATIVE else json.dumps(value)
+            try:
+                stored = await self._fill_script(
+                    keys=[_generation_key(key), *keys],
+                    args=[redis_generation or b"0", payload, redis_ttl],
+                    client=client,
+                )
+            except redis.RedisError:
+                logger.warning("Could not write %s to the Redis user cache", key)
+            else:
+                if not stored:
+                    self._count("stale_fills")
+                    return
+        self._fill_local(key, generation, keys, value)
+
+    def _fill_local(self, key: str, generation: int, keys: List[str], value: Any) -> None:
+        ttl = self.negative_ttl if value == _NEGATIVE else None
+        with self._lock:
+            if self._fills[key][1] != generation:
+                self._counters["stale_fills"] += 1
+                return
+            for cache_key in keys:
+                self.local.set(cache_key, value, ttl=ttl)
+
+    def invalidate_local(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                fill = self._fills.get(key)
+                if fill is not None:
+                    # Lookups already in flight for this key must not cache what they read
+                    fill[1] += 1
+                self.local.pop(key)
+
+    def invalidate(self, user_ids: Iterable[int], emails: Iterable[str]) -> None:
+        """Drop users from both tiers and tell other workers to do the same."""
+        keys = [_id_key(user_id) for user_id in user_ids]
+        keys += [_email_key(email) for email in emails]
+        if not keys:
+            return
+        self._count("invalidations")
+        self.invalidate_local(keys)
+        if not settings.REDIS_URL:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            self._invalidate_remote_sync(keys)
+            return
+        for key in keys:
+            self._remote_pending[key] = self._remote_pending.get(key, 0) + 1
+        task = loop.create_task(self._invalidate_remote(keys))
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._remote_done, keys))
+
+    def _remote_done(self, keys: List[str], task: "asyncio.Task[None]") -> None:
+        self._tasks.discard(task)
+        for key in keys:
+            remaining = self._remote_pending[key] - 1
+            if remaining:
+                self._remote_pending[key] = remaining
+            else:
+                del self._remote_pending[key]
+
+    async def wait_for_invalidations(self) -> None:
+        """Wait until every scheduled Redis invalidation has been sent."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _message(self, keys: List[str]) -> str:
+        return json.dumps({"origin": self.origin, "keys": keys})
+
+    def _queue_invalidation(self, pipe: Any, keys: List[str]) -> None:
+        # Generations go up before the delete, so a fill that read the old row
+        # is rejected whether its script runs before or after the delete
+        for key in keys:
+            pipe.incr(_generation_key(key))
+            pipe.expire(_generation_key(key), self.redis_ttl)
+        pipe.delete(*keys)
+        pipe.publish(INVALIDATION_CHANNEL, self._message(keys))
+
+    async def _invalidate_remote(self, keys: List[str]) -> None:
+        client = get_redis()
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                self._queue_invalidation(pipe, keys)
+                await pipe.execute()
+        except redis.RedisError:
+            logger.warning("Could not invalidate %d Redis user cache keys", len(keys))
+
+    def _invalidate_remote_sync(self, keys: List[str]) -> None:
+        # Sync code paths (scripts, bulk jobs) have no event loop to schedule on
+        if self._sync_redis is None:
+            self._sync_redis = redis.Redis.from_url(
+                settings.REDIS_URL, socket_timeout=settings.REDIS_SOCKET_TIMEOUT
+            )
+        try:
+            pipe = self._sync_redis.pipeline(transaction=False)
+            self._queue_invalidation(pipe, keys)
+            pipe.execute()
+        except redis.RedisError:
+            logger.warning("Could not invalidate %d Redis user cache keys", len(keys))
+
+    async def listen_for_invalidations(self) -> None:
+        """Drop local entries invalidated by other workers; runs until cancelled."""
+        while True:
+            # A dedicated connection without the pool's read timeout, so an
+            # idle channel is not mistaken for a lost one
+            client = get_pubsub_redis()
+            if client is None:
+                return
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    while True:
+                        # Waking once per health check interval lets an idle
+                        # connection send its PING
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True,
+                            timeout=settings.REDIS_HEALTH_CHECK_INTERVAL,
+                        )
+                        if message is None:
+                            continue
+                        payload = json.loads(message["data"])
+                        if payload.get("origin") != self.origin:
+                            self.invalidate_local(payload.get("keys", []))
+            except redis.RedisError:
+                # The connection was lost and invalidations sent meanwhile
+                # were missed, so nothing cached locally can be trusted
+                logger.warning("User cache invalidation subscription lost; reconnecting")
+                self.local.clear()
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+user_cache = UserCache(
+    local_size=settings.USER_CACHE_LOCAL_SIZE,
+    local_ttl=settings.USER_CACHE_LOCAL_TTL,
+    redis_ttl=settings.USER_CACHE_REDIS_TTL,
+    negative_ttl=settings.USER_CACHE_NEGATIVE_TTL,
+)
+
+
+def _changed_users(session: Session) -> Tuple[Set[int], Set[str]]:
+    user_ids: Set[int] = set()
+    emails: Set[str] = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, User):
+            continue
+        if obj.id is not None:
+            user_ids.add(obj.id)
+        history = inspect(obj).attrs.email.history
+        for email in list(history.added) + list(history.deleted) + list(history.unchanged):
+            if email:
+                emails.add(email)
+    return user_ids, emails
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_user_changes(session, flush_context):
+    # new/dirty/deleted and attribute history still show the flushed changes
+    # here, and newly inserted users already have their ids
+    user_ids, emails = _changed_users(session)
+    pending = session.info.setdefault("user_cache_invalidations", (set(), set()))
+    pending[0].update(user_ids)
+    pending[1].update(emails)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    pending = session.info.pop("user_cache_invalidations", None)
+    if pending is not None:
+        user_cache.invalidate(*pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_user_changes(session):
+    session.info.pop("user_cache_invalidations", None)
@@ -0,0 +1,7 @@
+from fastapi import APIRouter
+
+from app.api.v1 import consents, jobs
+
+router = APIRouter()
+router.include_router(consents.router, tags=["consents"])
+router.include_router(jobs.router, tags=["jobs"])
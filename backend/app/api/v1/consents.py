@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Security
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import JWTError
+from pydantic import BaseModel
+
+from app.core.security_config import GDPR_CONFIG
+from app.middleware.security import rbac_middleware, security
+from app.services.consent_store import consent_cache
+
+router = APIRouter()
+
+
+class ConsentGrant(BaseModel):
+    consent_type: str
+    expires_at: Optional[datetime] = None
+    policy_version: Optional[str] = None
+
+
+def _subject(credentials: HTTPAuthorizationCredentials) -> str:
+    """The user id of the bearer token; consents are always managed by the user themselves"""
+    try:
+        claims, _ = rbac_middleware.verify_token(credentials.credentials)
+    except JWTError:
+        claims = {}
+    if claims.get('sub') is None:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return str(claims['sub'])
+
+
+@router.get("/consents")
+async def list_consents(
+    credentials: HTTPAuthorizationCredentials = Security(security),
+) -> List[Dict[str, Any]]:
+    """Every consent the user has granted, oldest first, with its status"""
+    return await asyncio.to_thread(consent_cache.store.get_records, _subject(credentials))
+
+
+@router.post("/consents", status_code=201)
+async def grant_consent(
+    grant: ConsentGrant,
+    credentials: HTTPAuthorizationCredentials = Security(security),
+) -> Dict[str, Any]:
+    """Grant a consent, replacing any current grant of the same type"""
+    consent_id = await asyncio.to_thread(
+        consent_cache.grant,
+        _subject(credentials),
+        grant.consent_type,
+        grant.expires_at,
+        grant.policy_version or GDPR_CONFIG['privacy_policy_version']
+    )
+    return {'id': consent_id, 'consent_type': grant.consent_type}
+
+
+@router.delete("/consents/{consent_type}", status_code=204)
+async def revoke_consent(
+    consent_type: str,
+    credentials: HTTPAuthorizationCredentials = Security(security),
+) -> None:
+    """Revoke a consent; other workers drop their cached copy over Redis pub/sub"""
+    if not await asyncio.to_thread(consent_cache.revoke, _subject(credentials), consent_type):
+        raise HTTPException(status_code=404, detail="No active consent of this type")
@@ -0,0 +1,111 @@
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Request, Response, Security
+from fastapi.security import HTTPAuthorizationCredentials
+from pydantic import BaseModel
+
+from app.middleware.security import rbac_middleware, security
+from app.services.job_handlers import JOB_TYPES
+from app.services.job_queue import get_job_queue
+
+router = APIRouter()
+
+
+class UserJobRequest(BaseModel):
+    user_id: str
+
+
+class ReencryptionRequest(BaseModel):
+    data_type: str
+    source_key: str
+    destination_key: str
+
+
+class JobOut(BaseModel):
+    id: str
+    type: str
+    user_id: Optional[str] = None
+    status: str
+    attempts: int
+    max_attempts: int
+    payload: Dict[str, Any]
+    progress: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    run_at: Optional[str] = None
+
+
+async def _authorize(credentials: HTTPAuthorizationCredentials, permissions: List[str], http_request: Request) -> None:
+    client_ip = http_request.client.host if http_request.client else None
+    if not await rbac_middleware.verify_permissions(credentials, permissions, ip_address=client_ip):
+        raise HTTPException(status_code=403, detail="Not enough privileges")
+
+
+async def _enqueue(job_type: str,
+                   payload: Dict[str, Any],
+                   user_id: Optional[str],
+                   response: Response,
+                   http_request: Request,
+                   credentials: HTTPAuthorizationCredentials) -> Dict[str, Any]:
+    await _authorize(credentials, JOB_TYPES[job_type].permissions, http_request)
+    queue = get_job_queue()
+    job_id, created = await queue.enqueue(job_type, payload, user_id)
+    if not created:
+        # An unfinished job for this user already exists; report that one instead
+        response.status_code = 200
+    job = await queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=409, detail="Job finished while being enqueued, retry the request")
+    return job
+
+
+@router.post("/jobs/gdpr-export", response_model=JobOut, status_code=202)
+async def enqueue_gdpr_export(
+    request: UserJobRequest,
+    response: Response,
+    http_request: Request,
+    credentials: HTTPAuthorizationCredentials = Security(security),
+) -> Dict[str, Any]:
+    """Queue an export of all of a user's data to S3; the result holds a download URL"""
+    return await _enqueue('gdpr_export', request.model_dump(), request.user_id, response, http_request, credentials)
+
+
+@router.post("/jobs/gdpr-deletion", response_model=JobOut, status_code=202)
+async def enqueue_gdpr_deletion(
+    request: UserJobRequest,
+    response: Response,
+    http_request: Request,
+    credentials: HTTPAuthorizationCredentials = Security(security),
+) -> Dict[str, Any]:
+    """Queue the erasure of all of a user's data (right to be forgotten)"""
+    return await _enqueue('gdpr_deletion', request.model_dump(), request.user_id, response, http_request, credentials)
+
+
+@router.post("/jobs/reencryption", response_model=JobOut, status_code=202)
+async def enqueue_reencryption(
+    request: ReencryptionRequest,
+    response: Response,
+    http_request: Request,
+    credentials: HTTPAuthorizationCredentials = Security(security),
+) -> Dict[str, Any]:
+    """Queue re-encryption of a JSON Lines object in AWS_S3_BUCKET under the current key"""
+    return await _enqueue('reencryption', request.model_dump(), None, response, http_request, credentials)
+
+
+@router.get("/jobs/{job_id}", response_model=JobOut)
+async def get_job(
+    job_id: str,
+    http_request: Request,
+    credentials: HTTPAuthorizationCredentials = Security(security),
+) -> Dict[str, Any]:
+    """Status, progress and outcome of a job; finished jobs expire after JOBS_CONFIG result_ttl_seconds"""
+    job = await get_job_queue().get(job_id)
+    job_type = JOB_TYPES.get(job['type']) if job is not None else None
+    if job_type is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await _authorize(credentials, job_type.permissions, http_request)
+    return job
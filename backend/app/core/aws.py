@@ -0,0 +1,27 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+
+_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name: str, endpoint_url: Optional[str] = None) -> Any:
+    """Return a shared boto3 client, creating it on first use.
+
+    Client construction loads endpoint and credential metadata, so it is
+    deferred until a service actually needs AWS rather than done at import.
+    boto3 clients are thread-safe and are shared across the process.
+    ``endpoint_url`` points a client at an AWS-compatible stand-in such as
+    MinIO or LocalStack.
+    """
+    key = (service_name, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = boto3.client(service_name, endpoint_url=endpoint_url)
+                _clients[key] = client
+    return client
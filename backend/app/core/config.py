@@ -19,15 +19,31 @@ class Settings(BaseSettings):
 
     # Database
     DATABASE_URL: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0  # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800  # seconds before a connection is replaced
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_TIMEOUT_MS: int = 30000
 
     # Security
     SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8  # 8 days
+    SECRETS_BACKEND: str = "aws_secrets_manager"  # aws_secrets_manager, env or file
+    SECRETS_FILE: str | None = None  # JSON file read by the file backend
+
+    # Redis
+    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_SOCKET_TIMEOUT: float = 0.25
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # idle seconds before a connection is PINGed
 
     # AWS Configuration
     AWS_ACCESS_KEY_ID: str
     AWS_SECRET_ACCESS_KEY: str
     AWS_REGION: str = "us-east-1"
+    AWS_S3_BUCKET: str | None = None  # bucket for GDPR data-portability exports
+    AWS_S3_ENDPOINT_URL: str | None = None  # S3-compatible stand-in such as MinIO or LocalStack
 
     # OpenAI Configuration
     OPENAI_API_KEY: str | None = None
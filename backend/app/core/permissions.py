@@ -0,0 +1,136 @@
+import base64
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Set
+
+from app.core.security_config import (
+    JWT_CONFIG,
+    PERMISSION_BITS,
+    ROLE_INHERITANCE,
+    ROLE_PERMISSIONS,
+    UserRole,
+)
+
+
+# Required permission sets whose masks are kept by required_mask
+REQUIRED_MASK_CACHE_SIZE = 1024
+
+
+class PermissionRegistry:
+    """Compiled authorization tables mapping permissions to bits and roles to masks.
+
+    Every permission is interned to a fixed bit position, and role
+    inheritance is resolved once when the registry is built, so checking
+    any or all of N permissions is a single bitwise operation.
+    """
+
+    def __init__(self,
+                 permission_bits: Sequence[str],
+                 role_permissions: Mapping[UserRole, Set[str]],
+                 role_inheritance: Mapping[UserRole, List[UserRole]]):
+        if len(set(permission_bits)) != len(permission_bits):
+            raise ValueError("Duplicate permission in PERMISSION_BITS")
+        self._names: List[str] = list(permission_bits)
+        self._bits: Dict[str, int] = {name: 1 << i for i, name in enumerate(self._names)}
+        # Masks of the permission sets routes require; bounded, since callers pass a fixed few
+        self._required_masks: Dict[FrozenSet[str], Optional[int]] = {}
+        self._role_permissions = role_permissions
+        self._role_inheritance = role_inheritance
+        self.role_masks: Dict[UserRole, int] = {}
+        for role in role_permissions:
+            self.role_masks[role] = self._resolve_role(role, ())
+
+    def _resolve_role(self, role: UserRole, chain: tuple) -> int:
+        if role in chain:
+            raise ValueError(f"Role inheritance cycle: {' -> '.join(r.value for r in chain + (role,))}")
+        if role in self.role_masks:
+            return self.role_masks[role]
+        try:
+            mask = self.mask(self._role_permissions.get(role, ()))
+        except KeyError as e:
+            raise ValueError(f"Permission {e} of role {role.value} is missing from PERMISSION_BITS")
+        for parent in self._role_inheritance.get(role, ()):
+            mask |= self._resolve_role(parent, chain + (role,))
+        return mask
+
+    @property
+    def all_mask(self) -> int:
+        return (1 << len(self._names)) - 1
+
+    def mask(self, permissions: Iterable[str]) -> int:
+        """Return the mask for permissions; raises KeyError for unknown ones"""
+        mask = 0
+        for permission in permissions:
+            mask |= self._bits[permission]
+        return mask
+
+    def required_mask(self, permissions: FrozenSet[str]) -> Optional[int]:
+        """Return the mask for a required permission set, or None if any is unknown"""
+        try:
+            return self._required_masks[permissions]
+        except KeyError:
+            pass
+        try:
+            mask: Optional[int] = self.mask(permissions)
+        except KeyError:
+            mask = None
+        if len(self._required_masks) < REQUIRED_MASK_CACHE_SIZE:
+            self._required_masks[permissions] = mask
+        return mask
+
+    def lenient_mask(self, permissions: Iterable[str]) -> int:
+        """Return the mask for permissions, ignoring names that are not registered"""
+        bits = self._bits
+        mask = 0
+        for permission in permissions:
+            mask |= bits.get(permission, 0)
+        return mask
+
+    def names(self, mask: int) -> FrozenSet[str]:
+        """Expand a mask back into permission names"""
+        return frozenset(name for name, bit in self._bits.items() if mask & bit)
+
+    def role_mask(self, role: UserRole) -> int:
+        return self.role_masks[UserRole(role)]
+
+    def register(self, permission: str) -> int:
+        """Return the bit of a permission, which must already be in PERMISSION_BITS.
+
+        Bits are never assigned at runtime: a bit chosen in one process would
+        depend on registration order, would not be persisted, and would
+        collide with the next entry appended to PERMISSION_BITS, so a token
+        carrying it would be read as a different permission elsewhere. New
+        permissions are added by appending them to PERMISSION_BITS.
+        """
+        try:
+            return self._bits[permission]
+        except KeyError:
+            raise ValueError(f"Permission {permission} is missing from PERMISSION_BITS; append it there") from None
+
+    @staticmethod
+    def has_all(mask: int, required: int) -> bool:
+        return mask & required == required
+
+    @staticmethod
+    def has_any(mask: int, required: int) -> bool:
+        return mask & required != 0
+
+
+def encode_mask(mask: int) -> str:
+    """Encode a permission mask as compact unpadded base64url"""
+    raw = mask.to_bytes(max(1, (mask.bit_length() + 7) // 8), 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def permission_claims(role: UserRole, extra_permissions: Iterable[str] = ()) -> Dict[str, str]:
+    """Build the JWT claim carrying the permission mask for role plus any extras"""
+    mask = permission_registry.role_mask(role) | permission_registry.mask(extra_permissions)
+    return {JWT_CONFIG['permission_mask_claim']: encode_mask(mask)}
+
+
+def decode_mask(value: str) -> int:
+    """Decode a mask produced by encode_mask"""
+    padded = value + '=' * (-len(value) % 4)
+    return int.from_bytes(base64.urlsafe_b64decode(padded), 'big')
+
+
+# Compiled once at import from the static role configuration
+permission_registry = PermissionRegistry(PERMISSION_BITS, ROLE_PERMISSIONS, ROLE_INHERITANCE)
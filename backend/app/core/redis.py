@@ -0,0 +1,48 @@
+from typing import Optional
+
+import redis.asyncio as redis
+
+_pool: Optional[redis.ConnectionPool] = None
+
+
+def get_redis() -> redis.Redis:
+    """Return a Redis client backed by the process-wide connection pool"""
+    global _pool
+    if _pool is None:
+        # Settings are read on first use so importing this module needs no environment
+        from app.core.config import settings
+
+        _pool = redis.ConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+    return redis.Redis(connection_pool=_pool)
+
+
+def get_pubsub_redis() -> redis.Redis:
+    """Return a client with its own connection for a long-lived pub/sub subscription.
+
+    Subscribers wait indefinitely for messages, so the connection has no
+    read timeout; liveness comes from TCP keepalive and the PING sent after
+    REDIS_HEALTH_CHECK_INTERVAL idle seconds. The caller closes the client.
+    """
+    from app.core.config import settings
+
+    return redis.Redis.from_url(
+        settings.REDIS_URL,
+        socket_timeout=None,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+
+
+async def close_redis() -> None:
+    """Disconnect every pooled Redis connection"""
+    global _pool
+    if _pool is not None:
+        await _pool.disconnect()
+        _pool = None
@@ -50,6 +50,37 @@ ROLE_PERMISSIONS: Dict[UserRole, Set[str]] = {
     }
 }
 
+# Roles that inherit every permission of another role
+ROLE_INHERITANCE: Dict[UserRole, List[UserRole]] = {
+    UserRole.OWNER: [UserRole.ADMIN],
+    UserRole.ADMIN: [UserRole.MANAGER],
+    UserRole.MANAGER: [],
+    UserRole.TEAM_MEMBER: []
+}
+
+# Bit position of each permission in token permission masks. This list is
+# append-only: new permissions go at the end so masks in tokens already
+# issued keep their meaning. Never reorder or remove entries.
+PERMISSION_BITS: List[str] = [
+    "manage_users",
+    "manage_roles",
+    "manage_billing",
+    "manage_settings",
+    "view_analytics",
+    "manage_projects",
+    "manage_teams",
+    "manage_integrations",
+    "manage_security",
+    "manage_compliance",
+    "view_audit_logs",
+    "manage_api_keys",
+    "manage_encryption_keys",
+    "manage_backups",
+    "manage_infrastructure",
+    "view_projects",
+    "view_teams"
+]
+
 # Define sensitive data fields that require encryption
 SENSITIVE_FIELDS = {
     "user": ["password", "ssn", "credit_card", "bank_account"],
@@ -72,21 +103,80 @@ AWS_SECURITY_CONFIG = {
             "failed_login_attempts": 5,
             "api_errors": 100,
             "unauthorized_access": 1
+        },
+        "metric_namespace": "Dynamis/Security",
+        # Security events are counted in process against alarm_thresholds
+        "aggregation": {
+            "window_seconds": 300,  # sliding window the thresholds apply to
+            "bucket_seconds": 10,  # ring buffer resolution of each window
+            "max_tracked_keys": 100000,  # users and IPs tracked per threshold; the oldest are evicted
+            "publish_interval_seconds": 60,  # how often window counts are sent as metrics
+            "threshold_event_types": {  # the event types each threshold counts
+                "failed_login_attempts": ["login_failed"],
+                "api_errors": ["api_error"],
+                "unauthorized_access": ["unauthorized_access", "permission_denied"]
+            },
+            # Other services publish their security events on this Redis channel;
+            # only these types are accepted from it
+            "event_channel": "security:events",
+            "remote_event_types": ["login_failed"]
         }
     },
     "waf": {
         "rate_limit": 2000,  # requests per 5 minutes
-        "blocked_ips": [],  # list of blocked IP addresses
+        "blocked_ips": [],  # blocked IP addresses or CIDR prefixes (IPv4 or IPv6)
+        "allowed_ips": [],  # addresses or prefixes that are never blocked
+        "ip_lists": {
+            "source": "config",  # config, file or redis
+            "blocklist_path": None,  # threat feed file, one address or prefix per line
+            "allowlist_path": None,
+            "redis_blocklist_key": "dynamis:ipfilter:blocklist",  # Redis sets; bump <key>:version after updates
+            "redis_allowlist_key": "dynamis:ipfilter:allowlist",
+            "reload_interval_seconds": 30
+        },
         "geo_restrictions": {
             "enabled": True,
             "allowed_countries": ["US", "CA", "GB", "EU"],  # GDPR compliance
-            "blocked_countries": []  # countries to block
+            "blocked_countries": [],  # countries to block
+            "mode": "log",  # log violations, or enforce to reject them locally as well as in WAF
+            "database_path": None,  # built with python -m app.services.geoip build; None disables local checks
+            "lookup_cache_size": 100000,  # recent IP to country results kept per worker
+            "unknown_country": "allow",  # allow or block addresses the database does not cover
+            "request_audit": {
+                "mode": "aggregate",  # aggregate, sample or off
+                "sample_rate": 0.01,  # fraction of requests logged in sample mode
+                "flush_interval_seconds": 60,  # how often per-IP counts are logged
+                "max_tracked_ips": 100000  # flush early once this many IPs are pending
+            }
         }
     },
     "secrets_manager": {
         "jwt_secret_name": "/dynamis/jwt/secret",
         "kms_key_name": "/dynamis/kms/key",
-        "rotation_period": 90  # days
+        "rotation_period": 90,  # days
+        "cache_ttl_seconds": 3600,  # how often cached secrets are refreshed in the background
+        "refresh_jitter": 0.1,  # +/- fraction of the TTL, so workers do not refresh in lockstep
+        "retry_interval_seconds": 30,  # retry delay after a failed refresh
+        # How long the previous secret stays valid after a rotation: the 30 minute
+        # access token lifetime plus a 30 minute margin for clock skew and slow refreshes
+        "previous_version_window_seconds": 3600
+    }
+}
+
+# Local rate limiting (enforced in-process in addition to AWS WAF)
+RATE_LIMIT_CONFIG = {
+    "algorithm": "sliding_window_counter",  # token_bucket, sliding_window_log or sliding_window_counter
+    "limit": AWS_SECURITY_CONFIG["waf"]["rate_limit"],
+    "window_seconds": 300,
+    "key_by": "ip",  # ip, user or api_key
+    "api_key_header": "X-API-Key",
+    "max_tracked_keys": 1000000,
+    "backend": "local",  # local, or redis to share limits across workers
+    "redis": {
+        "key_prefix": "dynamis:ratelimit",
+        "failure_mode": "local",  # local, open or closed while Redis is unreachable
+        "retry_interval_seconds": 5,  # how long to skip Redis after a failure
+        "local_fallback_divisor": 1  # set to the worker count to split the limit locally
     }
 }
 
@@ -98,7 +188,30 @@ GDPR_CONFIG = {
     "privacy_policy_version": "1.0",
     "data_processing_agreement": True,
     "right_to_be_forgotten": True,
-    "data_portability": True
+    "data_portability": True,
+    "consent": {
+        "default_type": "data_processing",  # consent checked by GDPRComplianceMiddleware
+        "cache_size": 100000,  # users whose active consents are kept per worker
+        "cache_ttl_seconds": 300,  # upper bound; entries also end at the earliest consent expiry
+        "invalidation_channel": "dynamis:consent:invalidate"  # Redis pub/sub channel for grants and revocations
+    },
+    "processing_log": {
+        "flush_interval_seconds": 60,  # data processing is logged as per-window counts
+        "max_pending": 100000  # flush early once this many user/data type/purpose counts are pending
+    },
+    "export": {
+        "checkpoint_every": 5000,  # records per gzip member and checkpoint
+        "queue_size": 1000,  # records buffered between the sources and the writer
+        "compression_level": 6,
+        "s3": {
+            "key_prefix": "gdpr-exports",
+            "part_size_bytes": 16 * 1024 * 1024,  # S3 requires at least 5 MiB for all but the last part
+            "max_parts_in_flight": 4,  # bounds memory to about (in flight + 1) parts
+            "checksum_algorithm": "SHA256",  # per-part checksum verified by S3; None to disable
+            "max_retries": 3,
+            "presigned_url_expiry_seconds": 3600
+        }
+    }
 }
 
 # Encryption Settings
@@ -106,9 +219,26 @@ ENCRYPTION_CONFIG = {
     "algorithm": "AES-256-GCM",
     "key_rotation_period": 90,  # days
     "key_storage": "AWS KMS",
+    "key_alias": "alias/dynamis",
+    "key_discovery_concurrency": 8,  # concurrent list_resource_tags calls when no alias exists
+    "key_id_cache": {
+        "path": "/tmp/dynamis-kms-key.json",
+        "ttl_seconds": 86400
+    },
     "encryption_context": {
         "environment": "production",
         "application": "dynamis"
+    },
+    "data_key_cache": {
+        "max_age_seconds": 300,  # lifetime of the data key used for encryption
+        "max_uses": 100000,  # fields encrypted before a new data key is generated
+        "decrypt_cache_size": 1024,  # unwrapped data keys kept for decryption
+        "decrypt_cache_ttl_seconds": 3600
+    },
+    "bulk": {
+        "max_workers": None,  # defaults to the number of CPUs
+        "max_in_flight": 256,  # records submitted ahead of the one being yielded
+        "kms_concurrency": 4  # concurrent KMS calls while unwrapping data keys
     }
 }
 
@@ -120,11 +250,32 @@ JWT_CONFIG = {
     "token_type": "bearer",
     "issuer": "dynamis-ai",
     "audience": "dynamis-clients",
-    "secret_key_source": "aws_secrets_manager"  # Indicates secret key is stored in AWS Secrets Manager
+    "secret_key_source": "aws_secrets_manager",  # Indicates secret key is stored in AWS Secrets Manager
+    "permission_mask_claim": "pm",  # compact permission bitmask carried by tokens
+    "verified_token_cache": {
+        "enabled": True,
+        "max_size": 10000,  # verified tokens kept in memory
+        "max_ttl_seconds": 900  # upper bound even for tokens with a later exp
+    }
+}
+
+# Background jobs, run by python -m app.worker
+JOBS_CONFIG = {
+    "key_prefix": "dynamis:jobs",
+    "concurrency": 4,  # jobs run at once by each worker process
+    "poll_interval_seconds": 1.0,  # how often an idle worker checks for due jobs
+    "lease_seconds": 120,  # a running job whose worker stops heartbeating is retried after this
+    "heartbeat_interval_seconds": 15,  # also how often progress is published
+    "max_attempts": 5,
+    "retry_backoff_seconds": 30,  # doubled after each failed attempt, with jitter
+    "max_retry_backoff_seconds": 3600,
+    "result_ttl_seconds": 7 * 86400,  # how long finished jobs can still be queried
+    "checkpoint_dir": "/tmp/dynamis-jobs"  # lets a retried export resume where it stopped
 }
 
 # Audit Logging Configuration
 AUDIT_CONFIG = {
+    "log_group_name": "/aws/dynamis",
     "log_level": "INFO",
     "log_format": "json",
     "include_ip": True,
@@ -133,5 +284,21 @@ AUDIT_CONFIG = {
     "include_user_id": True,
     "include_action": True,
     "include_resource": True,
-    "include_changes": True
+    "include_changes": True,
+    "shipper": {
+        "max_queue_size": 10000,
+        "batch_max_events": 1000,
+        "batch_max_bytes": 1048576,  # PutLogEvents limit per call
+        "flush_interval_seconds": 2.0,
+        "backpressure": "drop",  # drop, block or spill
+        "block_timeout_seconds": 0.05,
+        "spill_path": "/tmp/dynamis-audit-spill.jsonl",
+        "max_retries": 3
+    },
+    "store": {
+        "enabled": True,  # also write events to the partitioned audit_events table
+        "partition_premake_days": 3,  # daily partitions created ahead of time
+        "maintenance_interval_seconds": 3600,  # partition creation and retention check
+        "page_size": 100  # default page size for user activity queries
+    }
 } 
\ No newline at end of file
@@ -1,19 +1,231 @@
-from sqlalchemy import create_engine
+"""
+Database engines, sessions and pool metrics.
+
+Usage:
+    python -m app.db.database bench --concurrency 20
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Dict, Union
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
+ASYNC_SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace(
+    "postgresql://", "postgresql+asyncpg://", 1
+)
+
+_pool_options = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+
+
+class PoolMetrics:
+    """Connection pool counters: checkouts, overflow connections and acquire wait time."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_events = 0
+        self.waits = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def instrument(self, engine: Engine) -> None:
+        pool = engine.pool
+        counts_overflow = hasattr(pool, "checkedout") and hasattr(pool, "size")
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            # A checkout that takes the pool past pool_size is served by an overflow connection
+            overflowed = counts_overflow and pool.checkedout() > pool.size()
+            with self._lock:
+                self.checkouts += 1
+                if overflowed:
+                    self.overflow_events += 1
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.waits += 1
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def snapshot(self, engine: Engine) -> Dict[str, Union[int, float]]:
+        pool = engine.pool
+        with self._lock:
+            return {
+                "pool_size": pool.size() if hasattr(pool, "size") else 0,
+                "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else 0,
+                "overflow": max(0, pool.overflow()) if hasattr(pool, "overflow") else 0,
+                "checkouts": self.checkouts,
+                "overflow_events": self.overflow_events,
+                "avg_wait_seconds": self.total_wait_seconds / self.waits if self.waits else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"},
+    **_pool_options,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    connect_args={
+        "server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+    },
+    **_pool_options,
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+sync_pool_metrics = PoolMetrics()
+sync_pool_metrics.instrument(engine)
+async_pool_metrics = PoolMetrics()
+async_pool_metrics.instrument(async_engine.sync_engine)
+
 Base = declarative_base()
 
+
+def get_pool_metrics() -> Dict[str, Dict[str, Union[int, float]]]:
+    return {
+        "sync": sync_pool_metrics.snapshot(engine),
+        "async": async_pool_metrics.snapshot(async_engine.sync_engine),
+    }
+
+
 # Dependency
-def get_db():
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        await db.connection()
+        async_pool_metrics.record_wait(time.perf_counter() - started)
+        yield db
+
+
+# Blocking session for scripts and sync code paths
+def get_sync_db():
     db = SessionLocal()
     try:
+        started = time.perf_counter()
+        db.connection()
+        sync_pool_metrics.record_wait(time.perf_counter() - started)
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+
+# Schema the benchmark seeds its synthetic users into, away from any real table
+BENCH_SCHEMA = "db_bench"
+_BENCH_LOOKUP = text(f"SELECT id, email, full_name, is_active FROM {BENCH_SCHEMA}.users WHERE id = :id")
+
+
+def _seed_bench_users(users: int) -> None:
+    with engine.begin() as connection:
+        connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA}"))
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {BENCH_SCHEMA}.users "
+            "(id bigint PRIMARY KEY, email text NOT NULL, full_name text, is_active boolean NOT NULL)"
+        ))
+        seeded = connection.execute(text(f"SELECT count(*) FROM {BENCH_SCHEMA}.users")).scalar_one()
+        if seeded != users:
+            connection.execute(text(f"TRUNCATE {BENCH_SCHEMA}.users"))
+            connection.execute(
+                text(
+                    f"INSERT INTO {BENCH_SCHEMA}.users (id, email, full_name, is_active) "
+                    "SELECT n, 'user' || n || '@example.com', 'User ' || n, n % 10 <> 0 "
+                    "FROM generate_series(1, :users) AS n"
+                ),
+                {"users": users},
+            )
+            connection.execute(text(f"ANALYZE {BENCH_SCHEMA}.users"))
+
+
+def _sync_rps(users: int, requests: int, concurrency: int) -> float:
+    def lookup(n: int) -> None:
+        for db in get_sync_db():
+            db.execute(_BENCH_LOOKUP, {"id": n % users + 1}).one()
+
+    # A thread per in-flight request, as FastAPI runs blocking dependencies
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lookup, range(concurrency)))
+        started = time.perf_counter()
+        list(executor.map(lookup, range(requests)))
+        return requests / (time.perf_counter() - started)
+
+
+async def _async_rps(users: int, requests: int, concurrency: int) -> float:
+    async def run(count: int) -> None:
+        remaining = iter(range(count))
+
+        async def worker() -> None:
+            for n in remaining:
+                async for db in get_db():
+                    (await db.execute(_BENCH_LOOKUP, {"id": n % users + 1})).one()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    try:
+        await run(concurrency)
+        started = time.perf_counter()
+        await run(requests)
+        return requests / (time.perf_counter() - started)
+    finally:
+        await async_engine.dispose()
+
+
+def benchmark(users: int, requests: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Requests per second for a primary-key user lookup through get_sync_db
+    and through get_db, with `concurrency` lookups in flight.
+
+    Each lookup opens and closes its own session, as a request would.
+    Synthetic users are seeded into BENCH_SCHEMA of the configured
+    database and reused while the seed has the requested size.
+    """
+    _seed_bench_users(users)
+    result: Dict[str, Any] = {"users": users, "requests": requests, "concurrency": concurrency}
+    result["sync_rps"] = round(_sync_rps(users, requests, concurrency))
+    result["async_rps"] = round(asyncio.run(_async_rps(users, requests, concurrency)))
+    for path, snapshot in get_pool_metrics().items():
+        result[f"{path}_overflow_events"] = snapshot["overflow_events"]
+        result[f"{path}_max_wait_ms"] = round(snapshot["max_wait_seconds"] * 1000, 2)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the database session dependencies")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser(
+        "bench", help="User lookups per second, sync vs async session, on the configured Postgres"
+    )
+    bench.add_argument("--users", type=int, default=100000)
+    bench.add_argument("--requests", type=int, default=20000)
+    bench.add_argument(
+        "--concurrency", type=int, default=20, help="lookups in flight; above DB_POOL_SIZE + DB_MAX_OVERFLOW they queue"
+    )
+    args = parser.parse_args()
+
+    result = benchmark(args.users, args.requests, args.concurrency)
+    for name, value in result.items():
+        print(f"{name}\t{value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,67 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 
+from app.core.redis import close_redis
+from app.middleware.security import (
+    SecurityMiddleware,
+    gdpr_middleware,
+    geo_violation_auditor,
+    rbac_middleware,
+    request_auditor,
+)
+from app.services.audit_service import audit_service
+from app.services.consent_store import consent_cache
+from app.services.ip_filter import ip_lists
+from app.services.secrets_provider import close_secrets_provider
+from app.services.security_service import security_service
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up AWS-backed services and start IP list reloads; flush audit events on shutdown"""
+    warm_ups = {
+        'audit_service': audit_service.warm_up,
+        'security_service': security_service.warm_up,
+        'rbac_middleware': rbac_middleware.warm_up,
+        'consent_cache': consent_cache.warm_up,
+    }
+    results = await asyncio.gather(
+        *(asyncio.to_thread(warm_up) for warm_up in warm_ups.values()),
+        return_exceptions=True
+    )
+    for name, result in zip(warm_ups, results):
+        if isinstance(result, Exception):
+            # Services retry lazily on first use, so a failed warm-up is not fatal
+            logger.warning("Warm-up of %s failed: %s", name, result)
+    ip_list_watcher = asyncio.create_task(ip_lists.watch())
+    audit_store_maintenance = asyncio.create_task(audit_service.run_store_maintenance())
+    consent_invalidation_listener = asyncio.create_task(consent_cache.listen_for_invalidations())
+    security_metrics_publisher = asyncio.create_task(audit_service.aggregator.run_publisher())
+    # Security events from other services, such as failed logins from the user service
+    security_event_listener = asyncio.create_task(audit_service.listen_for_security_events())
+    yield
+    ip_list_watcher.cancel()
+    audit_store_maintenance.cancel()
+    consent_invalidation_listener.cancel()
+    security_metrics_publisher.cancel()
+    security_event_listener.cancel()
+    await asyncio.to_thread(request_auditor.flush)
+    await asyncio.to_thread(geo_violation_auditor.flush)
+    await asyncio.to_thread(gdpr_middleware.processing_log.flush)
+    await asyncio.to_thread(audit_service.shutdown)
+    await asyncio.to_thread(security_service.shutdown)
+    await asyncio.to_thread(close_secrets_provider)
+    await close_redis()
+
+
 app = FastAPI(
     title="Dynamis API",
     description="Backend API for Dynamis - A modern business management platform",
@@ -10,6 +69,7 @@ app = FastAPI(
     docs_url="/api/docs",
     redoc_url="/api/redoc",
     openapi_url="/api/openapi.json",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -21,6 +81,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it runs first: blocked IPs and rate-limited clients are rejected before any other work
+app.add_middleware(SecurityMiddleware)
+
 # Error handling
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
@@ -35,5 +98,5 @@ async def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 
 # Import and include routers
-# from app.api.v1 import router as api_v1
-# app.include_router(api_v1, prefix="/api/v1") 
\ No newline at end of file
+from app.api.v1 import router as api_v1
+app.include_router(api_v1, prefix="/api/v1") 
\ No newline at end of file
@@ -1,70 +1,305 @@
+"""
+Security middleware: IP and country restrictions, rate limits, security
+headers, RBAC and GDPR consent checks.
+
+Usage:
+    python -m app.middleware.security bench --requests 200000
+    python -m app.middleware.security tokens --checks 100000
+"""
+
 from fastapi import Request, HTTPException, Security
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
-from typing import Optional, List
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError
+from typing import Any, Dict, Optional, List, Tuple
+import argparse
+import asyncio
+import hashlib
+import random
 import re
+import threading
+import time
 from datetime import datetime
-import boto3
-from botocore.exceptions import ClientError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from app.core.security_config import JWT_CONFIG, AWS_SECURITY_CONFIG
+from app.core.aws import get_client
+from app.core.cache import TTLCache
+from app.core.permissions import decode_mask, permission_claims, permission_registry
+from app.core.redis import get_redis
+from app.core.security_config import JWT_CONFIG, AWS_SECURITY_CONFIG, GDPR_CONFIG, RATE_LIMIT_CONFIG, UserRole
 from app.services.audit_service import audit_service
+from app.services.consent_store import consent_cache
+from app.services.geoip import GeoRestriction
+from app.services.ip_filter import IPLists, ip_lists
+from app.services.rate_limiter import RateLimitResult, create_rate_limiter
+from app.services.redis_rate_limiter import RedisRateLimiter
+from app.services.secrets_provider import SecretsProvider, SecretVersions, get_secrets_provider
 
 security = HTTPBearer()
 
-class SecurityMiddleware:
-    def __init__(self):
-        self.secrets_manager = boto3.client('secretsmanager')
-        self.waf_client = boto3.client('wafv2')
-        self.rate_limit = AWS_SECURITY_CONFIG['waf']['rate_limit']
-        self.blocked_ips = AWS_SECURITY_CONFIG['waf']['blocked_ips']
-        self.geo_restrictions = AWS_SECURITY_CONFIG['waf']['geo_restrictions']
+# Security headers added to every HTTP response, as raw ASGI header pairs
+SECURITY_HEADERS: List[Tuple[bytes, bytes]] = [
+    (b'x-content-type-options', b'nosniff'),
+    (b'x-frame-options', b'DENY'),
+    (b'x-xss-protection', b'1; mode=block'),
+    (b'strict-transport-security', b'max-age=31536000; includeSubDomains'),
+    (b'content-security-policy', b"default-src 'self'"),
+]
+_SECURITY_HEADER_NAMES = frozenset(name for name, _ in SECURITY_HEADERS)
+
+
+class RequestAuditor:
+    """Record per-request audit events without a log call on every request.
+
+    In ``aggregate`` mode requests are counted per client IP and one event per
+    IP is logged every flush interval (or sooner, once ``max_tracked_ips`` IPs
+    are pending). In ``sample`` mode a random fraction of requests is logged
+    individually; ``off`` disables request auditing.
+    """
+
+    def __init__(self,
+                 mode: str = 'aggregate',
+                 event_type: str = 'geo_check',
+                 sample_rate: float = 0.01,
+                 flush_interval: float = 60.0,
+                 max_tracked_ips: int = 100000):
+        if mode not in ('aggregate', 'sample', 'off'):
+            raise ValueError(f"Unknown request audit mode: {mode}")
+        self.mode = mode
+        self.event_type = event_type
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.max_tracked_ips = max_tracked_ips
+        self._counts: Dict[Optional[str], int] = {}
+        self._window_started = time.monotonic()
+        self._window_started_at = datetime.utcnow()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], event_type: str = 'geo_check') -> 'RequestAuditor':
+        return cls(
+            mode=config['mode'],
+            event_type=event_type,
+            sample_rate=config['sample_rate'],
+            flush_interval=config['flush_interval_seconds'],
+            max_tracked_ips=config['max_tracked_ips']
+        )
+
+    def record(self, ip_address: Optional[str], user_agent: Optional[str] = None) -> None:
+        if self.mode == 'off':
+            return
+        if self.mode == 'sample':
+            if random.random() < self.sample_rate:
+                audit_service.log_security_event(
+                    event_type=self.event_type,
+                    user_id=None,
+                    action='request',
+                    resource='api',
+                    changes={'sample_rate': self.sample_rate},
+                    ip_address=ip_address,
+                    user_agent=user_agent
+                )
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self._counts[ip_address] = self._counts.get(ip_address, 0) + 1
+            if len(self._counts) < self.max_tracked_ips and now - self._window_started < self.flush_interval:
+                return
+            window = self._swap(now)
+        try:
+            # Hand the batch to a thread so the request does not pay for it
+            asyncio.get_running_loop().run_in_executor(None, self._log, *window)
+        except RuntimeError:
+            self._log(*window)
 
-    async def __call__(self, request: Request, call_next):
-        # Check for blocked IPs
-        client_ip = request.client.host
-        if client_ip in self.blocked_ips:
-            raise HTTPException(status_code=403, detail="IP address blocked")
-
-        # Geographic restrictions are handled by AWS WAF
-        # This middleware only logs the request for audit purposes
-        if self.geo_restrictions['enabled']:
-            await audit_service.log_security_event(
-                event_type='geo_check',
+    def flush(self) -> None:
+        """Log the pending per-IP counts now, e.g. at shutdown"""
+        with self._lock:
+            window = self._swap(time.monotonic())
+        self._log(*window)
+
+    def _swap(self, now: float) -> Tuple[Dict[Optional[str], int], datetime, float]:
+        window = (self._counts, self._window_started_at, now - self._window_started)
+        self._counts = {}
+        self._window_started = now
+        self._window_started_at = datetime.utcnow()
+        return window
+
+    def _log(self, counts: Dict[Optional[str], int], started_at: datetime, duration: float) -> None:
+        for ip_address, requests in counts.items():
+            audit_service.log_security_event(
+                event_type=self.event_type,
                 user_id=None,
                 action='request',
                 resource='api',
-                ip_address=client_ip,
-                user_agent=request.headers.get('user-agent')
+                changes={
+                    'requests': requests,
+                    'window_start': started_at.isoformat(),
+                    'window_seconds': round(duration, 3)
+                },
+                ip_address=ip_address
             )
 
-        # Add security headers
-        response = await call_next(request)
-        response.headers.update({
-            "X-Content-Type-Options": "nosniff",
-            "X-Frame-Options": "DENY",
-            "X-XSS-Protection": "1; mode=block",
-            "Strict-Transport-Security": "max-age=31536000; includeSubDomains",
-            "Content-Security-Policy": "default-src 'self'"
-        })
-        
-        return response
+
+request_auditor = RequestAuditor.from_config(
+    AWS_SECURITY_CONFIG['waf']['geo_restrictions']['request_audit']
+)
+# Requests from countries outside geo_restrictions, audited the same way
+geo_violation_auditor = RequestAuditor.from_config(
+    AWS_SECURITY_CONFIG['waf']['geo_restrictions']['request_audit'],
+    event_type='geo_restricted'
+)
+
+
+class SecurityMiddleware:
+    """Pure ASGI middleware for IP and country restrictions, rate limits and security headers.
+
+    Register it with ``app.add_middleware(SecurityMiddleware)``. It wraps
+    ``send`` instead of using ``call_next``, so responses are not re-buffered
+    through an extra task and streaming responses pass straight through.
+    """
+
+    def __init__(self,
+                 app: ASGIApp,
+                 auditor: Optional[RequestAuditor] = None,
+                 lists: Optional[IPLists] = None,
+                 geo_restriction: Optional[GeoRestriction] = None,
+                 rate_limiter: Optional['RateLimitMiddleware'] = None):
+        self.app = app
+        self.rate_limiter = rate_limiter or rate_limit_middleware
+        # Shared with the lifespan task that hot-reloads the block and allow lists
+        self.ip_lists = lists or ip_lists
+        self.geo_restrictions = AWS_SECURITY_CONFIG['waf']['geo_restrictions']
+        # Geographic restrictions are enforced by AWS WAF; locally they are checked
+        # against the GeoIP database when one is configured, and requests are audited
+        self.auditor = (auditor or request_auditor) if self.geo_restrictions['enabled'] else None
+        self.geo_restriction = geo_restriction or GeoRestriction.from_config(self.geo_restrictions)
+        headers = {name.decode(): value.decode() for name, value in SECURITY_HEADERS}
+        self.blocked_response = JSONResponse(
+            status_code=403,
+            content={"detail": "IP address blocked"},
+            headers=headers
+        )
+        self.geo_blocked_response = JSONResponse(
+            status_code=403,
+            content={"detail": "Access from this region is not permitted"},
+            headers=headers
+        )
+
+    @property
+    def secrets_manager(self):
+        return get_client('secretsmanager')
+
+    @property
+    def waf_client(self):
+        return get_client('wafv2')
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get('client')
+        client_ip = client[0] if client else None
+        if client_ip is not None and self.ip_lists.is_blocked(client_ip):
+            await self.blocked_response(scope, receive, send)
+            return
+
+        if self.auditor is not None:
+            self.auditor.record(client_ip)
+
+        if client_ip is not None and self.geo_restriction is not None:
+            allowed, _ = self.geo_restriction.check(client_ip)
+            if not allowed:
+                geo_violation_auditor.record(client_ip)
+                if self.geo_restriction.enforce:
+                    await self.geo_blocked_response(scope, receive, send)
+                    return
+
+        rate_limit_headers: List[Tuple[bytes, bytes]] = []
+        result = await self.rate_limiter.check_rate_limit(scope)
+        if result is not None:
+            if not result:
+                await self.rate_limiter.rejected_response(result)(scope, receive, send)
+                return
+            rate_limit_headers = result.raw_headers()
+
+        response_started = False
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+                if message['status'] >= 500:
+                    self._log_api_error(scope, client_ip, message['status'])
+                headers = [
+                    header for header in message.get('headers', ())
+                    if header[0].lower() not in _SECURITY_HEADER_NAMES
+                ]
+                headers.extend(SECURITY_HEADERS)
+                headers.extend(rate_limit_headers)
+                message['headers'] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        except Exception:
+            # An outer middleware turns the exception into the 500 response
+            if not response_started:
+                self._log_api_error(scope, client_ip, 500)
+            raise
+
+    def _log_api_error(self, scope: Scope, client_ip: Optional[str], status: int) -> None:
+        # Counted against the api_errors alarm threshold
+        audit_service.log_security_event(
+            event_type='api_error',
+            user_id=scope.get('state', {}).get('user_id'),
+            action='respond',
+            resource='api',
+            changes={'status': status, 'method': scope['method'], 'path': scope['path']},
+            ip_address=client_ip
+        )
 
 class RBACMiddleware:
-    def __init__(self):
+    def __init__(self, secrets: Optional[SecretsProvider] = None):
         self.required_permissions = {}
-        self.secrets_manager = boto3.client('secretsmanager')
-        self.jwt_secret = self._get_jwt_secret()
+        self.jwt_secret_name = AWS_SECURITY_CONFIG['secrets_manager']['jwt_secret_name']
+        cache_config = JWT_CONFIG['verified_token_cache']
+        self.token_cache_enabled = cache_config['enabled']
+        self.token_cache_max_ttl = cache_config['max_ttl_seconds']
+        # Verified claims and permission sets keyed by the SHA-256 of the token
+        self._token_cache = TTLCache(maxsize=cache_config['max_size'])
+        self._secrets: Optional[SecretsProvider] = self._attach(secrets) if secrets is not None else None
 
-    def _get_jwt_secret(self) -> str:
-        """Retrieve JWT secret from AWS Secrets Manager"""
-        try:
-            response = self.secrets_manager.get_secret_value(
-                SecretId=AWS_SECURITY_CONFIG['secrets_manager']['jwt_secret_name']
-            )
-            return response['SecretString']
-        except ClientError as e:
-            raise Exception(f"Failed to retrieve JWT secret: {str(e)}")
+    @property
+    def secrets(self) -> SecretsProvider:
+        # The JWT secret is fetched on first use (or in warm_up), not at import
+        if self._secrets is None:
+            self._secrets = self._attach(get_secrets_provider())
+        return self._secrets
+
+    def _attach(self, secrets: SecretsProvider) -> SecretsProvider:
+        secrets.on_change(self._on_secret_change)
+        return secrets
+
+    @property
+    def jwt_secret(self) -> str:
+        return self.secrets.get(self.jwt_secret_name).current
+
+    def warm_up(self) -> None:
+        """Fetch the JWT secret ahead of traffic"""
+        self.jwt_secret
+
+    def refresh_jwt_secret(self) -> None:
+        """Re-fetch the JWT secret now; cached tokens are dropped if it rotated"""
+        self.secrets.refresh(self.jwt_secret_name)
+
+    def _on_secret_change(self, name: str, versions: SecretVersions) -> None:
+        if name == self.jwt_secret_name:
+            # Tokens verified with a secret that is no longer accepted must be re-checked
+            self._token_cache.clear()
 
     def require_permissions(self, permissions: List[str]):
         def decorator(func):
@@ -72,73 +307,418 @@ class RBACMiddleware:
             return func
         return decorator
 
+    def verify_token(self, token: str) -> Tuple[Dict[str, Any], int]:
+        """Decode and verify a JWT, returning its claims and permission mask.
+
+        Verified tokens are cached until they expire, so a long-lived token
+        is only decoded once. Raises JWTError for invalid tokens.
+        """
+        if not self.token_cache_enabled:
+            claims, mask, _ = self._decode_token(token)
+            return claims, mask
+
+        cache_key = hashlib.sha256(token.encode()).digest()
+        cached = self._token_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        claims, mask, accepted_until = self._decode_token(token)
+        verified = (claims, mask)
+        ttl = self.token_cache_max_ttl
+        exp = claims.get('exp')
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+        if accepted_until is not None:
+            # Signed with the previous secret: not cached past the end of the rotation window
+            ttl = min(ttl, accepted_until - time.time())
+        if ttl > 0:
+            self._token_cache.set(cache_key, verified, ttl=ttl)
+        return verified
+
+    def _decode_token(self, token: str) -> Tuple[Dict[str, Any], int, Optional[float]]:
+        """Verify a JWT, returning its claims, permission mask and, when it was
+        signed with the previous secret, the time that secret stops being accepted.
+        """
+        # During a rotation window tokens signed with the previous secret stay valid
+        versions = self.secrets.get(self.jwt_secret_name)
+        secrets = versions.values()
+        for index, secret in enumerate(secrets):
+            try:
+                payload = jwt.decode(
+                    token,
+                    secret,
+                    algorithms=[JWT_CONFIG['algorithm']]
+                )
+                break
+            except (ExpiredSignatureError, JWTClaimsError):
+                # The signature matched, so another secret cannot help
+                raise
+            except JWTError:
+                if index == len(secrets) - 1:
+                    raise
+        encoded_mask = payload.get(JWT_CONFIG['permission_mask_claim'])
+        if encoded_mask is not None:
+            try:
+                mask = decode_mask(encoded_mask)
+            except (TypeError, ValueError):
+                raise JWTError("Malformed permission mask")
+        else:
+            # Tokens issued before masks were introduced carry a name list
+            mask = permission_registry.lenient_mask(payload.get('permissions', []))
+        return payload, mask, self.secrets.previous_until(versions) if index else None
+
     async def verify_permissions(self, 
                                credentials: HTTPAuthorizationCredentials = Security(security),
-                               required_permissions: List[str] = None) -> bool:
+                               required_permissions: List[str] = None,
+                               require_all: bool = True,
+                               ip_address: Optional[str] = None) -> bool:
+        """Whether the bearer token grants required_permissions.
+
+        Denials and invalid tokens are audited with ip_address, the client
+        the request came from. Raises HTTPException 401 for invalid tokens.
+        """
         try:
-            # Verify JWT token using secret from AWS Secrets Manager
-            payload = jwt.decode(
-                credentials.credentials,
-                self.jwt_secret,
-                algorithms=[JWT_CONFIG['algorithm']]
-            )
-            
-            # Get user permissions from token
-            user_permissions = payload.get('permissions', [])
-            
+            claims, user_mask = self.verify_token(credentials.credentials)
+
             # Check if user has required permissions
             if required_permissions:
-                return all(perm in user_permissions for perm in required_permissions)
+                required_mask = permission_registry.required_mask(frozenset(required_permissions))
+                if required_mask is None:
+                    granted = False
+                elif require_all:
+                    granted = user_mask & required_mask == required_mask
+                else:
+                    granted = user_mask & required_mask != 0
+                if not granted:
+                    audit_service.log_security_event(
+                        event_type='permission_denied',
+                        user_id=claims.get('sub'),
+                        action='authorize',
+                        resource='api',
+                        changes={'required_permissions': required_permissions},
+                        ip_address=ip_address
+                    )
+                return granted
             return True
             
         except JWTError:
+            audit_service.log_security_event(
+                event_type='unauthorized_access',
+                user_id=None,
+                action='authenticate',
+                resource='api',
+                ip_address=ip_address
+            )
             raise HTTPException(
                 status_code=401,
                 detail="Invalid authentication credentials"
             )
 
 class RateLimitMiddleware:
+    """Rate limits from RATE_LIMIT_CONFIG, checked by SecurityMiddleware on every HTTP request"""
+
     def __init__(self):
-        self.rate_limit = AWS_SECURITY_CONFIG['waf']['rate_limit']
-        self.rate_limit_window = 300  # 5 minutes in seconds
-
-    async def check_rate_limit(self, request: Request) -> bool:
-        # Rate limiting is handled by AWS WAF
-        # This middleware only logs the request for audit purposes
-        client_ip = request.client.host
-        await audit_service.log_security_event(
-            event_type='rate_limit_check',
-            user_id=None,
-            action='request',
-            resource='api',
-            ip_address=client_ip
+        self.rate_limit = RATE_LIMIT_CONFIG['limit']
+        self.rate_limit_window = RATE_LIMIT_CONFIG['window_seconds']
+        self.key_by = RATE_LIMIT_CONFIG['key_by']
+        self.api_key_header = RATE_LIMIT_CONFIG['api_key_header'].lower().encode('latin-1')
+        self.limiter = create_rate_limiter(RATE_LIMIT_CONFIG)
+        self._distributed_limiter: Optional[RedisRateLimiter] = None
+
+    @property
+    def distributed_limiter(self) -> Optional[RedisRateLimiter]:
+        """The Redis-backed limiter when RATE_LIMIT_CONFIG selects it, else None"""
+        if RATE_LIMIT_CONFIG['backend'] != 'redis':
+            return None
+        if self._distributed_limiter is None:
+            self._distributed_limiter = RedisRateLimiter.from_config(get_redis(), RATE_LIMIT_CONFIG)
+        return self._distributed_limiter
+
+    def get_rate_limit_key(self, scope: Scope) -> Optional[str]:
+        """Identify the client by IP, user ID or API key as configured; None if it has no address"""
+        if self.key_by == 'user':
+            user_id = self._verified_user_id(scope)
+            if user_id is not None:
+                # Route dependencies authenticate after this check, so the audits read it from here
+                scope.setdefault('state', {})['user_id'] = user_id
+                return f"user:{user_id}"
+        elif self.key_by == 'api_key':
+            for name, value in scope['headers']:
+                if name == self.api_key_header and value:
+                    return f"api_key:{value.decode('latin-1')}"
+        client = scope.get('client')
+        return f"ip:{client[0]}" if client else None
+
+    def _verified_user_id(self, scope: Scope) -> Optional[str]:
+        """The subject of a valid bearer token, or None for anonymous or invalid requests"""
+        for name, value in scope['headers']:
+            if name == b'authorization':
+                scheme, _, token = value.decode('latin-1').partition(' ')
+                if scheme.lower() != 'bearer' or not token:
+                    return None
+                try:
+                    claims, _ = rbac_middleware.verify_token(token.strip())
+                except JWTError:
+                    return None
+                user_id = claims.get('sub')
+                return str(user_id) if user_id is not None else None
+        return None
+
+    async def check_rate_limit(self, scope: Scope) -> Optional[RateLimitResult]:
+        """Count the request against its client's limit; None when the client cannot be identified"""
+        # Enforced locally as well as by AWS WAF; only rejections are audited
+        key = self.get_rate_limit_key(scope)
+        if key is None:
+            return None
+        distributed_limiter = self.distributed_limiter
+        if distributed_limiter is not None:
+            result = await distributed_limiter.hit(key)
+        else:
+            result = self.limiter.hit(key)
+        if not result:
+            client = scope.get('client')
+            audit_service.log_security_event(
+                event_type='rate_limit_exceeded',
+                user_id=scope.get('state', {}).get('user_id'),
+                action='request',
+                resource='api',
+                ip_address=client[0] if client else None
+            )
+        return result
+
+    def rejected_response(self, result: RateLimitResult) -> JSONResponse:
+        headers = {name.decode(): value.decode() for name, value in SECURITY_HEADERS}
+        headers.update(result.headers())
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Rate limit exceeded"},
+            headers=headers
+        )
+
+class DataProcessingLog:
+    """Log data processing as periodic counts instead of one event per call.
+
+    Calls are counted per user, data type and purpose, and one GDPR event
+    per combination is logged every flush interval (or sooner, once
+    ``max_pending`` combinations are pending).
+    """
+
+    def __init__(self, flush_interval: float = 60.0, max_pending: int = 100000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._counts: Dict[Tuple[str, str, str], int] = {}
+        self._window_started = time.monotonic()
+        self._window_started_at = datetime.utcnow()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'DataProcessingLog':
+        return cls(
+            flush_interval=config['flush_interval_seconds'],
+            max_pending=config['max_pending']
         )
-        return True
+
+    def record(self, user_id: str, data_type: str, processing_purpose: str) -> None:
+        key = (user_id, data_type, processing_purpose)
+        now = time.monotonic()
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if len(self._counts) < self.max_pending and now - self._window_started < self.flush_interval:
+                return
+            window = self._swap(now)
+        try:
+            # Hand the batch to a thread so the request does not pay for it
+            asyncio.get_running_loop().run_in_executor(None, self._log, *window)
+        except RuntimeError:
+            self._log(*window)
+
+    def flush(self) -> None:
+        """Log the pending counts now, e.g. at shutdown"""
+        with self._lock:
+            window = self._swap(time.monotonic())
+        self._log(*window)
+
+    def _swap(self, now: float) -> Tuple[Dict[Tuple[str, str, str], int], datetime, float]:
+        window = (self._counts, self._window_started_at, now - self._window_started)
+        self._counts = {}
+        self._window_started = now
+        self._window_started_at = datetime.utcnow()
+        return window
+
+    def _log(self, counts: Dict[Tuple[str, str, str], int], started_at: datetime, duration: float) -> None:
+        for (user_id, data_type, processing_purpose), operations in counts.items():
+            audit_service.log_gdpr_event(
+                event_type='data_processing',
+                user_id=user_id,
+                action='process_data',
+                data_type=data_type,
+                details={
+                    'purpose': processing_purpose,
+                    'operations': operations,
+                    'window_start': started_at.isoformat(),
+                    'window_seconds': round(duration, 3)
+                }
+            )
+
 
 class GDPRComplianceMiddleware:
     def __init__(self):
-        self.consent_required = True
-        self.data_retention_period = 365  # days
+        self.consent_required = GDPR_CONFIG['consent_required']
+        self.data_retention_period = GDPR_CONFIG['data_retention_period']  # days
+        self.default_consent_type = GDPR_CONFIG['consent']['default_type']
+        self.processing_log = DataProcessingLog.from_config(GDPR_CONFIG['processing_log'])
 
-    async def check_consent(self, request: Request) -> bool:
-        # Check if user has given consent for data processing
-        consent_header = request.headers.get('X-Data-Processing-Consent')
-        return consent_header == 'true'
+    async def check_consent(self, request: Request, consent_type: Optional[str] = None) -> bool:
+        """Whether the authenticated user holds an active consent in the consent store.
+
+        A memory lookup once the user's consents are cached; unauthenticated
+        requests have no consent.
+        """
+        if not self.consent_required:
+            return True
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return False
+        try:
+            claims, _ = rbac_middleware.verify_token(token)
+        except JWTError:
+            return False
+        user_id = claims.get('sub')
+        if user_id is None:
+            return False
+        return await consent_cache.check(str(user_id), consent_type or self.default_consent_type)
 
     async def log_data_processing(self, 
                                 user_id: str,
                                 data_type: str,
                                 processing_purpose: str) -> None:
-        await audit_service.log_gdpr_event(
-            event_type='data_processing',
-            user_id=user_id,
-            action='process_data',
-            data_type=data_type,
-            details={'purpose': processing_purpose}
-        )
+        self.processing_log.record(user_id, data_type, processing_purpose)
 
 # Create middleware instances
-security_middleware = SecurityMiddleware()
 rbac_middleware = RBACMiddleware()
 rate_limit_middleware = RateLimitMiddleware()
-gdpr_middleware = GDPRComplianceMiddleware() 
\ No newline at end of file
+gdpr_middleware = GDPRComplianceMiddleware()
+
+
+def benchmark(requests: int, clients: int, blocked_entries: int) -> Dict[str, Any]:
+    """Time direct ASGI calls to a bare app with and without SecurityMiddleware"""
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'ok'})
+
+    async def receive() -> Message:
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message: Message) -> None:
+        pass
+
+    rng = random.Random(0)
+    # Blocked /24s below 100.0.0.0, clients in 100.64.0.0/10, so every request is allowed
+    lists = IPLists(blocked=[
+        f"{rng.randrange(1, 100)}.{rng.randrange(256)}.{rng.randrange(256)}.0/24"
+        for _ in range(blocked_entries)
+    ])
+    rate_limiter = RateLimitMiddleware()
+    rate_limiter.limiter = create_rate_limiter({**RATE_LIMIT_CONFIG, 'backend': 'local', 'limit': requests + 1})
+    rate_limiter._distributed_limiter = None
+    # Aggregated with no flush, so requests are counted but never logged
+    auditor = RequestAuditor(flush_interval=float('inf'), max_tracked_ips=clients + 1)
+    middleware = SecurityMiddleware(app, auditor=auditor, lists=lists, rate_limiter=rate_limiter)
+    scopes = [
+        {'type': 'http', 'client': (f"100.{64 + (i >> 16 & 63)}.{i >> 8 & 255}.{i & 255}", 50000),
+         'headers': [], 'state': {}}
+        for i in range(clients)
+    ]
+    stream = [scopes[rng.randrange(clients)] for _ in range(requests)]
+
+    async def run(handler: ASGIApp) -> float:
+        started = time.perf_counter()
+        for scope in stream:
+            await handler(scope, receive, send)
+        return time.perf_counter() - started
+
+    bare = asyncio.run(run(app))
+    wrapped = asyncio.run(run(middleware))
+    return {
+        'requests': requests,
+        'blocked_entries': len(lists.blocklist),
+        'bare_microseconds_per_request': round(bare / requests * 1e6, 2),
+        'middleware_microseconds_per_request': round(wrapped / requests * 1e6, 2),
+        'overhead_microseconds_per_request': round((wrapped - bare) / requests * 1e6, 2),
+    }
+
+
+class _FixedSecretBackend:
+    """Secrets backend serving one JWT secret, for the token benchmark"""
+
+    def __init__(self, secret: str):
+        self.secret = secret
+
+    def fetch(self, name: str) -> SecretVersions:
+        return SecretVersions(self.secret)
+
+
+def token_benchmark(checks: int, tokens: int) -> Dict[str, Any]:
+    """Per-call latency of verify_permissions (decode + check) with the verified-token cache off and on"""
+    secret = 'benchmark-secret'
+    required = ['manage_compliance']
+    rng = random.Random(0)
+    roles = list(UserRole)
+    expires = int(time.time()) + 3600
+    # Every token grants the required permission, so no denial is audited
+    credentials = [
+        HTTPAuthorizationCredentials(scheme='Bearer', credentials=jwt.encode(
+            {'sub': f"user-{i}", 'exp': expires, **permission_claims(rng.choice(roles), required)},
+            secret,
+            algorithm=JWT_CONFIG['algorithm']
+        ))
+        for i in range(tokens)
+    ]
+    stream = [credentials[rng.randrange(tokens)] for _ in range(checks)]
+
+    async def run(rbac: RBACMiddleware) -> List[float]:
+        samples = []
+        for item in stream:
+            started = time.perf_counter()
+            if not await rbac.verify_permissions(item, required):
+                raise RuntimeError("Benchmark token was denied")
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    result: Dict[str, Any] = {'checks': checks, 'tokens': tokens}
+    for label, cache_enabled in (('uncached', False), ('cached', True)):
+        provider = SecretsProvider(_FixedSecretBackend(secret))
+        rbac = RBACMiddleware(provider)
+        rbac.token_cache_enabled = cache_enabled
+        try:
+            samples = sorted(asyncio.run(run(rbac)))
+        finally:
+            provider.close()
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        result[f'{label}_p50_microseconds'] = round(samples[len(samples) // 2] * 1e6, 2)
+        result[f'{label}_p99_microseconds'] = round(p99 * 1e6, 2)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark SecurityMiddleware and RBAC token checks")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help="Measure middleware overhead per request")
+    bench_parser.add_argument('--requests', type=int, default=200000)
+    bench_parser.add_argument('--clients', type=int, default=10000)
+    bench_parser.add_argument('--blocked-entries', type=int, default=10000)
+    tokens_parser = commands.add_parser('tokens', help="Measure JWT decode + permission check latency at p50/p99")
+    tokens_parser.add_argument('--checks', type=int, default=100000)
+    tokens_parser.add_argument('--tokens', type=int, default=1000, help="distinct tokens the checks cycle through")
+    args = parser.parse_args()
+
+    if args.command == 'tokens':
+        result = token_benchmark(args.checks, args.tokens)
+    else:
+        result = benchmark(args.requests, args.clients, args.blocked_entries)
+    for name, value in result.items():
+        print(f"{name}\t{value}")
+
+
+if __name__ == '__main__':
+    main() 
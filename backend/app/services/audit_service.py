@@ -1,18 +1,116 @@
-import boto3
+import asyncio
 import json
+import logging
+import threading
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional, List
+from typing import Any, Dict, FrozenSet, Iterator, Optional, List, Tuple
 from botocore.exceptions import ClientError
+from redis.exceptions import RedisError
 
-from app.core.security_config import AUDIT_CONFIG, GDPR_CONFIG
+from app.core.aws import get_client
+from app.core.security_config import AUDIT_CONFIG, AWS_SECURITY_CONFIG, GDPR_CONFIG
+from app.services.audit_shipper import AuditLogShipper
+from app.services.audit_store import AuditStore
+from app.services.consent_store import consent_cache
+from app.services.gdpr_export import ExportSource, GDPRExporter, ProgressCallback
+from app.services.s3_export import S3ExportUploader
+from app.services.security_aggregator import SecurityAlert, SecurityEventAggregator
+
+logger = logging.getLogger(__name__)
 
 class AuditService:
     def __init__(self):
-        self.cloudwatch = boto3.client('cloudwatch')
-        self.cloudtrail = boto3.client('cloudtrail')
+        # AWS clients and the log shipper are created on first use
+        self._logs = None
+        self._cloudwatch = None
+        self._cloudtrail = None
+        self._shipper: Optional[AuditLogShipper] = None
+        self._shipper_lock = threading.Lock()
+        self._aggregator: Optional[SecurityEventAggregator] = None
+        self._store: Optional[AuditStore] = None
+        self.store_config = AUDIT_CONFIG['store']
         self.log_group_name = AUDIT_CONFIG['log_group_name']
         # Initialize database clients (placeholder)
         self.db_client = None  # TODO: Initialize database client
+
+    @property
+    def logs(self):
+        """CloudWatch Logs client, for shipping and querying audit events"""
+        if self._logs is None:
+            self._logs = get_client('logs')
+        return self._logs
+
+    @property
+    def cloudwatch(self):
+        """CloudWatch client, for security metrics"""
+        if self._cloudwatch is None:
+            self._cloudwatch = get_client('cloudwatch')
+        return self._cloudwatch
+
+    @property
+    def cloudtrail(self):
+        if self._cloudtrail is None:
+            self._cloudtrail = get_client('cloudtrail')
+        return self._cloudtrail
+
+    @property
+    def store(self) -> Optional[AuditStore]:
+        """The Postgres audit store, or None when AUDIT_CONFIG disables it"""
+        if self._store is None and self.store_config['enabled']:
+            # The engine is imported on first use so importing this module needs no database
+            from app.db.database import engine
+
+            self._store = AuditStore(
+                engine,
+                premake_days=self.store_config['partition_premake_days'],
+                retention_days=GDPR_CONFIG['data_retention_period']
+            )
+        return self._store
+
+    @property
+    def shipper(self) -> AuditLogShipper:
+        if self._shipper is None:
+            with self._shipper_lock:
+                if self._shipper is None:
+                    store = self.store
+                    self._shipper = AuditLogShipper.from_config(
+                        self.logs,
+                        self.log_group_name,
+                        sinks=[store.write_batch] if store is not None else None
+                    )
+        return self._shipper
+
+    @property
+    def aggregator(self) -> SecurityEventAggregator:
+        """Sliding-window counts of security events against the CloudWatch alarm thresholds"""
+        if self._aggregator is None:
+            with self._shipper_lock:
+                if self._aggregator is None:
+                    aggregator = SecurityEventAggregator.from_config(self.cloudwatch)
+                    aggregator.on_alert(self._log_alert)
+                    self._aggregator = aggregator
+        return self._aggregator
+
+    def warm_up(self) -> None:
+        """Create the AWS clients and start the log shipper ahead of traffic"""
+        self.cloudtrail
+        self.shipper.start()
+        if self.store is not None:
+            self.store.create_schema()
+
+    def maintain_store(self) -> None:
+        """Create upcoming audit partitions and drop those past GDPR retention"""
+        if self.store is not None:
+            self.store.maintain()
+
+    async def run_store_maintenance(self) -> None:
+        """Run maintain_store periodically; runs until cancelled"""
+        while self.store is not None:
+            try:
+                await asyncio.to_thread(self.maintain_store)
+            except Exception as e:
+                logger.warning("Audit store maintenance failed: %s", e)
+            await asyncio.sleep(self.store_config['maintenance_interval_seconds'])
         
     def log_security_event(self, 
                           event_type: str,
@@ -22,7 +120,7 @@ class AuditService:
                           changes: Optional[Dict[str, Any]] = None,
                           ip_address: Optional[str] = None,
                           user_agent: Optional[str] = None) -> None:
-        """Log a security event to CloudWatch"""
+        """Queue a security event for shipping to CloudWatch"""
         log_entry = {
             'timestamp': datetime.utcnow().isoformat(),
             'event_type': event_type,
@@ -34,17 +132,79 @@ class AuditService:
             'user_agent': user_agent
         }
         
+        self.shipper.enqueue(
+            f"security-{datetime.utcnow().strftime('%Y-%m-%d')}",
+            json.dumps(log_entry)
+        )
+        # Counted after queueing so alarms are logged after the event that raised them
+        self.aggregator.record(event_type, user_id, ip_address)
+
+    async def listen_for_security_events(self) -> None:
+        """Log security events other services publish over Redis; runs until cancelled"""
+        from app.core.config import settings
+        from app.core.redis import get_pubsub_redis
+
+        aggregation = AWS_SECURITY_CONFIG['cloudwatch']['aggregation']
+        accepted = frozenset(aggregation['remote_event_types'])
+        while True:
+            client = get_pubsub_redis()
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(aggregation['event_channel'])
+                    while True:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True,
+                            timeout=settings.REDIS_HEALTH_CHECK_INTERVAL
+                        )
+                        if message is not None:
+                            self.log_remote_event(message['data'], accepted)
+            except RedisError:
+                logger.warning("Security event subscription lost; reconnecting")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+    def log_remote_event(self, data: Any, accepted: FrozenSet[str]) -> None:
+        """Log one JSON security event published by another service if its type is accepted"""
         try:
-            self.cloudwatch.put_log_events(
-                logGroupName=self.log_group_name,
-                logStreamName=f"security-{datetime.utcnow().strftime('%Y-%m-%d')}",
-                logEvents=[{
-                    'timestamp': int(datetime.utcnow().timestamp() * 1000),
-                    'message': json.dumps(log_entry)
-                }]
-            )
-        except ClientError as e:
-            raise Exception(f"Failed to log security event: {str(e)}")
+            event = json.loads(data)
+            event_type = event['event_type']
+        except (TypeError, ValueError, KeyError):
+            logger.warning("Ignoring a malformed security event")
+            return
+        if event_type not in accepted:
+            logger.warning("Ignoring a %s security event from another service", event_type)
+            return
+        self.log_security_event(
+            event_type=event_type,
+            user_id=event.get('user_id'),
+            action=event.get('action', 'unknown'),
+            resource=event.get('resource', 'unknown'),
+            changes=event.get('changes'),
+            ip_address=event.get('ip_address'),
+            user_agent=event.get('user_agent')
+        )
+
+    def _log_alert(self, alert: SecurityAlert) -> None:
+        # security_alarm is not counted by any threshold, so this cannot alert again
+        logger.warning(
+            "Security alarm %s: %d events for %s %s within %ds",
+            alert.threshold_name, alert.count, alert.scope, alert.key, alert.window_seconds
+        )
+        self.log_security_event(
+            event_type='security_alarm',
+            user_id=alert.key if alert.scope == 'user' else None,
+            action='threshold_exceeded',
+            resource=alert.threshold_name,
+            changes={
+                'scope': alert.scope,
+                'count': alert.count,
+                'threshold': alert.threshold,
+                'window_seconds': alert.window_seconds,
+                'event_type': alert.event_type,
+            },
+            ip_address=alert.key if alert.scope == 'ip' else None
+        )
 
     def log_gdpr_event(self, 
                       event_type: str,
@@ -52,7 +212,7 @@ class AuditService:
                       action: str,
                       data_type: str,
                       details: Dict[str, Any]) -> None:
-        """Log GDPR-related events"""
+        """Queue a GDPR-related event for shipping to CloudWatch"""
         log_entry = {
             'timestamp': datetime.utcnow().isoformat(),
             'event_type': event_type,
@@ -63,43 +223,178 @@ class AuditService:
             'gdpr_compliance': True
         }
         
-        try:
-            self.cloudwatch.put_log_events(
-                logGroupName=self.log_group_name,
-                logStreamName=f"gdpr-{datetime.utcnow().strftime('%Y-%m-%d')}",
-                logEvents=[{
-                    'timestamp': int(datetime.utcnow().timestamp() * 1000),
-                    'message': json.dumps(log_entry)
-                }]
-            )
-        except ClientError as e:
-            raise Exception(f"Failed to log GDPR event: {str(e)}")
+        self.shipper.enqueue(
+            f"gdpr-{datetime.utcnow().strftime('%Y-%m-%d')}",
+            json.dumps(log_entry)
+        )
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until all queued audit events have been shipped"""
+        return self.shipper.flush(timeout)
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """Publish pending security metrics, flush queued audit events and stop the shipper"""
+        if self._aggregator is not None:
+            self._aggregator.publish()
+        if self._shipper is not None:
+            self._shipper.close(timeout)
+
+    def get_shipper_stats(self) -> Dict[str, int]:
+        """Get queued, sent, dropped and in-flight audit event counts"""
+        return self.shipper.stats()
 
     def get_user_activity_log(self, 
                             user_id: str,
                             start_time: datetime,
                             end_time: datetime) -> list:
         """Retrieve user activity logs for a specific time period"""
+        if self.store is not None:
+            return list(self.store.iter_user_activity(user_id, start_time, end_time))
+        return list(self._filter_log_events(user_id, start_time, end_time))
+
+    def get_user_activity_page(self,
+                               user_id: str,
+                               start_time: datetime,
+                               end_time: datetime,
+                               cursor: Optional[str] = None,
+                               limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Retrieve one page of user activity, newest first, and the cursor of the next page.
+
+        Raises ValueError for a malformed cursor.
+        """
+        if self.store is None:
+            raise RuntimeError("Paginated activity queries require the audit store")
+        return self.store.get_user_activity(
+            user_id, start_time, end_time, cursor, limit or self.store_config['page_size']
+        )
+
+    def _filter_log_events(self, user_id: str, start_time: datetime, end_time: datetime):
+        """Scan CloudWatch for a user's events, following every result page"""
+        params = {
+            'logGroupName': self.log_group_name,
+            'startTime': int(start_time.timestamp() * 1000),
+            'endTime': int(end_time.timestamp() * 1000),
+            'filterPattern': f'{{$.user_id = "{user_id}"}}'
+        }
         try:
-            response = self.cloudwatch.filter_log_events(
-                logGroupName=self.log_group_name,
-                startTime=int(start_time.timestamp() * 1000),
-                endTime=int(end_time.timestamp() * 1000),
-                filterPattern=f'{{$.user_id = "{user_id}"}}'
-            )
-            return [json.loads(event['message']) for event in response['events']]
+            for page in self.logs.get_paginator('filter_log_events').paginate(**params):
+                for event in page['events']:
+                    yield json.loads(event['message'])
         except ClientError as e:
             raise Exception(f"Failed to retrieve user activity logs: {str(e)}")
 
+    def export_sources(self, user_id: str, window_end: datetime) -> Dict[str, ExportSource]:
+        """Lazy, fully paginated readers of every kind of data held about a user"""
+        def personal_info() -> Iterator[Dict[str, Any]]:
+            yield self._get_user_personal_info(user_id)
+
+        def activity_logs() -> Iterator[Dict[str, Any]]:
+            start_time = window_end - timedelta(days=30)
+            if self.store is not None:
+                return self.store.iter_user_activity(user_id, start_time, window_end)
+            return self._filter_log_events(user_id, start_time, window_end)
+
+        def consent_records() -> Iterator[Dict[str, Any]]:
+            yield from self._get_user_consent_records(user_id)
+
+        def data_processing_records() -> Iterator[Dict[str, Any]]:
+            return self._iter_data_processing_records(
+                user_id, window_end - timedelta(days=90), window_end
+            )
+
+        return {
+            'personal_info': personal_info,
+            'activity_logs': activity_logs,
+            'consent_records': consent_records,
+            'data_processing_records': data_processing_records,
+        }
+
+    def stream_user_data_export(self,
+                                user_id: str,
+                                output_path: str,
+                                checkpoint_path: Optional[str] = None,
+                                progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Export all user data as gzipped JSON Lines, resumable from checkpoint_path.
+
+        Sources are read concurrently and streamed to output_path in
+        constant memory; see GDPRExporter. Returns the final progress report.
+        """
+        exporter = GDPRExporter.from_config(
+            lambda window_end: self.export_sources(user_id, window_end)
+        )
+        try:
+            report = exporter.export(user_id, output_path, checkpoint_path, progress)
+        except Exception as e:
+            raise Exception(f"Failed to export user data: {str(e)}")
+
+        self.log_gdpr_event(
+            event_type='data_export',
+            user_id=user_id,
+            action='export_user_data',
+            data_type='all',
+            details={
+                'export_format': 'jsonl.gz',
+                'records': report['records'],
+                'unavailable_sources': report['unavailable_sources']
+            }
+        )
+        return report
+
+    def export_user_data_to_s3(self,
+                               user_id: str,
+                               checkpoint_path: Optional[str] = None,
+                               progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Export all user data to AWS_S3_BUCKET, resumable from checkpoint_path.
+
+        The export is uploaded as it is produced, without a local copy; see
+        S3ExportUploader. Returns the final progress report with the object
+        key and a presigned download URL.
+        """
+        # Settings are read on first use so importing this module needs no environment
+        from app.core.config import settings
+
+        if not settings.AWS_S3_BUCKET:
+            raise ValueError("AWS_S3_BUCKET is not configured")
+        uploader = S3ExportUploader.from_config(
+            get_client('s3', settings.AWS_S3_ENDPOINT_URL),
+            settings.AWS_S3_BUCKET
+        )
+        exporter = GDPRExporter.from_config(
+            lambda window_end: self.export_sources(user_id, window_end)
+        )
+        try:
+            report = uploader.export(exporter, user_id, checkpoint_path, progress)
+        except Exception as e:
+            raise Exception(f"Failed to export user data: {str(e)}") from e
+
+        self.log_gdpr_event(
+            event_type='data_export',
+            user_id=user_id,
+            action='export_user_data',
+            data_type='all',
+            details={
+                'export_format': 'jsonl.gz',
+                'records': report['records'],
+                'unavailable_sources': report['unavailable_sources'],
+                'location': f"s3://{report['bucket']}/{report['key']}"
+            }
+        )
+        return report
+
     def export_user_data(self, user_id: str) -> Dict[str, Any]:
-        """Export all user data for GDPR compliance"""
+        """Export all user data for GDPR compliance.
+
+        Builds the whole export in memory; use stream_user_data_export for
+        users with large histories.
+        """
         try:
             # Get user data from various sources
+            sources = self.export_sources(user_id, datetime.utcnow())
             user_data = {
-                'personal_info': self._get_user_personal_info(user_id),
-                'activity_logs': self._get_user_activity_logs(user_id),
-                'consent_records': self._get_user_consent_records(user_id),
-                'data_processing_records': self._get_data_processing_records(user_id)
+                'personal_info': next(sources['personal_info']()),
+                'activity_logs': list(sources['activity_logs']()),
+                'consent_records': list(sources['consent_records']()),
+                'data_processing_records': list(sources['data_processing_records']())
             }
             
             # Log the data export
@@ -115,24 +410,46 @@ class AuditService:
         except Exception as e:
             raise Exception(f"Failed to export user data: {str(e)}")
 
-    def delete_user_data(self, user_id: str) -> None:
-        """Delete all user data for GDPR right to be forgotten"""
+    def delete_user_data(self, user_id: str, progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Delete all user data for GDPR right to be forgotten.
+
+        Runs for as long as the deletions take, so requests should enqueue
+        a gdpr_deletion job instead of calling this directly. A store whose
+        deletion is not implemented yet is skipped and named in the
+        returned report's unavailable_steps, so the other stores are still
+        erased.
+        """
+        steps = [
+            ('personal_info', self._delete_user_personal_info),
+            ('activity_logs', self._delete_user_activity_logs),
+            ('consent_records', self._delete_user_consent_records),
+        ]
+        unavailable: List[str] = []
         try:
             # Delete user data from various sources
-            self._delete_user_personal_info(user_id)
-            self._delete_user_activity_logs(user_id)
-            self._delete_user_consent_records(user_id)
-            
+            for completed, (name, delete) in enumerate(steps):
+                if progress is not None:
+                    progress({'user_id': user_id, 'step': name, 'completed_steps': completed, 'total_steps': len(steps)})
+                try:
+                    delete(user_id)
+                except NotImplementedError:
+                    unavailable.append(name)
+
             # Log the data deletion
             self.log_gdpr_event(
                 event_type='data_deletion',
                 user_id=user_id,
                 action='delete_user_data',
                 data_type='all',
-                details={'reason': 'GDPR right to be forgotten request'}
+                details={'reason': 'GDPR right to be forgotten request', 'unavailable_steps': unavailable}
             )
         except Exception as e:
-            raise Exception(f"Failed to delete user data: {str(e)}")
+            raise Exception(f"Failed to delete user data: {str(e)}") from e
+        return {
+            'user_id': user_id,
+            'completed_steps': [name for name, _ in steps if name not in unavailable],
+            'unavailable_steps': unavailable,
+        }
 
     def _get_user_personal_info(self, user_id: str) -> Dict[str, Any]:
         """Get user personal information from the database"""
@@ -149,53 +466,39 @@ class AuditService:
         raise NotImplementedError("Method _get_user_personal_info not implemented")
 
     def _get_user_activity_logs(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get user activity logs from CloudWatch"""
-        try:
-            # Get logs from the last 30 days
-            end_time = datetime.utcnow()
-            start_time = end_time - timedelta(days=30)
-            
-            response = self.cloudwatch.filter_log_events(
-                logGroupName=self.log_group_name,
-                startTime=int(start_time.timestamp() * 1000),
-                endTime=int(end_time.timestamp() * 1000),
-                filterPattern=f'{{$.user_id = "{user_id}"}}'
-            )
-            
-            return [json.loads(event['message']) for event in response['events']]
-        except ClientError as e:
-            raise Exception(f"Failed to retrieve user activity logs: {str(e)}")
+        """Get user activity logs from the audit store (or CloudWatch without one)"""
+        # Get logs from the last 30 days
+        end_time = datetime.utcnow()
+        start_time = end_time - timedelta(days=30)
+        return self.get_user_activity_log(user_id, start_time, end_time)
 
     def _get_user_consent_records(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get user consent records from the database"""
-        # TODO: Implement database query to retrieve user consent records
-        # Example structure:
-        # [
-        #     {
-        #         "id": "consent_id",
-        #         "user_id": user_id,
-        #         "consent_type": "data_processing",
-        #         "granted_at": "2024-01-01T00:00:00Z",
-        #         "expires_at": "2025-01-01T00:00:00Z",
-        #         "status": "active"
-        #     }
-        # ]
-        raise NotImplementedError("Method _get_user_consent_records not implemented")
+        """Get every consent grant of the user, with its status, from the consent store"""
+        return consent_cache.store.get_records(user_id)
 
     def _get_data_processing_records(self, user_id: str) -> List[Dict[str, Any]]:
         """Get data processing records from CloudTrail"""
+        end_time = datetime.utcnow()
+        return list(self._iter_data_processing_records(user_id, end_time - timedelta(days=90), end_time))
+
+    def _iter_data_processing_records(self,
+                                      user_id: str,
+                                      start_time: datetime,
+                                      end_time: datetime) -> Iterator[Dict[str, Any]]:
+        """Yield CloudTrail events for a user, following every result page"""
         try:
-            response = self.cloudtrail.lookup_events(
+            pages = self.cloudtrail.get_paginator('lookup_events').paginate(
                 LookupAttributes=[
                     {
                         'AttributeKey': 'ResourceName',
                         'AttributeValue': f'user/{user_id}'
                     }
                 ],
-                StartTime=datetime.utcnow() - timedelta(days=90),
-                EndTime=datetime.utcnow()
+                StartTime=start_time,
+                EndTime=end_time
             )
-            return response['Events']
+            for page in pages:
+                yield from page['Events']
         except ClientError as e:
             raise Exception(f"Failed to retrieve data processing records: {str(e)}")
 
@@ -211,37 +514,41 @@ class AuditService:
         raise NotImplementedError("Method _delete_user_personal_info not implemented")
 
     def _delete_user_activity_logs(self, user_id: str) -> None:
-        """Delete user activity logs from CloudWatch"""
-        try:
-            # Create a new log stream for deletion records
-            deletion_stream = f"deletion-{datetime.utcnow().strftime('%Y-%m-%d')}"
-            
-            # Log the deletion operation
-            self.cloudwatch.put_log_events(
-                logGroupName=self.log_group_name,
-                logStreamName=deletion_stream,
-                logEvents=[{
-                    'timestamp': int(datetime.utcnow().timestamp() * 1000),
-                    'message': json.dumps({
-                        'event_type': 'data_deletion',
-                        'user_id': user_id,
-                        'data_type': 'activity_logs',
-                        'timestamp': datetime.utcnow().isoformat()
-                    })
-                }]
-            )
-        except ClientError as e:
-            raise Exception(f"Failed to delete user activity logs: {str(e)}")
+        """Delete user activity logs from the audit store.
+
+        CloudWatch log events cannot be deleted one by one; they age out
+        with the log group's retention.
+        """
+        deleted = 0
+        if self.store is not None:
+            # Events still queued for the user would otherwise be stored after the delete
+            if not self.flush():
+                raise Exception("Timed out flushing queued audit events before deletion")
+            deleted = self.store.delete_user(user_id)
+        # Record the deletion operation in its own log stream
+        deletion_stream = f"deletion-{datetime.utcnow().strftime('%Y-%m-%d')}"
+        self.shipper.enqueue(
+            deletion_stream,
+            json.dumps({
+                'event_type': 'data_deletion',
+                'user_id': user_id,
+                'data_type': 'activity_logs',
+                'records_deleted': deleted,
+                'timestamp': datetime.utcnow().isoformat()
+            })
+        )
 
     def _delete_user_consent_records(self, user_id: str) -> None:
-        """Delete user consent records from the database"""
-        # TODO: Implement database query to delete user consent records
-        # Steps:
-        # 1. Get all consent records for the user
-        # 2. Archive consent records (for compliance)
-        # 3. Delete active consent records
-        # 4. Log deletion operation
-        raise NotImplementedError("Method _delete_user_consent_records not implemented")
+        """Delete user consent records from the consent store"""
+        deleted = consent_cache.delete_user(user_id)
+        # The deletion itself is the compliance record; the grants are not kept
+        self.log_gdpr_event(
+            event_type='data_deletion',
+            user_id=user_id,
+            action='delete_consent_records',
+            data_type='consent_records',
+            details={'records_deleted': deleted}
+        )
 
 # Create a singleton instance
 audit_service = AuditService() 
\ No newline at end of file
@@ -0,0 +1,388 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from app.core.security_config import AUDIT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# CloudWatch Logs PutLogEvents limits
+MAX_BATCH_EVENTS = 10000
+MAX_BATCH_BYTES = 1048576
+EVENT_OVERHEAD_BYTES = 26
+MAX_EVENT_BYTES = 262144 - EVENT_OVERHEAD_BYTES
+MAX_BATCH_SPAN_MS = 24 * 60 * 60 * 1000
+
+BACKPRESSURE_MODES = ('drop', 'block', 'spill')
+
+# (log stream name, timestamp in ms, message)
+LogEvent = Tuple[str, int, str]
+# Receives each stream's batch of (timestamp in ms, message) alongside CloudWatch
+AuditSink = Callable[[str, List[Tuple[int, str]]], None]
+
+_FLUSH = object()
+_STOP = object()
+
+
+class AuditLogShipper:
+    """Ship audit log events to CloudWatch Logs from a background worker.
+
+    Events are put on a bounded in-process queue and sent in batches per log
+    stream once a batch reaches its event count or byte size limit, or once
+    the oldest pending event is older than the flush interval. Each batch
+    is also passed to every sink, e.g. the Postgres audit store; a failing
+    sink is counted but never blocks CloudWatch delivery.
+    """
+
+    def __init__(self,
+                 client: Any,
+                 log_group_name: str,
+                 max_queue_size: int = 10000,
+                 batch_max_events: int = 1000,
+                 batch_max_bytes: int = MAX_BATCH_BYTES,
+                 flush_interval: float = 2.0,
+                 backpressure: str = 'drop',
+                 block_timeout: float = 0.05,
+                 spill_path: Optional[str] = None,
+                 max_retries: int = 3,
+                 sinks: Optional[List[AuditSink]] = None):
+        if backpressure not in BACKPRESSURE_MODES:
+            raise ValueError(f"Unknown backpressure mode: {backpressure}")
+        if backpressure == 'spill' and not spill_path:
+            raise ValueError("spill_path is required for the 'spill' backpressure mode")
+
+        self.client = client
+        self.log_group_name = log_group_name
+        self.batch_max_events = min(batch_max_events, MAX_BATCH_EVENTS)
+        self.batch_max_bytes = min(batch_max_bytes, MAX_BATCH_BYTES)
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.max_retries = max_retries
+        self.sinks = list(sinks or [])
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+        # Whether close is registered to run at interpreter exit
+        self._exit_hook = False
+        self._counters = {
+            'queued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'failed': 0,
+            'spilled': 0,
+            'in_flight': 0,
+            'sink_failed': 0,
+        }
+
+    @classmethod
+    def from_config(cls,
+                    client: Any,
+                    log_group_name: str,
+                    sinks: Optional[List[AuditSink]] = None) -> 'AuditLogShipper':
+        """Build a shipper from AUDIT_CONFIG['shipper']"""
+        config = AUDIT_CONFIG['shipper']
+        return cls(
+            client=client,
+            log_group_name=log_group_name,
+            max_queue_size=config['max_queue_size'],
+            batch_max_events=config['batch_max_events'],
+            batch_max_bytes=config['batch_max_bytes'],
+            flush_interval=config['flush_interval_seconds'],
+            backpressure=config['backpressure'],
+            block_timeout=config['block_timeout_seconds'],
+            spill_path=config['spill_path'],
+            max_retries=config['max_retries'],
+            sinks=sinks,
+        )
+
+    def start(self) -> None:
+        """Start the background worker if it is not running yet"""
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._closed = False
+            self._worker = threading.Thread(
+                target=self._run, name='audit-log-shipper', daemon=True
+            )
+            self._worker.start()
+            # Once per shipper, however often a dead worker is restarted
+            if not self._exit_hook:
+                atexit.register(self.close)
+                self._exit_hook = True
+
+    def enqueue(self, log_stream: str, message: str, timestamp_ms: Optional[int] = None) -> bool:
+        """Queue a single log event; returns False if it was dropped"""
+        if self._closed:
+            self._count('dropped')
+            return False
+        if self._worker is None or not self._worker.is_alive():
+            self.start()
+
+        if timestamp_ms is None:
+            timestamp_ms = int(time.time() * 1000)
+        event = (log_stream, timestamp_ms, _truncate(message))
+
+        try:
+            if self.backpressure == 'block':
+                self._queue.put(event, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            if self.backpressure == 'spill':
+                self._spill(event)
+                return True
+            self._count('dropped')
+            return False
+
+        self._count('queued')
+        return True
+
+    def flush(self, timeout: Optional[float] = 10.0) -> bool:
+        """Send everything queued so far; returns False on timeout"""
+        if self._worker is None:
+            return True
+        if not self._worker.is_alive():
+            if self._closed or self._queue.empty():
+                return True
+            self.start()
+        done = threading.Event()
+        try:
+            self._queue.put((_FLUSH, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """Flush pending events and stop the worker"""
+        with self._lock:
+            if self._exit_hook:
+                atexit.unregister(self.close)
+                self._exit_hook = False
+            worker = self._worker
+            if self._closed or worker is None:
+                self._closed = True
+                return
+            self._closed = True
+        try:
+            self._queue.put((_STOP, None), timeout=timeout)
+        except queue.Full:
+            return
+        worker.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """Return a snapshot of the shipper counters"""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _spill(self, event: LogEvent) -> None:
+        """Append an event that did not fit in the queue to the spill file"""
+        line = json.dumps({'stream': event[0], 'timestamp': event[1], 'message': event[2]})
+        try:
+            with self._spill_lock, open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+                spill_file.write(line + '\n')
+        except OSError:
+            self._count('dropped')
+            return
+        self._count('spilled')
+
+    def _run(self) -> None:
+        pending: Dict[str, List[Tuple[int, str]]] = {}
+        pending_bytes: Dict[str, int] = {}
+        oldest: Optional[float] = None
+
+        while True:
+            if oldest is None:
+                wait = self.flush_interval
+            else:
+                wait = max(0.0, oldest + self.flush_interval - time.monotonic())
+
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item[0] is _FLUSH:
+                self._replay_spill(pending, pending_bytes)
+                self._send_all(pending, pending_bytes)
+                oldest = None
+                item[1].set()
+                continue
+
+            if item is not None and item[0] is _STOP:
+                self._replay_spill(pending, pending_bytes)
+                self._send_all(pending, pending_bytes)
+                return
+
+            if item is not None:
+                self._count('in_flight')
+                if oldest is None:
+                    oldest = time.monotonic()
+                if self._add(pending, pending_bytes, item):
+                    self._send_stream(pending, pending_bytes, item[0])
+
+            if oldest is not None and time.monotonic() - oldest >= self.flush_interval:
+                self._send_all(pending, pending_bytes)
+                oldest = None
+
+            if self.backpressure == 'spill' and self._queue.empty():
+                if self._replay_spill(pending, pending_bytes) and oldest is None:
+                    oldest = time.monotonic()
+
+    def _add(self,
+             pending: Dict[str, List[Tuple[int, str]]],
+             pending_bytes: Dict[str, int],
+             event: LogEvent) -> bool:
+        """Add an event to its stream batch; returns True when the batch is full"""
+        stream, timestamp, message = event
+        size = len(message.encode('utf-8')) + EVENT_OVERHEAD_BYTES
+        if pending_bytes.get(stream, 0) + size > self.batch_max_bytes:
+            self._send_stream(pending, pending_bytes, stream)
+        pending.setdefault(stream, []).append((timestamp, message))
+        pending_bytes[stream] = pending_bytes.get(stream, 0) + size
+        return len(pending[stream]) >= self.batch_max_events
+
+    def _replay_spill(self,
+                      pending: Dict[str, List[Tuple[int, str]]],
+                      pending_bytes: Dict[str, int]) -> bool:
+        """Move spilled events back into the pending batches"""
+        if not self.spill_path:
+            return False
+        replay_path = self.spill_path + '.replay'
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return False
+            os.replace(self.spill_path, replay_path)
+
+        replayed = False
+        with open(replay_path, encoding='utf-8') as replay_file:
+            for line in replay_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                event = (record['stream'], record['timestamp'], record['message'])
+                self._count('in_flight')
+                self._count('spilled', -1)
+                replayed = True
+                if self._add(pending, pending_bytes, event):
+                    self._send_stream(pending, pending_bytes, event[0])
+        os.remove(replay_path)
+        return replayed
+
+    def _send_all(self,
+                  pending: Dict[str, List[Tuple[int, str]]],
+                  pending_bytes: Dict[str, int]) -> None:
+        for stream in list(pending):
+            self._send_stream(pending, pending_bytes, stream)
+
+    def _send_stream(self,
+                     pending: Dict[str, List[Tuple[int, str]]],
+                     pending_bytes: Dict[str, int],
+                     stream: str) -> None:
+        events = pending.pop(stream, [])
+        pending_bytes.pop(stream, None)
+        if not events:
+            return
+        # PutLogEvents requires chronological order within a batch
+        events.sort(key=lambda event: event[0])
+        for sink in self.sinks:
+            try:
+                sink(stream, events)
+            except Exception:
+                logger.exception("Audit sink failed for %d events in %s", len(events), stream)
+                self._count('sink_failed', len(events))
+        for batch in _split_batch(events, self.batch_max_events, self.batch_max_bytes):
+            sent = self._put(stream, batch)
+            self._count('in_flight', -len(batch))
+            self._count('sent' if sent else 'failed', len(batch))
+
+    def _put(self, stream: str, batch: List[Tuple[int, str]]) -> bool:
+        log_events = [{'timestamp': timestamp, 'message': message} for timestamp, message in batch]
+        stream_created = False
+        attempt = 0
+        while True:
+            try:
+                self.client.put_log_events(
+                    logGroupName=self.log_group_name,
+                    logStreamName=stream,
+                    logEvents=log_events
+                )
+                return True
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code == 'ResourceNotFoundException' and not stream_created:
+                    # The stream is created on its first batch, which is then sent again
+                    self._create_stream(stream)
+                    stream_created = True
+                    continue
+                error: Exception = e
+            except BotoCoreError as e:
+                error = e
+            except Exception:
+                # A failed batch must never stop the worker thread
+                logger.exception("Shipping %d audit events to %s failed", len(batch), stream)
+                return False
+            if attempt >= self.max_retries:
+                logger.warning("Shipping %d audit events to %s failed: %s", len(batch), stream, error)
+                return False
+            time.sleep(min(0.1 * 2 ** attempt, 2.0))
+            attempt += 1
+
+    def _create_stream(self, stream: str) -> None:
+        try:
+            self.client.create_log_stream(
+                logGroupName=self.log_group_name,
+                logStreamName=stream
+            )
+        except (BotoCoreError, ClientError):
+            # Already exists, or the retried put reports the failure
+            pass
+
+
+def _truncate(message: str) -> str:
+    """Trim a message to the maximum PutLogEvents event size"""
+    encoded = message.encode('utf-8')
+    if len(encoded) <= MAX_EVENT_BYTES:
+        return message
+    return encoded[:MAX_EVENT_BYTES].decode('utf-8', errors='ignore')
+
+
+def _split_batch(events: List[Tuple[int, str]],
+                 max_events: int,
+                 max_bytes: int) -> List[List[Tuple[int, str]]]:
+    """Split sorted events into batches that respect the PutLogEvents limits"""
+    batches: List[List[Tuple[int, str]]] = []
+    batch: List[Tuple[int, str]] = []
+    batch_bytes = 0
+    for timestamp, message in events:
+        size = len(message.encode('utf-8')) + EVENT_OVERHEAD_BYTES
+        if batch and (
+            len(batch) >= max_events
+            or batch_bytes + size > max_bytes
+            or timestamp - batch[0][0] > MAX_BATCH_SPAN_MS
+        ):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append((timestamp, message))
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
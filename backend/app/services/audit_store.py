@@ -0,0 +1,245 @@
+import base64
+import json
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import JSON, BigInteger, DateTime, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'audit_events'
+_PARTITION_NAME = re.compile(rf'^{TABLE}_(\d{{8}})$')
+
+# Columns promoted out of the event JSON so they can be indexed
+_COLUMNS = ('event_type', 'user_id', 'action', 'resource', 'ip_address')
+
+_CREATE_TABLE = f'''
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id bigint GENERATED ALWAYS AS IDENTITY,
+    timestamp timestamptz NOT NULL,
+    stream text NOT NULL,
+    event_type text,
+    user_id text,
+    action text,
+    resource text,
+    ip_address text,
+    payload jsonb NOT NULL,
+    PRIMARY KEY (timestamp, id)
+) PARTITION BY RANGE (timestamp)
+'''
+
+_CREATE_INDEXES = (
+    f'CREATE INDEX IF NOT EXISTS ix_{TABLE}_user_id_timestamp ON {TABLE} (user_id, timestamp, id)',
+    f'CREATE INDEX IF NOT EXISTS ix_{TABLE}_event_type_timestamp ON {TABLE} (event_type, timestamp)',
+)
+
+_INSERT = text(f'''
+INSERT INTO {TABLE} (timestamp, stream, event_type, user_id, action, resource, ip_address, payload)
+VALUES (:timestamp, :stream, :event_type, :user_id, :action, :resource, :ip_address, CAST(:payload AS jsonb))
+''')
+
+_USER_ACTIVITY = f'''
+SELECT id, timestamp, payload FROM {TABLE}
+WHERE user_id = :user_id AND timestamp >= :start_time AND timestamp < :end_time
+{{after}}
+ORDER BY timestamp DESC, id DESC
+LIMIT :limit
+'''
+
+_DELETE_USER = text(f'DELETE FROM {TABLE} WHERE user_id = :user_id')
+
+# Daily tables, with whether each is still attached and whether an
+# interrupted DETACH ... CONCURRENTLY left it pending
+_PARTITIONS = text(f'''
+SELECT child.relname, pg_inherits.inhrelid IS NOT NULL AS attached,
+       coalesce(pg_inherits.inhdetachpending, false) AS detach_pending
+FROM pg_class child
+LEFT JOIN pg_inherits ON pg_inherits.inhrelid = child.oid
+WHERE child.relkind = 'r' AND pg_table_is_visible(child.oid) AND child.relname LIKE '{TABLE}\\_%'
+''')
+
+
+def encode_cursor(timestamp: datetime, event_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), event_id]).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, event_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(event_id)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+class AuditStore:
+    """Append-only Postgres store of audit events, partitioned by day.
+
+    Events arrive from the audit log shipper in batches. Per-user queries
+    are range scans on ``(user_id, timestamp, id)`` with keyset cursors,
+    and retention is applied by dropping whole daily partitions instead of
+    deleting rows. Partitions cover UTC days whatever the session TimeZone,
+    and are detached concurrently before being dropped so writers are not
+    blocked by a lock on the parent table.
+    """
+
+    def __init__(self, engine: Engine, premake_days: int = 3, retention_days: int = 365):
+        self.engine = engine
+        self.premake_days = premake_days
+        self.retention_days = retention_days
+        self._known_partitions: set = set()
+
+    def create_schema(self) -> None:
+        """Create the partitioned table, its indexes and upcoming partitions"""
+        with self.engine.begin() as connection:
+            connection.execute(text(_CREATE_TABLE))
+            for statement in _CREATE_INDEXES:
+                connection.execute(text(statement))
+        self.ensure_partitions()
+
+    def ensure_partitions(self, days: Optional[List[date]] = None) -> None:
+        """Create the daily partitions for days (default: today and premake_days ahead)"""
+        if days is None:
+            today = datetime.now(timezone.utc).date()
+            days = [today + timedelta(days=offset) for offset in range(self.premake_days + 1)]
+        missing = [day for day in days if day not in self._known_partitions]
+        if not missing:
+            return
+        with self.engine.begin() as connection:
+            for day in missing:
+                connection.execute(text(_create_partition(day)))
+        self._known_partitions.update(missing)
+
+    def drop_expired_partitions(self, retention_days: Optional[int] = None) -> List[str]:
+        """Drop partitions whose whole day is older than the retention period.
+
+        Each is first detached with DETACH PARTITION ... CONCURRENTLY, which
+        only needs a SHARE UPDATE EXCLUSIVE lock on the parent; dropping a
+        still-attached partition would take an ACCESS EXCLUSIVE one. A
+        detach interrupted by a previous run is finalized, and a detached
+        table whose drop failed is dropped.
+        """
+        retention_days = self.retention_days if retention_days is None else retention_days
+        cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+        dropped = []
+        # DETACH ... CONCURRENTLY cannot run inside a transaction block
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            for name, attached, detach_pending in connection.execute(_PARTITIONS).all():
+                match = _PARTITION_NAME.match(name)
+                if not match:
+                    continue
+                day = datetime.strptime(match.group(1), '%Y%m%d').date()
+                # The partition holds [day, day + 1); keep it until all of that is expired
+                if day + timedelta(days=1) > cutoff:
+                    continue
+                if detach_pending:
+                    connection.execute(text(f'ALTER TABLE {TABLE} DETACH PARTITION {name} FINALIZE'))
+                elif attached:
+                    connection.execute(text(f'ALTER TABLE {TABLE} DETACH PARTITION {name} CONCURRENTLY'))
+                connection.execute(text(f'DROP TABLE IF EXISTS {name}'))
+                self._known_partitions.discard(day)
+                dropped.append(name)
+        if dropped:
+            logger.info("Dropped %d expired audit partitions", len(dropped))
+        return dropped
+
+    def maintain(self) -> None:
+        """Create upcoming partitions and drop expired ones"""
+        self.ensure_partitions()
+        self.drop_expired_partitions()
+
+    def write_batch(self, stream: str, batch: List[Tuple[int, str]]) -> None:
+        """Insert a shipper batch of (timestamp ms, JSON message) events"""
+        rows = [_row(stream, timestamp_ms, message) for timestamp_ms, message in batch]
+        self.ensure_partitions(sorted({row['timestamp'].date() for row in rows}))
+        with self.engine.begin() as connection:
+            connection.execute(_INSERT, rows)
+
+    def delete_user(self, user_id: str) -> int:
+        """Delete every stored event of a user, returning how many were deleted"""
+        with self.engine.begin() as connection:
+            return connection.execute(_DELETE_USER, {'user_id': user_id}).rowcount
+
+    def get_user_activity(self,
+                          user_id: str,
+                          start_time: datetime,
+                          end_time: datetime,
+                          cursor: Optional[str] = None,
+                          limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return one page of a user's events, newest first, and the next cursor"""
+        params: Dict[str, Any] = {
+            'user_id': user_id,
+            'start_time': _utc(start_time),
+            'end_time': _utc(end_time),
+            'limit': limit + 1,
+        }
+        after = ''
+        if cursor:
+            params['cursor_timestamp'], params['cursor_id'] = decode_cursor(cursor)
+            after = 'AND (timestamp, id) < (:cursor_timestamp, :cursor_id)'
+        with self.engine.connect() as connection:
+            query = text(_USER_ACTIVITY.format(after=after)).columns(
+                id=BigInteger, timestamp=DateTime(timezone=True), payload=JSON
+            )
+            rows = connection.execute(query, params).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+        return [row.payload for row in rows], next_cursor
+
+    def iter_user_activity(self,
+                           user_id: str,
+                           start_time: datetime,
+                           end_time: datetime,
+                           page_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Yield every event of a user in the range, one page at a time"""
+        cursor = None
+        while True:
+            events, cursor = self.get_user_activity(user_id, start_time, end_time, cursor, page_size)
+            yield from events
+            if cursor is None:
+                return
+
+
+def _partition_name(day: date) -> str:
+    return f"{TABLE}_{day.strftime('%Y%m%d')}"
+
+
+def _create_partition(day: date) -> str:
+    # Bounds carry an explicit +00 offset; a bare date would be read in the
+    # session TimeZone while rows are routed by their UTC day
+    start, end = day.isoformat(), (day + timedelta(days=1)).isoformat()
+    return (
+        f"CREATE TABLE IF NOT EXISTS {_partition_name(day)} PARTITION OF {TABLE} "
+        f"FOR VALUES FROM ('{start} 00:00:00+00') TO ('{end} 00:00:00+00')"
+    )
+
+
+def _utc(value: datetime) -> datetime:
+    # Naive datetimes in this codebase come from datetime.utcnow()
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _row(stream: str, timestamp_ms: int, message: str) -> Dict[str, Any]:
+    try:
+        event = json.loads(message)
+    except ValueError:
+        event = {}
+    if not isinstance(event, dict):
+        event = {}
+    row = {
+        'timestamp': datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc),
+        'stream': stream,
+        'payload': message if event else json.dumps({'message': message}),
+    }
+    for column in _COLUMNS:
+        value = event.get(column)
+        row[column] = None if value is None else str(value)
+    return row
@@ -0,0 +1,335 @@
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import redis
+from redis.exceptions import RedisError
+from sqlalchemy import DateTime, text
+from sqlalchemy.engine import Engine
+
+from app.core.cache import TTLCache
+from app.core.security_config import GDPR_CONFIG
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'consent_records'
+
+_CREATE_TABLE = f'''
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    user_id text NOT NULL,
+    consent_type text NOT NULL,
+    granted_at timestamptz NOT NULL,
+    expires_at timestamptz,
+    revoked_at timestamptz,
+    policy_version text
+)
+'''
+
+_CREATE_INDEXES = (
+    f'CREATE INDEX IF NOT EXISTS ix_{TABLE}_user_id_granted_at ON {TABLE} (user_id, granted_at)',
+    # Grants racing before the unique index existed may have left several
+    # active rows of one type; keep the newest so the index can be built
+    f'''UPDATE {TABLE} SET revoked_at = now()
+    WHERE revoked_at IS NULL AND id NOT IN (
+        SELECT max(id) FROM {TABLE} WHERE revoked_at IS NULL GROUP BY user_id, consent_type
+    )''',
+    # At most one unrevoked grant per type; only those are read on the request path
+    f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{TABLE}_active ON {TABLE} (user_id, consent_type) WHERE revoked_at IS NULL',
+    # Superseded by the unique index above
+    f'DROP INDEX IF EXISTS ix_{TABLE}_active',
+)
+
+_REVOKE = text(f'''
+UPDATE {TABLE} SET revoked_at = :now
+WHERE user_id = :user_id AND consent_type = :consent_type AND revoked_at IS NULL
+''')
+
+# A grant committed by a concurrent transaction after _REVOKE ran is taken over
+_GRANT = text(f'''
+INSERT INTO {TABLE} (user_id, consent_type, granted_at, expires_at, policy_version)
+VALUES (:user_id, :consent_type, :now, :expires_at, :policy_version)
+ON CONFLICT (user_id, consent_type) WHERE revoked_at IS NULL DO UPDATE SET
+    granted_at = excluded.granted_at,
+    expires_at = excluded.expires_at,
+    policy_version = excluded.policy_version
+RETURNING id
+''')
+
+_ACTIVE = text(f'''
+SELECT consent_type, expires_at FROM {TABLE}
+WHERE user_id = :user_id AND revoked_at IS NULL AND (expires_at IS NULL OR expires_at > :now)
+''').columns(expires_at=DateTime(timezone=True))
+
+_RECORDS = text(f'''
+SELECT id, consent_type, granted_at, expires_at, revoked_at, policy_version FROM {TABLE}
+WHERE user_id = :user_id
+ORDER BY granted_at, id
+''').columns(
+    granted_at=DateTime(timezone=True),
+    expires_at=DateTime(timezone=True),
+    revoked_at=DateTime(timezone=True)
+)
+
+_DELETE = text(f'DELETE FROM {TABLE} WHERE user_id = :user_id')
+
+
+class ConsentStore:
+    """Postgres table of consent grants.
+
+    Granting again revokes the user's current grant of that type and
+    inserts a new row, so the table keeps the full history that GDPR
+    exports report. A unique partial index allows one unrevoked grant per
+    type; when two grants race, the later one updates the row the other
+    inserted instead of adding a second active grant.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def create_schema(self) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(text(_CREATE_TABLE))
+            for statement in _CREATE_INDEXES:
+                connection.execute(text(statement))
+
+    def grant(self,
+              user_id: str,
+              consent_type: str,
+              expires_at: Optional[datetime] = None,
+              policy_version: Optional[str] = None) -> int:
+        """Record a grant, superseding any current one of the same type; returns its id"""
+        now = datetime.now(timezone.utc)
+        with self.engine.begin() as connection:
+            connection.execute(_REVOKE, {'user_id': user_id, 'consent_type': consent_type, 'now': now})
+            return connection.execute(_GRANT, {
+                'user_id': user_id,
+                'consent_type': consent_type,
+                'now': now,
+                'expires_at': _utc(expires_at) if expires_at is not None else None,
+                'policy_version': policy_version,
+            }).scalar_one()
+
+    def revoke(self, user_id: str, consent_type: str) -> int:
+        """Revoke the user's current grant of consent_type; returns the rows revoked"""
+        with self.engine.begin() as connection:
+            result = connection.execute(_REVOKE, {
+                'user_id': user_id,
+                'consent_type': consent_type,
+                'now': datetime.now(timezone.utc),
+            })
+        return result.rowcount
+
+    def active_consents(self, user_id: str) -> Tuple[FrozenSet[str], Optional[datetime]]:
+        """The consent types a user currently holds, and when the first of them expires"""
+        with self.engine.connect() as connection:
+            rows = connection.execute(_ACTIVE, {'user_id': user_id, 'now': datetime.now(timezone.utc)}).all()
+        expiries = [_utc(row.expires_at) for row in rows if row.expires_at is not None]
+        return frozenset(row.consent_type for row in rows), min(expiries, default=None)
+
+    def get_records(self, user_id: str) -> List[Dict[str, Any]]:
+        """Every grant of a user, oldest first, with its current status"""
+        now = datetime.now(timezone.utc)
+        with self.engine.connect() as connection:
+            rows = connection.execute(_RECORDS, {'user_id': user_id}).all()
+        records = []
+        for row in rows:
+            expires_at = _utc(row.expires_at) if row.expires_at is not None else None
+            if row.revoked_at is not None:
+                status = 'revoked'
+            elif expires_at is not None and expires_at <= now:
+                status = 'expired'
+            else:
+                status = 'active'
+            records.append({
+                'id': row.id,
+                'user_id': user_id,
+                'consent_type': row.consent_type,
+                'granted_at': _utc(row.granted_at).isoformat(),
+                'expires_at': expires_at.isoformat() if expires_at is not None else None,
+                'revoked_at': _utc(row.revoked_at).isoformat() if row.revoked_at is not None else None,
+                'policy_version': row.policy_version,
+                'status': status,
+            })
+        return records
+
+    def delete_records(self, user_id: str) -> int:
+        with self.engine.begin() as connection:
+            return connection.execute(_DELETE, {'user_id': user_id}).rowcount
+
+
+class ConsentCache:
+    """Each user's set of active consents, held in process memory.
+
+    An entry lives at most ``ttl`` seconds and never past the earliest
+    expiry among its consents, so an expired consent is never served.
+    Users without consents are cached too. Grants and revocations made
+    through the cache drop the user's entry here and, over Redis pub/sub,
+    in every other worker; entries missed by a worker still expire on
+    their TTL.
+    """
+
+    def __init__(self,
+                 store: Optional[ConsentStore] = None,
+                 maxsize: int = 100000,
+                 ttl: float = 300.0,
+                 channel: str = 'consent:invalidate'):
+        self._store = store
+        self.ttl = ttl
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._cache = TTLCache(maxsize=maxsize)
+        # Bumped by every invalidation, so a load that raced one is not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._sync_redis: Any = None
+
+    @classmethod
+    def from_config(cls, store: Optional[ConsentStore] = None) -> 'ConsentCache':
+        config = GDPR_CONFIG['consent']
+        return cls(
+            store,
+            maxsize=config['cache_size'],
+            ttl=config['cache_ttl_seconds'],
+            channel=config['invalidation_channel']
+        )
+
+    @property
+    def store(self) -> ConsentStore:
+        if self._store is None:
+            # The engine is imported on first use so importing this module needs no database
+            from app.db.database import engine
+
+            self._store = ConsentStore(engine)
+        return self._store
+
+    def warm_up(self) -> None:
+        self.store.create_schema()
+
+    def get_active(self, user_id: str) -> FrozenSet[str]:
+        """The user's active consent types, loading them on a cache miss"""
+        consents = self._cache.get(user_id)
+        if consents is None:
+            consents = self._load(user_id)
+        return consents
+
+    async def check(self, user_id: str, consent_type: str) -> bool:
+        """Whether the user holds consent_type; a memory lookup unless the entry is missing"""
+        consents = self._cache.get(user_id)
+        if consents is None:
+            consents = await asyncio.to_thread(self._load, user_id)
+        return consent_type in consents
+
+    def grant(self,
+              user_id: str,
+              consent_type: str,
+              expires_at: Optional[datetime] = None,
+              policy_version: Optional[str] = None) -> int:
+        consent_id = self.store.grant(user_id, consent_type, expires_at, policy_version)
+        self.invalidate(user_id)
+        return consent_id
+
+    def revoke(self, user_id: str, consent_type: str) -> int:
+        revoked = self.store.revoke(user_id, consent_type)
+        self.invalidate(user_id)
+        return revoked
+
+    def delete_user(self, user_id: str) -> int:
+        deleted = self.store.delete_records(user_id)
+        self.invalidate(user_id)
+        return deleted
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user's entry here and tell other workers to do the same"""
+        self.invalidate_local(user_id)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            loop.create_task(self._publish(user_id))
+        else:
+            self._publish_sync(user_id)
+
+    def invalidate_local(self, user_id: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(user_id)
+
+    async def listen_for_invalidations(self) -> None:
+        """Drop entries invalidated by other workers; runs until cancelled"""
+        from app.core.config import settings
+        from app.core.redis import get_pubsub_redis
+
+        while True:
+            # A dedicated connection without the pool's read timeout, so an
+            # idle channel is not mistaken for a lost one
+            client = get_pubsub_redis()
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    while True:
+                        # Waking once per health check interval lets an idle
+                        # connection send its PING
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True,
+                            timeout=settings.REDIS_HEALTH_CHECK_INTERVAL
+                        )
+                        if message is None:
+                            continue
+                        payload = json.loads(message['data'])
+                        if payload.get('origin') != self.origin:
+                            self.invalidate_local(payload['user_id'])
+            except RedisError:
+                # Invalidations may have been missed while disconnected
+                logger.warning("Consent invalidation subscription lost; reconnecting")
+                self._cache.clear()
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+    def _load(self, user_id: str) -> FrozenSet[str]:
+        with self._lock:
+            generation = self._generation
+        consents, earliest_expiry = self.store.active_consents(user_id)
+        ttl = self.ttl
+        if earliest_expiry is not None:
+            ttl = min(ttl, (earliest_expiry - datetime.now(timezone.utc)).total_seconds())
+        with self._lock:
+            if generation == self._generation and ttl > 0:
+                self._cache.set(user_id, consents, ttl)
+        return consents
+
+    def _message(self, user_id: str) -> str:
+        return json.dumps({'origin': self.origin, 'user_id': user_id})
+
+    async def _publish(self, user_id: str) -> None:
+        from app.core.redis import get_redis
+
+        try:
+            await get_redis().publish(self.channel, self._message(user_id))
+        except RedisError:
+            logger.warning("Could not publish consent invalidation for %s", user_id)
+
+    def _publish_sync(self, user_id: str) -> None:
+        # Jobs and scripts run on threads with no event loop to schedule on
+        from app.core.config import settings
+
+        if self._sync_redis is None:
+            self._sync_redis = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=settings.REDIS_SOCKET_TIMEOUT)
+        try:
+            self._sync_redis.publish(self.channel, self._message(user_id))
+        except RedisError:
+            logger.warning("Could not publish consent invalidation for %s", user_id)
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite and naive callers return datetimes without a zone; they are UTC here
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+consent_cache = ConsentCache.from_config()
@@ -0,0 +1,297 @@
+import gzip
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional
+
+from app.core.security_config import GDPR_CONFIG
+
+FORMAT_VERSION = 1
+
+# A source yields one user's records of one kind, in a stable order
+ExportSource = Callable[[], Iterator[Any]]
+ProgressCallback = Callable[[Dict[str, Any]], None]
+# Called at every checkpoint, once the output up to checkpoint.offset is complete
+CheckpointCallback = Callable[['ExportCheckpoint'], None]
+
+_DONE = object()
+
+
+class SourceUnavailable(Exception):
+    """Raised by a source whose backing store is not implemented or configured"""
+
+
+class ExportCheckpoint:
+    """Where an interrupted export stopped.
+
+    ``offset`` is the length of the output when the last complete gzip
+    member was written, and ``counts`` how many records of each source it
+    contains. ``window_end`` pins the time range so the sources return the
+    same records when the export is resumed.
+    """
+
+    def __init__(self,
+                 user_id: str,
+                 window_end: datetime,
+                 offset: int = 0,
+                 counts: Optional[Dict[str, int]] = None,
+                 completed: Optional[List[str]] = None,
+                 unavailable: Optional[List[str]] = None):
+        self.user_id = user_id
+        self.window_end = window_end
+        self.offset = offset
+        self.counts = counts or {}
+        self.completed = completed or []
+        self.unavailable = unavailable or []
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], user_id: str) -> Optional['ExportCheckpoint']:
+        if data.get('format_version') != FORMAT_VERSION or data.get('user_id') != user_id:
+            return None
+        return cls(
+            user_id,
+            datetime.fromisoformat(data['window_end']),
+            data['offset'],
+            data['counts'],
+            data['completed'],
+            data['unavailable']
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'format_version': FORMAT_VERSION,
+            'user_id': self.user_id,
+            'window_end': self.window_end.isoformat(),
+            'offset': self.offset,
+            'counts': dict(self.counts),
+            'completed': list(self.completed),
+            'unavailable': list(self.unavailable),
+        }
+
+    @classmethod
+    def load(cls, path: str, user_id: str) -> Optional['ExportCheckpoint']:
+        try:
+            with open(path, encoding='utf-8') as checkpoint_file:
+                data = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+        return cls.from_dict(data, user_id)
+
+    def save(self, path: str) -> None:
+        save_json(path, self.to_dict())
+
+    def progress(self, done: bool = False) -> Dict[str, Any]:
+        return {
+            'user_id': self.user_id,
+            'records': dict(self.counts),
+            'bytes_written': self.offset,
+            'completed_sources': list(self.completed),
+            'unavailable_sources': list(self.unavailable),
+            'done': done,
+        }
+
+
+class GDPRExporter:
+    """Stream a user's data export as gzip-compressed JSON Lines.
+
+    All sources are read concurrently, each on its own thread following
+    every result page, and their records are interleaved into the output
+    through a bounded queue, so memory use does not depend on the size of
+    the export. Every line is ``{"source": ..., "data": ...}``, between a
+    header line and a summary line.
+
+    The output is a sequence of gzip members, which gzip readers treat as
+    one stream. After every ``checkpoint_every`` records the current member
+    is closed, the file is synced and a checkpoint is saved; a resumed
+    export truncates the file to the last checkpoint and skips the records
+    each source already wrote.
+    """
+
+    def __init__(self,
+                 sources_factory: Callable[[datetime], Dict[str, ExportSource]],
+                 checkpoint_every: int = 5000,
+                 queue_size: int = 1000,
+                 compression_level: int = 6):
+        self.sources_factory = sources_factory
+        self.checkpoint_every = checkpoint_every
+        self.queue_size = queue_size
+        self.compression_level = compression_level
+
+    @classmethod
+    def from_config(cls, sources_factory: Callable[[datetime], Dict[str, ExportSource]]) -> 'GDPRExporter':
+        config = GDPR_CONFIG['export']
+        return cls(
+            sources_factory,
+            checkpoint_every=config['checkpoint_every'],
+            queue_size=config['queue_size'],
+            compression_level=config['compression_level']
+        )
+
+    def export(self,
+               user_id: str,
+               output_path: str,
+               checkpoint_path: Optional[str] = None,
+               progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Write the export to output_path, resuming from checkpoint_path if present.
+
+        Returns the final progress report. The checkpoint is removed once
+        the export is complete.
+        """
+        checkpoint = None
+        if checkpoint_path and os.path.exists(output_path):
+            checkpoint = ExportCheckpoint.load(checkpoint_path, user_id)
+            if checkpoint is not None and os.path.getsize(output_path) < checkpoint.offset:
+                # The output is shorter than the checkpoint says, so start over
+                checkpoint = None
+        if checkpoint is None:
+            checkpoint = ExportCheckpoint(user_id, datetime.utcnow())
+
+        mode = 'r+b' if checkpoint.offset else 'wb'
+        with open(output_path, mode) as output:
+            output.truncate(checkpoint.offset)
+            output.seek(checkpoint.offset)
+
+            def on_checkpoint(checkpoint: ExportCheckpoint) -> None:
+                output.flush()
+                os.fsync(output.fileno())
+                if checkpoint_path:
+                    checkpoint.save(checkpoint_path)
+
+            self.write(output, checkpoint, on_checkpoint, progress)
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        report = checkpoint.progress(done=True)
+        if progress is not None:
+            progress(report)
+        return report
+
+    def write(self,
+              output: BinaryIO,
+              checkpoint: ExportCheckpoint,
+              on_checkpoint: Optional[CheckpointCallback] = None,
+              progress: Optional[ProgressCallback] = None) -> None:
+        """Write the export to any binary stream, continuing from checkpoint.
+
+        output must be positioned at checkpoint.offset. on_checkpoint is
+        where the caller makes the output durable and records the
+        checkpoint, e.g. by syncing a file or uploading a part.
+        """
+        member = self._open_member(output)
+        if checkpoint.offset == 0:
+            member.write(_line({
+                'type': 'header',
+                'format_version': FORMAT_VERSION,
+                'user_id': checkpoint.user_id,
+                'generated_at': checkpoint.window_end.isoformat(),
+            }))
+
+        sources = {
+            name: source
+            for name, source in self.sources_factory(checkpoint.window_end).items()
+            if name not in checkpoint.completed and name not in checkpoint.unavailable
+        }
+        records: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        since_checkpoint = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, len(sources)), thread_name_prefix='gdpr-export') as pool:
+            for name, source in sources.items():
+                pool.submit(self._produce, name, source, checkpoint.counts.get(name, 0), records, stop)
+            try:
+                remaining = len(sources)
+                while remaining:
+                    name, item = records.get()
+                    if item is _DONE:
+                        remaining -= 1
+                        checkpoint.completed.append(name)
+                        continue
+                    if isinstance(item, SourceUnavailable):
+                        remaining -= 1
+                        checkpoint.unavailable.append(name)
+                        continue
+                    if isinstance(item, BaseException):
+                        raise item
+                    member.write(_line({'source': name, 'data': item}))
+                    checkpoint.counts[name] = checkpoint.counts.get(name, 0) + 1
+                    since_checkpoint += 1
+                    if since_checkpoint >= self.checkpoint_every:
+                        member = self._checkpoint(output, member, checkpoint, on_checkpoint, progress)
+                        since_checkpoint = 0
+            finally:
+                stop.set()
+                # Unblock producers waiting on a full queue so the pool can shut down
+                while not records.empty():
+                    records.get_nowait()
+
+        member.write(_line({
+            'type': 'summary',
+            'records': checkpoint.counts,
+            'unavailable_sources': checkpoint.unavailable,
+        }))
+        member.close()
+        checkpoint.offset = output.tell()
+
+    def _produce(self,
+                 name: str,
+                 source: ExportSource,
+                 skip: int,
+                 records: queue.Queue,
+                 stop: threading.Event) -> None:
+        try:
+            for index, record in enumerate(source()):
+                if index < skip:
+                    continue
+                if not _put(records, (name, record), stop):
+                    return
+            _put(records, (name, _DONE), stop)
+        except NotImplementedError as e:
+            _put(records, (name, SourceUnavailable(str(e))), stop)
+        except BaseException as e:
+            _put(records, (name, e), stop)
+
+    def _open_member(self, output: BinaryIO) -> gzip.GzipFile:
+        return gzip.GzipFile(fileobj=output, mode='wb', compresslevel=self.compression_level)
+
+    def _checkpoint(self,
+                    output: BinaryIO,
+                    member: gzip.GzipFile,
+                    checkpoint: ExportCheckpoint,
+                    on_checkpoint: Optional[CheckpointCallback],
+                    progress: Optional[ProgressCallback]) -> gzip.GzipFile:
+        # Closing the member writes its trailer but leaves the output open
+        member.close()
+        checkpoint.offset = output.tell()
+        if on_checkpoint is not None:
+            on_checkpoint(checkpoint)
+        if progress is not None:
+            progress(checkpoint.progress())
+        return self._open_member(output)
+
+
+def save_json(path: str, value: Dict[str, Any]) -> None:
+    """Atomically replace path with value as JSON"""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as json_file:
+        json.dump(value, json_file)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def _put(records: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put item unless the export was stopped; returns False once it was"""
+    while not stop.is_set():
+        try:
+            records.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _line(value: Dict[str, Any]) -> bytes:
+    return (json.dumps(value, default=str) + '\n').encode('utf-8')
@@ -0,0 +1,321 @@
+"""
+Offline IP to country resolution from a memory-mapped range database.
+
+The database is a flat binary file of sorted, non-overlapping address
+ranges. It is mapped read-only, so every worker process on a host shares
+the same page-cache copy, and a lookup is a bisect over the mapped columns
+with no parsing at load time.
+
+File layout, one column per field so each can be bisected in place:
+    header   >4sHII: magic b'DGEO', version, IPv4 count, IPv6 count
+    IPv4     count x <I first, count x <I last, count x 2s country
+    IPv6     count x 16s first, count x 16s last, count x 2s country
+
+IPv4 bounds are little-endian so that, on little-endian hosts, they are
+read as a memoryview of native integers; IPv6 bounds are big-endian
+bytes, which compare in numeric order.
+
+Usage:
+    python -m app.services.geoip build ranges.csv geoip.bin
+    python -m app.services.geoip lookup geoip.bin 203.0.113.7
+"""
+
+import argparse
+import bisect
+import csv
+import mmap
+import os
+import socket
+import struct
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.cache import TTLCache
+
+MAGIC = b'DGEO'
+VERSION = 1
+HEADER = struct.Struct('>4sHII')
+IPV4_BOUND = struct.Struct('<I')
+IPV6_WIDTH = 16
+COUNTRY_WIDTH = 2
+
+_NOT_FOUND = ''
+_IPV4_MAPPED = b'\x00' * 10 + b'\xff\xff'
+
+# Member states, so "EU" in allowed_countries admits their country codes
+EU_COUNTRIES = frozenset({
+    'AT', 'BE', 'BG', 'CY', 'CZ', 'DE', 'DK', 'EE', 'ES', 'FI', 'FR', 'GR', 'HR', 'HU',
+    'IE', 'IT', 'LT', 'LU', 'LV', 'MT', 'NL', 'PL', 'PT', 'RO', 'SE', 'SI', 'SK',
+})
+
+
+class _Column(Sequence):
+    """Read-only view of fixed-width values in the mapped file, for bisect"""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int, width: int):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+        self._width = width
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> Any:
+        start = self._offset + index * self._width
+        return self._buffer[start:start + self._width]
+
+
+class _UInt32Column(_Column):
+    """Little-endian IPv4 bounds on hosts where a native memoryview cannot be used"""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int):
+        super().__init__(buffer, offset, count, IPV4_BOUND.size)
+
+    def __getitem__(self, index: int) -> int:
+        return IPV4_BOUND.unpack_from(self._buffer, self._offset + index * IPV4_BOUND.size)[0]
+
+
+class GeoIPDatabase:
+    """Country lookups against a memory-mapped range file.
+
+    Recent results (including misses) are kept in an LRU so repeat clients
+    skip the bisect.
+    """
+
+    def __init__(self, path: str, cache_size: int = 100000):
+        self.path = path
+        with open(path, 'rb') as database:
+            self._buffer = mmap.mmap(database.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views: List[memoryview] = []
+        try:
+            self._map_columns()
+        except ValueError:
+            self.close()
+            raise
+        self._cache = TTLCache(maxsize=cache_size)
+
+    def _map_columns(self) -> None:
+        if len(self._buffer) < HEADER.size:
+            raise ValueError(f"{self.path} is not a GeoIP database")
+        magic, version, ipv4_count, ipv6_count = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} GeoIP database")
+        size = (
+            HEADER.size
+            + ipv4_count * (2 * IPV4_BOUND.size + COUNTRY_WIDTH)
+            + ipv6_count * (2 * IPV6_WIDTH + COUNTRY_WIDTH)
+        )
+        if size != len(self._buffer):
+            raise ValueError(f"{self.path} is truncated or corrupt")
+
+        offset = HEADER.size
+        bounds = []
+        for _ in range(2):
+            column_size = ipv4_count * IPV4_BOUND.size
+            if sys.byteorder == 'little':
+                view = memoryview(self._buffer)[offset:offset + column_size].cast('I')
+                self._views.append(view)
+                bounds.append(view)
+            else:
+                bounds.append(_UInt32Column(self._buffer, offset, ipv4_count))
+            offset += column_size
+        self._ipv4 = (bounds[0], bounds[1], offset)
+        offset += ipv4_count * COUNTRY_WIDTH
+        ipv6_first = _Column(self._buffer, offset, ipv6_count, IPV6_WIDTH)
+        ipv6_last = _Column(self._buffer, offset + ipv6_count * IPV6_WIDTH, ipv6_count, IPV6_WIDTH)
+        self._ipv6 = (ipv6_first, ipv6_last, offset + 2 * ipv6_count * IPV6_WIDTH)
+
+    def lookup(self, address: str) -> Optional[str]:
+        """Return the ISO country code for address, or None if unknown"""
+        country = self._cache.get(address)
+        if country is None:
+            country = self._lookup(address)
+            self._cache.set(address, country)
+        return country or None
+
+    def _lookup(self, address: str) -> str:
+        try:
+            if ':' in address:
+                packed = socket.inet_pton(socket.AF_INET6, address)
+                if packed.startswith(_IPV4_MAPPED):
+                    packed = packed[12:]
+            else:
+                packed = socket.inet_pton(socket.AF_INET, address)
+        except (OSError, ValueError):
+            return _NOT_FOUND
+        if len(packed) == 4:
+            first, last, countries = self._ipv4
+            key = int.from_bytes(packed, 'big')
+        else:
+            first, last, countries = self._ipv6
+            key = packed
+        index = bisect.bisect_right(first, key) - 1
+        if index < 0 or key > last[index]:
+            return _NOT_FOUND
+        start = countries + index * COUNTRY_WIDTH
+        return self._buffer[start:start + COUNTRY_WIDTH].decode('ascii')
+
+    def close(self) -> None:
+        # The mmap cannot be closed while memoryviews of it are alive
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._buffer.close()
+
+
+class GeoRestriction:
+    """Apply geo_restrictions country rules to client addresses.
+
+    In ``log`` mode violations are only reported; in ``enforce`` mode the
+    middleware rejects them. Addresses the database does not cover (private
+    ranges, new allocations) follow ``unknown_country``.
+    """
+
+    def __init__(self,
+                 database: GeoIPDatabase,
+                 allowed_countries: Iterable[str] = (),
+                 blocked_countries: Iterable[str] = (),
+                 mode: str = 'log',
+                 unknown_country: str = 'allow'):
+        if mode not in ('log', 'enforce'):
+            raise ValueError(f"Unknown geo restriction mode: {mode}")
+        if unknown_country not in ('allow', 'block'):
+            raise ValueError(f"Unknown policy for unresolved addresses: {unknown_country}")
+        self.database = database
+        self.allowed = _expand_countries(allowed_countries)
+        self.blocked = _expand_countries(blocked_countries)
+        self.enforce = mode == 'enforce'
+        self.allow_unknown = unknown_country == 'allow'
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional['GeoRestriction']:
+        """Build from AWS_SECURITY_CONFIG geo_restrictions; None without a database"""
+        if not config['enabled'] or not config['database_path']:
+            return None
+        return cls(
+            GeoIPDatabase(config['database_path'], config['lookup_cache_size']),
+            config['allowed_countries'],
+            config['blocked_countries'],
+            config['mode'],
+            config['unknown_country']
+        )
+
+    def check(self, address: str) -> Tuple[bool, Optional[str]]:
+        """Return whether address may connect, and its country if known"""
+        country = self.database.lookup(address)
+        if country is None:
+            return self.allow_unknown, None
+        if country in self.blocked:
+            return False, country
+        return not self.allowed or country in self.allowed, country
+
+
+def _expand_countries(countries: Iterable[str]) -> frozenset:
+    expanded = set()
+    for country in countries:
+        country = country.upper()
+        expanded.add(country)
+        if country == 'EU':
+            expanded.update(EU_COUNTRIES)
+    return frozenset(expanded)
+
+
+def _pack(address: str) -> bytes:
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    return socket.inet_pton(family, address.strip())
+
+
+def _parse_row(row: List[str]) -> Tuple[bytes, bytes, str]:
+    """Parse ``first,last,country`` or ``network/prefix,country``"""
+    if len(row) >= 3:
+        first, last, country = _pack(row[0]), _pack(row[1]), row[2]
+        if len(first) != len(last):
+            raise ValueError("range mixes IPv4 and IPv6")
+    elif len(row) == 2 and '/' in row[0]:
+        address, _, prefix = row[0].strip().partition('/')
+        first = _pack(address)
+        bits = len(first) * 8
+        if not prefix.isdigit() or int(prefix) > bits:
+            raise ValueError(f"invalid prefix length in {row[0]!r}")
+        host_bits = bits - int(prefix)
+        value = int.from_bytes(first, 'big') >> host_bits << host_bits
+        first = value.to_bytes(len(first), 'big')
+        last = (value | ((1 << host_bits) - 1)).to_bytes(len(first), 'big')
+        country = row[1]
+    else:
+        raise ValueError("expected first,last,country or network,country")
+    country = country.strip().upper()
+    if len(country) != 2 or not country.isascii() or not country.isalpha():
+        raise ValueError(f"invalid country code {country!r}")
+    if first > last:
+        raise ValueError("range ends before it starts")
+    return first, last, country
+
+
+def build_database(rows: Iterable[List[str]], output_path: str) -> Tuple[int, int]:
+    """Write a database from CSV rows; returns the IPv4 and IPv6 range counts.
+
+    A leading header row is skipped. Overlapping ranges are rejected, since
+    a lookup could otherwise return either country. The file is written
+    next to output_path and renamed into place, so workers that already
+    mapped the old file keep a consistent view.
+    """
+    ranges: Tuple[List[Tuple[bytes, bytes, str]], List[Tuple[bytes, bytes, str]]] = ([], [])
+    for line_number, row in enumerate(rows, start=1):
+        if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+            continue
+        try:
+            first, last, country = _parse_row(row)
+        except (OSError, ValueError) as e:
+            if line_number == 1:
+                continue
+            raise ValueError(f"line {line_number}: {e}")
+        ranges[len(first) == 16].append((first, last, country))
+
+    for family in ranges:
+        family.sort()
+        for previous, current in zip(family, family[1:]):
+            if current[0] <= previous[1]:
+                raise ValueError(f"overlapping ranges for {previous[2]} and {current[2]}")
+
+    temporary_path = f"{output_path}.tmp"
+    with open(temporary_path, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, VERSION, len(ranges[0]), len(ranges[1])))
+        for bound in (0, 1):
+            for record in ranges[0]:
+                output.write(IPV4_BOUND.pack(int.from_bytes(record[bound], 'big')))
+        output.write(b''.join(record[2].encode('ascii') for record in ranges[0]))
+        for bound in (0, 1):
+            output.write(b''.join(record[bound] for record in ranges[1]))
+        output.write(b''.join(record[2].encode('ascii') for record in ranges[1]))
+    os.replace(temporary_path, output_path)
+    return len(ranges[0]), len(ranges[1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or query a GeoIP range database")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="Convert a CSV range list to the binary format")
+    build_parser.add_argument('csv_path')
+    build_parser.add_argument('output_path')
+
+    lookup_parser = commands.add_parser('lookup', help="Resolve addresses against a database")
+    lookup_parser.add_argument('database_path')
+    lookup_parser.add_argument('addresses', nargs='+')
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        with open(args.csv_path, newline='', encoding='utf-8') as source:
+            ipv4_count, ipv6_count = build_database(csv.reader(source), args.output_path)
+        print(f"Wrote {ipv4_count} IPv4 and {ipv6_count} IPv6 ranges to {args.output_path}")
+    else:
+        database = GeoIPDatabase(args.database_path)
+        for address in args.addresses:
+            print(f"{address}\t{database.lookup(address) or '-'}")
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
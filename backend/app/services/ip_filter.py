@@ -0,0 +1,368 @@
+"""
+IPv4/IPv6 block and allow lists with CIDR prefixes and hot reload.
+
+Usage:
+    python -m app.services.ip_filter bench --entries 1000000
+"""
+
+import argparse
+import asyncio
+import bisect
+import logging
+import os
+import random
+import socket
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from app.core.redis import get_redis
+from app.core.security_config import AWS_SECURITY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_IPV4_MAPPED_PREFIX = 0xffff
+_BUCKET_SHIFT = 16
+
+
+def parse_entry(entry: str) -> Tuple[int, int, int]:
+    """Parse an address or CIDR prefix into (family, first, last) integers.
+
+    ``family`` is 0 for IPv4 and 1 for IPv6. Host bits set in a prefix are
+    ignored, as with ``ipaddress.ip_network(strict=False)``. Raises
+    ValueError for malformed entries.
+    """
+    address, _, prefix = entry.strip().partition('/')
+    family = 1 if ':' in address else 0
+    try:
+        packed = socket.inet_pton(socket.AF_INET6 if family else socket.AF_INET, address)
+    except (OSError, ValueError):
+        raise ValueError(f"Invalid IP address: {entry!r}")
+    bits = 128 if family else 32
+    prefix_length = bits
+    if prefix:
+        if not prefix.isdigit() or int(prefix) > bits:
+            raise ValueError(f"Invalid prefix length: {entry!r}")
+        prefix_length = int(prefix)
+    host_bits = bits - prefix_length
+    first = int.from_bytes(packed, 'big') >> host_bits << host_bits
+    return family, first, first | ((1 << host_bits) - 1)
+
+
+class IPFilter:
+    """Immutable set of IPv4/IPv6 addresses and CIDR prefixes.
+
+    Entries are merged into sorted, non-overlapping ``[first, last]`` integer
+    intervals per address family, so a lookup is a single bisect regardless
+    of how many entries or prefixes the filter holds. IPv4 bounds are kept
+    in 64-bit arrays (16 bytes per merged interval) so feeds with millions
+    of entries stay compact, and a table of offsets per /16 narrows each
+    IPv4 search to the handful of intervals in the address's /16.
+    """
+
+    __slots__ = ('_starts', '_ends', '_buckets', '_size', 'rejected')
+
+    def __init__(self, entries: Iterable[str] = (), strict: bool = True):
+        # IPv4 intervals are packed into one int (first << 32 | last) so they
+        # sort as plain integers, which is much faster than sorting tuples
+        ipv4: List[int] = []
+        ipv6: List[Tuple[int, int]] = []
+        size = 0
+        rejected = 0
+        for entry in entries:
+            try:
+                family, first, last = parse_entry(entry)
+            except ValueError:
+                if strict:
+                    raise
+                rejected += 1
+                continue
+            if family:
+                ipv6.append((first, last))
+            else:
+                ipv4.append(first << 32 | last)
+            size += 1
+
+        ipv4.sort()
+        ipv4_starts = array('Q')
+        ipv4_ends = array('Q')
+        for packed in ipv4:
+            first, last = packed >> 32, packed & 0xffffffff
+            if ipv4_starts and first <= ipv4_ends[-1] + 1:
+                if last > ipv4_ends[-1]:
+                    ipv4_ends[-1] = last
+            else:
+                ipv4_starts.append(first)
+                ipv4_ends.append(last)
+        ipv6_merged = _merge(ipv6)
+        self._starts = (ipv4_starts, [first for first, _ in ipv6_merged])
+        self._ends = (ipv4_ends, [last for _, last in ipv6_merged])
+        self._buckets = _bucket_index(ipv4_starts)
+        self._size = size
+        self.rejected = rejected
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]) -> 'IPFilter':
+        """Build a filter from threat-feed style lines.
+
+        Blank lines and ``#`` comments (whole-line or trailing) are skipped,
+        and malformed entries are counted in ``rejected`` instead of raising.
+        """
+        def entries():
+            for line in lines:
+                entry = line.split('#', 1)[0].strip()
+                if entry:
+                    yield entry
+        return cls(entries(), strict=False)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'IPFilter':
+        with open(path, encoding='utf-8') as feed:
+            return cls.from_lines(feed)
+
+    def __contains__(self, address: str) -> bool:
+        # inet_pton is an order of magnitude faster than ipaddress.ip_address
+        family = 1 if ':' in address else 0
+        try:
+            packed = socket.inet_pton(socket.AF_INET6 if family else socket.AF_INET, address)
+        except (OSError, ValueError):
+            return False
+        value = int.from_bytes(packed, 'big')
+        if family and value >> 32 == _IPV4_MAPPED_PREFIX:
+            # Dual-stack sockets report IPv4 clients as ::ffff:a.b.c.d
+            family, value = 0, value & 0xffffffff
+        if family:
+            index = bisect.bisect_right(self._starts[1], value) - 1
+        else:
+            # Only the slice of intervals starting in the same /16 needs searching
+            bucket = value >> _BUCKET_SHIFT
+            index = bisect.bisect_right(
+                self._starts[0], value, self._buckets[bucket], self._buckets[bucket + 1]
+            ) - 1
+        return index >= 0 and value <= self._ends[family][index]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def interval_count(self) -> int:
+        """Number of merged intervals actually searched"""
+        return len(self._starts[0]) + len(self._starts[1])
+
+
+def _bucket_index(starts: array) -> array:
+    """Offsets into starts of the first interval beginning in each /16"""
+    buckets = array('L', [0]) * ((1 << (32 - _BUCKET_SHIFT)) + 1)
+    bucket = 0
+    for index, first in enumerate(starts):
+        while bucket <= first >> _BUCKET_SHIFT:
+            buckets[bucket] = index
+            bucket += 1
+    for remaining in range(bucket, len(buckets)):
+        buckets[remaining] = len(starts)
+    return buckets
+
+
+def _merge(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Sort intervals and merge the ones that overlap or touch"""
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+class IPLists:
+    """The active IP blocklist and allowlist, reloadable without a restart.
+
+    Allowlisted addresses are never blocked, so partner or office ranges can
+    be exempted from a broad threat feed. Both filters are published as one
+    tuple, so a reload is a single reference swap and a request never sees
+    a new blocklist paired with an old allowlist.
+
+    Lists come from AWS_SECURITY_CONFIG (``source: config``), from files
+    re-read when their mtime changes (``source: file``), or from Redis sets
+    whose ``<key>:version`` counter writers bump after updating the set
+    (``source: redis``). A failed reload keeps the previous lists.
+    """
+
+    def __init__(self,
+                 blocked: Iterable[str] = (),
+                 allowed: Iterable[str] = (),
+                 config: Optional[Dict[str, Any]] = None):
+        self.config = config or AWS_SECURITY_CONFIG['waf']['ip_lists']
+        self._lists: Tuple[IPFilter, IPFilter] = (IPFilter(blocked), IPFilter(allowed))
+        self._versions: Tuple[Any, Any] = (None, None)
+
+    @classmethod
+    def from_config(cls) -> 'IPLists':
+        waf = AWS_SECURITY_CONFIG['waf']
+        return cls(waf['blocked_ips'], waf['allowed_ips'], waf['ip_lists'])
+
+    @property
+    def blocklist(self) -> IPFilter:
+        return self._lists[0]
+
+    @property
+    def allowlist(self) -> IPFilter:
+        return self._lists[1]
+
+    def is_blocked(self, address: str) -> bool:
+        blocklist, allowlist = self._lists
+        return bool(blocklist) and address in blocklist and not (allowlist and address in allowlist)
+
+    def swap(self, blocklist: Optional[IPFilter] = None, allowlist: Optional[IPFilter] = None) -> None:
+        """Atomically replace either or both lists"""
+        current = self._lists
+        self._lists = (
+            current[0] if blocklist is None else blocklist,
+            current[1] if allowlist is None else allowlist
+        )
+        logger.info(
+            "IP lists updated: %d blocked and %d allowed entries",
+            len(self._lists[0]), len(self._lists[1])
+        )
+
+    def reload_files(self) -> bool:
+        """Reload file-backed lists whose mtime changed; returns True if swapped"""
+        paths = (self.config['blocklist_path'], self.config['allowlist_path'])
+        filters: List[Optional[IPFilter]] = [None, None]
+        versions = list(self._versions)
+        for index, path in enumerate(paths):
+            if not path:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                logger.warning("IP list %s is missing; keeping the current list", path)
+                continue
+            if mtime == versions[index]:
+                continue
+            filters[index] = IPFilter.from_file(path)
+            versions[index] = mtime
+            if filters[index].rejected:
+                logger.warning("Skipped %d malformed entries in %s", filters[index].rejected, path)
+        if filters[0] is None and filters[1] is None:
+            return False
+        self.swap(*filters)
+        self._versions = tuple(versions)
+        return True
+
+    async def reload_redis(self, client: Any) -> bool:
+        """Reload Redis-backed lists whose version changed; returns True if swapped"""
+        keys = (self.config['redis_blocklist_key'], self.config['redis_allowlist_key'])
+        current_versions = await client.mget([f"{key}:version" for key in keys])
+        filters: List[Optional[IPFilter]] = [None, None]
+        versions = list(self._versions)
+        for index, key in enumerate(keys):
+            version = current_versions[index]
+            if version is None or version == versions[index]:
+                continue
+            members = await client.smembers(key)
+            entries = [member.decode() if isinstance(member, bytes) else member for member in members]
+            filters[index] = await asyncio.to_thread(IPFilter.from_lines, entries)
+            versions[index] = version
+        if filters[0] is None and filters[1] is None:
+            return False
+        self.swap(*filters)
+        self._versions = tuple(versions)
+        return True
+
+    async def watch(self) -> None:
+        """Poll the configured source for changes; runs until cancelled"""
+        source = self.config['source']
+        if source == 'config':
+            return
+        if source not in ('file', 'redis'):
+            raise ValueError(f"Unknown IP list source: {source}")
+
+        while True:
+            try:
+                if source == 'file':
+                    # Parsing a large feed is CPU-bound, keep it off the event loop
+                    await asyncio.to_thread(self.reload_files)
+                else:
+                    await self.reload_redis(get_redis())
+            except (OSError, RedisError) as e:
+                logger.warning("IP list reload failed, keeping the current lists: %s", e)
+            except Exception:
+                # A bad feed or a bug in one reload must not stop later reloads
+                logger.exception("IP list reload failed, keeping the current lists")
+            await asyncio.sleep(self.config['reload_interval_seconds'])
+
+
+ip_lists = IPLists.from_config()
+
+
+def _feed_lines(entries: int, rng: random.Random) -> List[str]:
+    """A synthetic threat feed: mostly single IPv4 hosts, some IPv4 /24s and IPv6 /64s"""
+    lines = []
+    for _ in range(entries):
+        kind = rng.random()
+        if kind < 0.9:
+            lines.append(socket.inet_ntoa(rng.getrandbits(32).to_bytes(4, 'big')))
+        elif kind < 0.97:
+            lines.append(socket.inet_ntoa((rng.getrandbits(24) << 8).to_bytes(4, 'big')) + '/24')
+        else:
+            prefix = (0x2001 << 112 | rng.getrandbits(48) << 64).to_bytes(16, 'big')
+            lines.append(socket.inet_ntop(socket.AF_INET6, prefix) + '/64')
+    return lines
+
+
+def benchmark(entries: int, lookups: int) -> Dict[str, Any]:
+    """Build a filter from a threat feed of the given size and time lookups against it"""
+    rng = random.Random(0)
+    lines = _feed_lines(entries, rng)
+    started = time.perf_counter()
+    feed = IPFilter.from_lines(lines)
+    build_seconds = time.perf_counter() - started
+
+    # Half listed hosts, half random addresses (nearly all misses)
+    hosts = [line for line in lines if '/' not in line]
+    probes = [
+        rng.choice(hosts) if index % 2 else socket.inet_ntoa(rng.getrandbits(32).to_bytes(4, 'big'))
+        for index in range(lookups)
+    ]
+    matched = 0
+    started = time.perf_counter()
+    for address in probes:
+        if address in feed:
+            matched += 1
+    lookup_seconds = time.perf_counter() - started
+    starts, ends = feed._starts, feed._ends
+    array_bytes = (starts[0].itemsize * len(starts[0]) + ends[0].itemsize * len(ends[0])
+                   + feed._buckets.itemsize * len(feed._buckets))
+    return {
+        'entries': len(feed),
+        'intervals': feed.interval_count(),
+        'build_seconds': round(build_seconds, 2),
+        'ipv4_array_megabytes': round(array_bytes / 2 ** 20, 1),
+        'lookups': lookups,
+        'matched': matched,
+        'microseconds_per_lookup': round(lookup_seconds / lookups * 1e6, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the IP filter on a synthetic threat feed")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help="Measure build time, memory and lookup latency")
+    bench_parser.add_argument('--entries', type=int, default=1000000)
+    bench_parser.add_argument('--lookups', type=int, default=1000000)
+    args = parser.parse_args()
+
+    result = benchmark(args.entries, args.lookups)
+    for name, value in result.items():
+        print(f"{name}\t{value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import itertools
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.core.aws import get_client
+from app.core.security_config import SENSITIVE_FIELDS
+from app.services.audit_service import audit_service
+from app.services.gdpr_export import save_json
+from app.services.job_queue import Handler, JobContext, PermanentJobError
+from app.services.s3_export import MultipartUploadWriter, stored_parts
+from app.services.security_service import DecryptionError, security_service
+
+# How often re-encryption publishes its record count
+_REPORT_EVERY = 1000
+# Version of the re-encryption checkpoint file
+_REENCRYPTION_FORMAT = 1
+
+
+class JobType(NamedTuple):
+    """A job handler and the permissions needed to enqueue or inspect its jobs"""
+    handler: Handler
+    permissions: List[str]
+
+
+def export_user_data(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    """Upload a user's GDPR export to S3; a retry resumes from the job's checkpoint"""
+    try:
+        report = audit_service.export_user_data_to_s3(payload['user_id'], context.checkpoint_path, context.report)
+    except ValueError as e:
+        raise PermanentJobError(str(e)) from e
+    return {
+        'bucket': report['bucket'],
+        'key': report['key'],
+        'url': report['url'],
+        'url_expires_in': report['url_expires_in'],
+        'records': report['records'],
+        # Sources whose store is not implemented yet; the export does not contain their data
+        'unavailable_sources': report['unavailable_sources'],
+    }
+
+
+def delete_user_data(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    """Erase a user's data; every step is idempotent, so a retry starts over"""
+    return audit_service.delete_user_data(payload['user_id'], context.report)
+
+
+def reencrypt_records(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    """Re-encrypt a JSON Lines object in AWS_S3_BUCKET under the current key.
+
+    Records are streamed from source_key through SecurityService and
+    uploaded to destination_key as they come out, with parts cut at record
+    boundaries. The job's checkpoint records the upload and how many source
+    records each completed part covers, so a retry skips those records and
+    continues the same upload. The new object is only completed if every
+    record was re-encrypted.
+    """
+    # Settings are read on first use so importing this module needs no environment
+    from app.core.config import settings
+
+    data_type = payload['data_type']
+    if data_type not in SENSITIVE_FIELDS:
+        raise PermanentJobError(f"Unknown data type: {data_type}")
+    if not settings.AWS_S3_BUCKET:
+        raise PermanentJobError("AWS_S3_BUCKET is not configured")
+    bucket = settings.AWS_S3_BUCKET
+    client = get_client('s3', settings.AWS_S3_ENDPOINT_URL)
+
+    checkpoint_path = context.checkpoint_path
+    upload = _resume_reencryption(client, bucket, payload, checkpoint_path)
+    if upload is None:
+        upload = {
+            'format_version': _REENCRYPTION_FORMAT,
+            'bucket': bucket,
+            'source_key': payload['source_key'],
+            'destination_key': payload['destination_key'],
+            'upload_id': client.create_multipart_upload(
+                Bucket=bucket,
+                Key=payload['destination_key'],
+                ContentType='application/x-ndjson',
+                ChecksumAlgorithm='SHA256'
+            )['UploadId'],
+            'parts': [],
+        }
+        save_json(checkpoint_path, upload)
+    parts = upload['parts']
+    # Everything was uploaded before; only completing the upload failed
+    uploaded = bool(parts) and parts[-1].get('final', False)
+    progress = {'source_key': payload['source_key'], 'records': parts[-1]['state']['records'] if parts else 0}
+
+    def on_parts(parts: List[Dict[str, Any]]) -> None:
+        upload['parts'] = parts
+        save_json(checkpoint_path, upload)
+
+    writer = MultipartUploadWriter(
+        client, bucket, payload['destination_key'], upload['upload_id'], parts=parts, on_parts=on_parts
+    )
+    try:
+        if not uploaded:
+            _reencrypt_from(client.get_object(Bucket=bucket, Key=payload['source_key'])['Body'],
+                            writer, data_type, progress, context)
+        writer.complete({'records': progress['records']})
+    except PermanentJobError:
+        writer.abort()
+        os.remove(checkpoint_path)
+        raise
+    except BaseException:
+        # Left open so the retry continues after the parts already uploaded
+        writer.close()
+        raise
+    os.remove(checkpoint_path)
+    return {'bucket': bucket, 'key': payload['destination_key'], 'records': progress['records']}
+
+
+def _reencrypt_from(source: Any,
+                    writer: MultipartUploadWriter,
+                    data_type: str,
+                    progress: Dict[str, Any],
+                    context: JobContext) -> None:
+    """Re-encrypt the source records after the first progress['records'] into writer"""
+    try:
+        lines = (line for line in source.iter_lines() if line.strip())
+        for index, line in enumerate(itertools.islice(lines, progress['records'], None), progress['records']):
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise PermanentJobError(f"Record {index} is not valid JSON: {e}") from e
+            try:
+                record = security_service.reencrypt_sensitive_data(record, data_type)
+            except DecryptionError as e:
+                raise PermanentJobError(f"Record {index} cannot be decrypted: {e}") from e
+            writer.write((json.dumps(record) + '\n').encode('utf-8'))
+            progress['records'] += 1
+            writer.mark({'records': progress['records']})
+            if progress['records'] % _REPORT_EVERY == 0:
+                context.report(dict(progress))
+    finally:
+        source.close()
+
+
+def _resume_reencryption(client: Any,
+                         bucket: str,
+                         payload: Dict[str, Any],
+                         checkpoint_path: str) -> Optional[Dict[str, Any]]:
+    """Load the checkpointed upload, keeping only the parts S3 still holds"""
+    try:
+        with open(checkpoint_path, encoding='utf-8') as checkpoint_file:
+            upload = json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+    if (upload.get('format_version') != _REENCRYPTION_FORMAT
+            or upload.get('bucket') != bucket
+            or upload.get('source_key') != payload['source_key']
+            or upload.get('destination_key') != payload['destination_key']):
+        return None
+    parts = stored_parts(client, bucket, upload['destination_key'], upload['upload_id'], upload['parts'])
+    if parts is None:
+        # The upload was aborted, completed or expired; start a new one
+        return None
+    upload['parts'] = parts
+    return upload
+
+
+JOB_TYPES: Dict[str, JobType] = {
+    'gdpr_export': JobType(export_user_data, ['manage_compliance']),
+    'gdpr_deletion': JobType(delete_user_data, ['manage_compliance']),
+    'reencryption': JobType(reencrypt_records, ['manage_encryption_keys']),
+}
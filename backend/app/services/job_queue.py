@@ -0,0 +1,449 @@
+"""
+Redis-backed queue for work too long to run in a request.
+
+The API enqueues a job and returns its id at once; ``python -m app.worker``
+processes claim jobs and run them, a bounded number at a time. Each job is
+a hash under ``<prefix>:job:<id>``. Due jobs wait in the ``queue`` sorted
+set scored by when they may run, which also holds retries until their
+backoff has passed. Claimed jobs move to the ``running`` set scored by
+their lease deadline; a worker extends the lease with every heartbeat, and
+jobs whose worker died are handed out again once their lease lapses.
+
+At most one unfinished job of each type exists per user: enqueueing another
+returns the id of the one already queued or running.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, Union
+
+from app.core.security_config import JOBS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# All scripts use the Redis server clock, so workers on different hosts agree on time
+_NOW_MS = '''
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+'''
+
+# KEYS: job, queue, dedupe. ARGV: id, type, user_id, payload, max_attempts, dedupe flag, dedupe ttl ms
+ENQUEUE_SCRIPT = _NOW_MS + '''
+if ARGV[6] == '1' then
+  local existing = redis.call('GET', KEYS[3])
+  if existing then
+    return {existing, 0}
+  end
+  -- Expires on its own in case the job is lost without being settled
+  redis.call('SET', KEYS[3], ARGV[1], 'PX', ARGV[7])
+end
+redis.call('HSET', KEYS[1], 'id', ARGV[1], 'type', ARGV[2], 'user_id', ARGV[3], 'payload', ARGV[4],
+           'status', 'queued', 'attempts', 0, 'max_attempts', ARGV[5], 'dedupe_key', ARGV[6] == '1' and KEYS[3] or '',
+           'created_at', now, 'updated_at', now)
+redis.call('ZADD', KEYS[2], now, ARGV[1])
+return {ARGV[1], 1}
+'''
+
+# KEYS: queue, running. ARGV: job key prefix, worker, lease ms
+CLAIM_SCRIPT = _NOW_MS + '''
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1)
+if #ids == 0 then
+  return false
+end
+local id = ids[1]
+local key = ARGV[1] .. id
+redis.call('ZREM', KEYS[1], id)
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), id)
+redis.call('HSET', key, 'status', 'running', 'worker', ARGV[2], 'started_at', now, 'updated_at', now)
+redis.call('HINCRBY', key, 'attempts', 1)
+return redis.call('HGETALL', key)
+'''
+
+# KEYS: running, job. ARGV: id, worker, lease ms, progress
+HEARTBEAT_SCRIPT = _NOW_MS + '''
+if redis.call('HGET', KEYS[2], 'worker') ~= ARGV[2] or redis.call('HGET', KEYS[2], 'status') ~= 'running' then
+  return 0
+end
+redis.call('ZADD', KEYS[1], 'XX', now + tonumber(ARGV[3]), ARGV[1])
+redis.call('HSET', KEYS[2], 'progress', ARGV[4], 'updated_at', now)
+return 1
+'''
+
+# KEYS: running, job. ARGV: id, worker, status, result, error, progress, ttl ms
+FINISH_SCRIPT = _NOW_MS + '''
+if redis.call('HGET', KEYS[2], 'worker') ~= ARGV[2] or redis.call('HGET', KEYS[2], 'status') ~= 'running' then
+  return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], 'status', ARGV[3], 'result', ARGV[4], 'error', ARGV[5], 'progress', ARGV[6],
+           'finished_at', now, 'updated_at', now)
+redis.call('PEXPIRE', KEYS[2], ARGV[7])
+local dedupe = redis.call('HGET', KEYS[2], 'dedupe_key')
+if dedupe and dedupe ~= '' and redis.call('GET', dedupe) == ARGV[1] then
+  redis.call('DEL', dedupe)
+end
+return 1
+'''
+
+# KEYS: running, queue, job. ARGV: id, worker, delay ms, error, progress
+RETRY_SCRIPT = _NOW_MS + '''
+if redis.call('HGET', KEYS[3], 'worker') ~= ARGV[2] or redis.call('HGET', KEYS[3], 'status') ~= 'running' then
+  return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), ARGV[1])
+redis.call('HSET', KEYS[3], 'status', 'queued', 'error', ARGV[4], 'progress', ARGV[5],
+           'run_at', now + tonumber(ARGV[3]), 'updated_at', now)
+return 1
+'''
+
+# KEYS: running, queue. ARGV: job key prefix, ttl ms
+REAP_SCRIPT = _NOW_MS + '''
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 100)
+for _, id in ipairs(expired) do
+  local key = ARGV[1] .. id
+  redis.call('ZREM', KEYS[1], id)
+  local attempts = tonumber(redis.call('HGET', key, 'attempts') or '0')
+  local max_attempts = tonumber(redis.call('HGET', key, 'max_attempts') or '1')
+  if attempts >= max_attempts then
+    redis.call('HSET', key, 'status', 'failed', 'error', 'worker stopped responding', 'finished_at', now, 'updated_at', now)
+    redis.call('PEXPIRE', key, ARGV[2])
+    local dedupe = redis.call('HGET', key, 'dedupe_key')
+    if dedupe and dedupe ~= '' and redis.call('GET', dedupe) == id then
+      redis.call('DEL', dedupe)
+    end
+  else
+    redis.call('ZADD', KEYS[2], now, id)
+    redis.call('HSET', key, 'status', 'queued', 'error', 'worker stopped responding', 'updated_at', now)
+  end
+end
+return #expired
+'''
+
+_TIMESTAMP_FIELDS = ('created_at', 'updated_at', 'started_at', 'finished_at', 'run_at')
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler for a failure that retrying cannot fix"""
+
+
+# Failures that are not retried, also when they are the cause of another exception
+_PERMANENT_ERRORS = (PermanentJobError, NotImplementedError)
+
+
+class JobContext:
+    """Handed to a running handler so it can report progress.
+
+    ``report`` only records the latest progress; the worker publishes it
+    with the next heartbeat, so handlers can call it as often as they like.
+    """
+
+    def __init__(self, job: Dict[str, Any], checkpoint_dir: str):
+        self.job_id = job['id']
+        self.attempt = job['attempts']
+        self.progress: Dict[str, Any] = job.get('progress') or {}
+        self.checkpoint_dir = checkpoint_dir
+
+    def report(self, progress: Dict[str, Any]) -> None:
+        self.progress = progress
+
+    @property
+    def checkpoint_path(self) -> str:
+        """Where the handler can keep state that lets a retry resume"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        return os.path.join(self.checkpoint_dir, f"{self.job_id}.json")
+
+
+Handler = Callable[[Dict[str, Any], JobContext], Union[Optional[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]]
+
+
+class JobQueue:
+    """Enqueue, claim and settle jobs; every state change is one Lua script"""
+
+    def __init__(self,
+                 client: Any,
+                 key_prefix: str = 'jobs',
+                 max_attempts: int = 5,
+                 retry_backoff: float = 30.0,
+                 max_retry_backoff: float = 3600.0,
+                 result_ttl: float = 7 * 86400):
+        self.client = client
+        self.key_prefix = key_prefix
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.result_ttl_ms = int(result_ttl * 1000)
+        self._queue_key = f"{key_prefix}:queue"
+        self._running_key = f"{key_prefix}:running"
+        self._enqueue = client.register_script(ENQUEUE_SCRIPT)
+        self._claim = client.register_script(CLAIM_SCRIPT)
+        self._heartbeat = client.register_script(HEARTBEAT_SCRIPT)
+        self._finish = client.register_script(FINISH_SCRIPT)
+        self._retry = client.register_script(RETRY_SCRIPT)
+        self._reap = client.register_script(REAP_SCRIPT)
+
+    @classmethod
+    def from_config(cls, client: Any) -> 'JobQueue':
+        return cls(
+            client,
+            key_prefix=JOBS_CONFIG['key_prefix'],
+            max_attempts=JOBS_CONFIG['max_attempts'],
+            retry_backoff=JOBS_CONFIG['retry_backoff_seconds'],
+            max_retry_backoff=JOBS_CONFIG['max_retry_backoff_seconds'],
+            result_ttl=JOBS_CONFIG['result_ttl_seconds']
+        )
+
+    async def enqueue(self,
+                      job_type: str,
+                      payload: Dict[str, Any],
+                      user_id: Optional[str] = None) -> Tuple[str, bool]:
+        """Queue a job; returns its id and whether it was created.
+
+        Jobs with a user_id are deduplicated per type and user, so a repeat
+        request while one is unfinished returns the existing job's id.
+        """
+        job_id = uuid.uuid4().hex
+        reply = await self._enqueue(
+            keys=[self._job_key(job_id), self._queue_key, f"{self.key_prefix}:dedupe:{job_type}:{user_id}"],
+            args=[job_id, job_type, user_id or '', json.dumps(payload), self.max_attempts,
+                  '1' if user_id else '0', self.result_ttl_ms]
+        )
+        return _text(reply[0]), bool(int(reply[1]))
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's status, progress and outcome, or None if unknown or expired"""
+        fields = await self.client.hgetall(self._job_key(job_id))
+        if not fields:
+            return None
+        job = _decode(fields)
+        for name in _TIMESTAMP_FIELDS:
+            if job.get(name) is not None:
+                job[name] = datetime.fromtimestamp(job[name] / 1000, tz=timezone.utc).isoformat()
+        job.pop('dedupe_key', None)
+        job.pop('worker', None)
+        return job
+
+    async def claim(self, worker_id: str, lease: float) -> Optional[Dict[str, Any]]:
+        """Take the next due job, holding it for lease seconds"""
+        reply = await self._claim(
+            keys=[self._queue_key, self._running_key],
+            args=[self._job_key(''), worker_id, int(lease * 1000)]
+        )
+        if not reply:
+            return None
+        return _decode(dict(zip(reply[::2], reply[1::2])))
+
+    async def heartbeat(self, job: Dict[str, Any], worker_id: str, lease: float, progress: Dict[str, Any]) -> bool:
+        """Extend the job's lease and publish progress; False if the job was lost"""
+        reply = await self._heartbeat(
+            keys=[self._running_key, self._job_key(job['id'])],
+            args=[job['id'], worker_id, int(lease * 1000), json.dumps(progress, default=str)]
+        )
+        return bool(reply)
+
+    async def succeed(self,
+                      job: Dict[str, Any],
+                      worker_id: str,
+                      result: Optional[Dict[str, Any]],
+                      progress: Dict[str, Any]) -> bool:
+        return bool(await self._finish(
+            keys=[self._running_key, self._job_key(job['id'])],
+            args=[job['id'], worker_id, SUCCEEDED, json.dumps(result, default=str), '',
+                  json.dumps(progress, default=str), self.result_ttl_ms]
+        ))
+
+    async def fail(self,
+                   job: Dict[str, Any],
+                   worker_id: str,
+                   error: str,
+                   progress: Dict[str, Any],
+                   retry: bool = True) -> bool:
+        """Schedule a retry with exponential backoff, or fail the job for good"""
+        progress_value = json.dumps(progress, default=str)
+        if retry and job['attempts'] < job['max_attempts']:
+            delay = min(self.retry_backoff * 2 ** (job['attempts'] - 1), self.max_retry_backoff)
+            delay *= random.uniform(0.5, 1.5)
+            return bool(await self._retry(
+                keys=[self._running_key, self._queue_key, self._job_key(job['id'])],
+                args=[job['id'], worker_id, int(delay * 1000), error, progress_value]
+            ))
+        return bool(await self._finish(
+            keys=[self._running_key, self._job_key(job['id'])],
+            args=[job['id'], worker_id, FAILED, 'null', error, progress_value, self.result_ttl_ms]
+        ))
+
+    async def requeue_expired(self) -> int:
+        """Return jobs whose worker stopped heartbeating to the queue"""
+        return int(await self._reap(
+            keys=[self._running_key, self._queue_key],
+            args=[self._job_key(''), self.result_ttl_ms]
+        ))
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.key_prefix}:job:{job_id}"
+
+
+class JobWorker:
+    """Claim jobs and run them, at most ``concurrency`` at a time.
+
+    Synchronous handlers run on threads and async ones on the worker's
+    event loop. Handler failures are retried with backoff unless they are
+    permanent (``PermanentJobError``, ``NotImplementedError`` or an unknown
+    job type). ``stop`` lets the running jobs finish before ``run`` returns.
+    """
+
+    def __init__(self,
+                 queue: JobQueue,
+                 handlers: Dict[str, Handler],
+                 concurrency: int = 4,
+                 poll_interval: float = 1.0,
+                 lease: float = 120.0,
+                 heartbeat_interval: float = 15.0,
+                 checkpoint_dir: str = '/tmp/dynamis-jobs'):
+        if heartbeat_interval >= lease:
+            raise ValueError("heartbeat_interval must be shorter than the lease")
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.heartbeat_interval = heartbeat_interval
+        self.checkpoint_dir = checkpoint_dir
+        self.worker_id = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stopping = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @classmethod
+    def from_config(cls, queue: JobQueue, handlers: Dict[str, Handler], concurrency: Optional[int] = None) -> 'JobWorker':
+        return cls(
+            queue,
+            handlers,
+            concurrency=concurrency or JOBS_CONFIG['concurrency'],
+            poll_interval=JOBS_CONFIG['poll_interval_seconds'],
+            lease=JOBS_CONFIG['lease_seconds'],
+            heartbeat_interval=JOBS_CONFIG['heartbeat_interval_seconds'],
+            checkpoint_dir=JOBS_CONFIG['checkpoint_dir']
+        )
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        """Process jobs until stop is called"""
+        slots = asyncio.Semaphore(self.concurrency)
+        logger.info("Job worker %s started with concurrency %d", self.worker_id, self.concurrency)
+        while not self._stopping.is_set():
+            await slots.acquire()
+            job = None
+            try:
+                await self.queue.requeue_expired()
+                job = await self.queue.claim(self.worker_id, self.lease)
+            except Exception as e:
+                logger.warning("Claiming a job failed: %s", e)
+            if job is None:
+                slots.release()
+                await self._idle()
+                continue
+            task = asyncio.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info("Job worker %s stopped", self.worker_id)
+
+    async def _idle(self) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        context = JobContext(job, self.checkpoint_dir)
+        heartbeat = asyncio.create_task(self._heartbeat(job, context))
+        logger.info("Running %s job %s, attempt %d", job['type'], job['id'], job['attempts'])
+        try:
+            handler = self.handlers.get(job['type'])
+            if handler is None:
+                raise PermanentJobError(f"Unknown job type: {job['type']}")
+            if asyncio.iscoroutinefunction(handler):
+                result = await handler(job['payload'], context)
+            else:
+                result = await asyncio.to_thread(handler, job['payload'], context)
+        except Exception as e:
+            heartbeat.cancel()
+            permanent = _is_permanent(e)
+            logger.warning("%s job %s failed%s: %s", job['type'], job['id'],
+                           '' if permanent else ', will retry', e)
+            await self._settle(self.queue.fail(job, self.worker_id, str(e), context.progress, retry=not permanent))
+            return
+        heartbeat.cancel()
+        await self._settle(self.queue.succeed(job, self.worker_id, result, context.progress))
+
+    async def _settle(self, update: Awaitable[bool]) -> None:
+        try:
+            if not await update:
+                # The lease lapsed and another worker took the job over
+                logger.warning("Job outcome discarded: lease was lost")
+        except Exception as e:
+            # The lease will lapse and the job is run again
+            logger.warning("Recording a job outcome failed: %s", e)
+
+    async def _heartbeat(self, job: Dict[str, Any], context: JobContext) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                if not await self.queue.heartbeat(job, self.worker_id, self.lease, context.progress):
+                    logger.warning("Lost the lease on %s job %s", job['type'], job['id'])
+                    return
+            except Exception as e:
+                logger.warning("Heartbeat for job %s failed: %s", job['id'], e)
+
+
+def _is_permanent(error: BaseException) -> bool:
+    while error is not None:
+        if isinstance(error, _PERMANENT_ERRORS):
+            return True
+        error = error.__cause__
+    return False
+
+
+def _text(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _decode(fields: Dict[Any, Any]) -> Dict[str, Any]:
+    job: Dict[str, Any] = {_text(name): _text(value) for name, value in fields.items()}
+    for name in ('payload', 'progress', 'result'):
+        if job.get(name):
+            job[name] = json.loads(job[name])
+    for name in ('attempts', 'max_attempts') + _TIMESTAMP_FIELDS:
+        if job.get(name) not in (None, ''):
+            job[name] = int(job[name])
+    job['user_id'] = job.get('user_id') or None
+    job['error'] = job.get('error') or None
+    return job
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue on the shared Redis pool"""
+    global _queue
+    if _queue is None:
+        # Imported on first use so the queue can be built around any client in tests
+        from app.core.redis import get_redis
+
+        _queue = JobQueue.from_config(get_redis())
+    return _queue
@@ -0,0 +1,290 @@
+"""
+In-process rate limiters.
+
+Usage:
+    python -m app.services.rate_limiter bench --keys 200000
+"""
+
+import abc
+import argparse
+import math
+import random
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.security_config import RATE_LIMIT_CONFIG
+
+
+class RateLimitResult:
+    """Outcome of a rate limit check; truthy when the request is allowed"""
+
+    __slots__ = ('allowed', 'limit', 'remaining', 'reset_after', 'retry_after')
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset_after: float, retry_after: float = 0.0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_after = reset_after
+        self.retry_after = retry_after
+
+    def __bool__(self) -> bool:
+        return self.allowed
+
+    def headers(self) -> Dict[str, str]:
+        """Return the X-RateLimit-* (and, when rejected, Retry-After) headers"""
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+    def raw_headers(self) -> List[Tuple[bytes, bytes]]:
+        """The same headers as raw ASGI header pairs"""
+        return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in self.headers().items()]
+
+
+class RateLimiter(abc.ABC):
+    """Base class for in-process rate limiters keyed by client identity.
+
+    Per-key state lives in an OrderedDict kept in last-seen order, so idle
+    keys are evicted from the front in amortized O(1) and the number of
+    tracked keys never exceeds ``max_keys``.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 1000000, idle_timeout: Optional[float] = None):
+        if limit <= 0 or window <= 0:
+            raise ValueError("limit and window must be positive")
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.idle_timeout = idle_timeout if idle_timeout is not None else window
+        self._state: 'OrderedDict[str, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, now: Optional[float] = None) -> RateLimitResult:
+        """Record one request for key and return whether it is allowed"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                state = self._new_state(now)
+                self._state[key] = state
+            else:
+                self._state.move_to_end(key)
+            result = self._check(state, now)
+            self._evict(now)
+        return result
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._state.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def _evict(self, now: float) -> None:
+        state = self._state
+        while state:
+            key, oldest = next(iter(state.items()))
+            if len(state) <= self.max_keys and now - self._last_seen(oldest) < self.idle_timeout:
+                break
+            del state[key]
+
+    @abc.abstractmethod
+    def _new_state(self, now: float) -> Any:
+        """State for a key seen for the first time at ``now``"""
+
+    @abc.abstractmethod
+    def _last_seen(self, state: Any) -> float:
+        """When the key owning ``state`` last made a request"""
+
+    @abc.abstractmethod
+    def _check(self, state: Any, now: float) -> RateLimitResult:
+        """Count a request at ``now`` against ``state``"""
+
+
+class TokenBucketLimiter(RateLimiter):
+    """Bucket of ``limit`` tokens refilled continuously over ``window`` seconds"""
+
+    def __init__(self, limit: int, window: float, **kwargs):
+        super().__init__(limit, window, **kwargs)
+        self.refill_rate = limit / window
+
+    def _new_state(self, now: float) -> list:
+        # [tokens, last refill time]
+        return [float(self.limit), now]
+
+    def _last_seen(self, state: list) -> float:
+        return state[1]
+
+    def _check(self, state: list, now: float) -> RateLimitResult:
+        tokens = min(float(self.limit), state[0] + (now - state[1]) * self.refill_rate)
+        state[1] = now
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        state[0] = tokens
+        return RateLimitResult(
+            allowed=allowed,
+            limit=self.limit,
+            remaining=int(tokens),
+            reset_after=(self.limit - tokens) / self.refill_rate,
+            retry_after=0.0 if allowed else (1.0 - tokens) / self.refill_rate
+        )
+
+
+class SlidingWindowLogLimiter(RateLimiter):
+    """Exact sliding window over the timestamps of accepted requests.
+
+    Memory per key grows with ``limit``; prefer the counter variant for
+    large limits.
+    """
+
+    def _new_state(self, now: float) -> deque:
+        return deque(maxlen=self.limit)
+
+    def _last_seen(self, state: deque) -> float:
+        return state[-1] if state else -math.inf
+
+    def _check(self, state: deque, now: float) -> RateLimitResult:
+        boundary = now - self.window
+        while state and state[0] <= boundary:
+            state.popleft()
+        allowed = len(state) < self.limit
+        if allowed:
+            state.append(now)
+        oldest = state[0] if state else now
+        return RateLimitResult(
+            allowed=allowed,
+            limit=self.limit,
+            remaining=self.limit - len(state),
+            reset_after=oldest + self.window - now,
+            retry_after=0.0 if allowed else oldest + self.window - now
+        )
+
+
+class SlidingWindowCounterLimiter(RateLimiter):
+    """Approximate sliding window from the current and previous fixed windows"""
+
+    def __init__(self, limit: int, window: float, **kwargs):
+        kwargs.setdefault('idle_timeout', 2 * window)
+        super().__init__(limit, window, **kwargs)
+
+    def _new_state(self, now: float) -> list:
+        # [current window start, previous window count, current window count, last seen]
+        return [now - now % self.window, 0, 0, now]
+
+    def _last_seen(self, state: list) -> float:
+        return state[3]
+
+    def _check(self, state: list, now: float) -> RateLimitResult:
+        window_start = now - now % self.window
+        if window_start != state[0]:
+            elapsed_windows = (window_start - state[0]) / self.window
+            state[1] = state[2] if elapsed_windows < 1.5 else 0
+            state[2] = 0
+            state[0] = window_start
+        state[3] = now
+
+        into_window = now - window_start
+        weight = 1.0 - into_window / self.window
+        estimated = state[1] * weight + state[2]
+        allowed = estimated < self.limit
+        if allowed:
+            state[2] += 1
+            estimated += 1
+
+        retry_after = 0.0
+        if not allowed:
+            if state[1]:
+                # Time until the previous window's weighted share drops enough to admit one request
+                needed = estimated - self.limit + 1
+                retry_after = min(self.window - into_window, needed * self.window / state[1])
+            else:
+                retry_after = self.window - into_window
+        return RateLimitResult(
+            allowed=allowed,
+            limit=self.limit,
+            remaining=max(0, int(self.limit - estimated)),
+            reset_after=self.window - into_window,
+            retry_after=retry_after
+        )
+
+
+ALGORITHMS = {
+    'token_bucket': TokenBucketLimiter,
+    'sliding_window_log': SlidingWindowLogLimiter,
+    'sliding_window_counter': SlidingWindowCounterLimiter,
+}
+
+
+def create_rate_limiter(config: Optional[Dict[str, Any]] = None) -> RateLimiter:
+    """Build the rate limiter selected by RATE_LIMIT_CONFIG (or config)"""
+    config = config or RATE_LIMIT_CONFIG
+    try:
+        limiter_class = ALGORITHMS[config['algorithm']]
+    except KeyError:
+        raise ValueError(f"Unknown rate limit algorithm: {config['algorithm']}")
+    return limiter_class(
+        config['limit'],
+        config['window_seconds'],
+        max_keys=config['max_tracked_keys']
+    )
+
+
+def benchmark(algorithm: str, keys: int, checks: int, limit: int = 2000, window: float = 300.0) -> Dict[str, Any]:
+    """Measure hit() throughput and memory per tracked key for one algorithm"""
+    limiter = ALGORITHMS[algorithm](limit, window, max_keys=keys)
+    names = [f"ip:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(keys)]
+
+    # Memory: one hit per key, so every key holds state
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    now = time.monotonic()
+    for name in names:
+        limiter.hit(name, now)
+    state_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    # Throughput: random keys from the tracked set, as from many distinct clients
+    rng = random.Random(0)
+    stream = [names[rng.randrange(keys)] for _ in range(checks)]
+    hit = limiter.hit
+    started = time.perf_counter()
+    for name in stream:
+        hit(name)
+    elapsed = time.perf_counter() - started
+    return {
+        'algorithm': algorithm,
+        'tracked_keys': len(limiter),
+        'checks_per_second': round(checks / elapsed),
+        'microseconds_per_check': round(elapsed / checks * 1e6, 2),
+        'bytes_per_key': round(state_bytes / keys),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the in-process rate limiters")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help="Measure checks per second and memory per tracked key")
+    bench_parser.add_argument('--algorithm', choices=sorted(ALGORITHMS) + ['all'], default='all')
+    bench_parser.add_argument('--keys', type=int, default=200000)
+    bench_parser.add_argument('--checks', type=int, default=1000000)
+    bench_parser.add_argument('--limit', type=int, default=RATE_LIMIT_CONFIG['limit'])
+    args = parser.parse_args()
+
+    algorithms = sorted(ALGORITHMS) if args.algorithm == 'all' else [args.algorithm]
+    for algorithm in algorithms:
+        result = benchmark(algorithm, args.keys, args.checks, args.limit, RATE_LIMIT_CONFIG['window_seconds'])
+        print('\t'.join(f"{name}={value}" for name, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+from redis.exceptions import RedisError
+
+from app.core.security_config import RATE_LIMIT_CONFIG
+from app.services.rate_limiter import RateLimiter, RateLimitResult, create_rate_limiter
+
+# Each script updates a single key atomically using the Redis server clock,
+# so every worker shares one view of time and of the counters.
+_NOW_MS = '''
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+'''
+
+TOKEN_BUCKET_SCRIPT = _NOW_MS + '''
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local rate = limit / window
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1]) or limit
+local ts = tonumber(state[2]) or now
+tokens = math.min(limit, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+  allowed = 1
+  tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], window)
+return {allowed, tostring(tokens)}
+'''
+
+SLIDING_WINDOW_LOG_SCRIPT = _NOW_MS + '''
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+local allowed = 0
+if count < limit then
+  allowed = 1
+  count = count + 1
+  redis.call('ZADD', KEYS[1], now, ARGV[3])
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+redis.call('PEXPIRE', KEYS[1], window)
+return {allowed, count, oldest[2] or tostring(now), now}
+'''
+
+SLIDING_WINDOW_COUNTER_SCRIPT = _NOW_MS + '''
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local start = now - (now % window)
+local state = redis.call('HMGET', KEYS[1], 's', 'p', 'c')
+local s = tonumber(state[1]) or start
+local p = tonumber(state[2]) or 0
+local c = tonumber(state[3]) or 0
+if s ~= start then
+  if start - s == window then p = c else p = 0 end
+  c = 0
+end
+local into = now - start
+local estimated = p * (1 - into / window) + c
+local allowed = 0
+if estimated < limit then
+  allowed = 1
+  c = c + 1
+end
+redis.call('HSET', KEYS[1], 's', start, 'p', p, 'c', c)
+redis.call('PEXPIRE', KEYS[1], window * 2)
+return {allowed, p, c, into}
+'''
+
+SCRIPTS = {
+    'token_bucket': TOKEN_BUCKET_SCRIPT,
+    'sliding_window_log': SLIDING_WINDOW_LOG_SCRIPT,
+    'sliding_window_counter': SLIDING_WINDOW_COUNTER_SCRIPT,
+}
+
+FAILURE_MODES = ('local', 'open', 'closed')
+
+
+class RedisRateLimiter:
+    """Rate limiter whose counters live in Redis and are shared by all workers.
+
+    Checks run as server-side Lua scripts, so each one is a single atomic
+    round-trip; ``hit_many`` pipelines a batch of checks. When Redis is
+    unreachable the limiter stops calling it for ``retry_interval`` seconds
+    and, depending on ``failure_mode``, falls back to the in-process
+    limiter ('local'), allows everything ('open') or rejects everything
+    ('closed').
+    """
+
+    def __init__(self,
+                 client: Any,
+                 algorithm: str,
+                 limit: int,
+                 window: float,
+                 key_prefix: str = 'ratelimit',
+                 failure_mode: str = 'local',
+                 retry_interval: float = 5.0,
+                 fallback: Optional[RateLimiter] = None):
+        if algorithm not in SCRIPTS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        if failure_mode not in FAILURE_MODES:
+            raise ValueError(f"Unknown failure mode: {failure_mode}")
+        self.client = client
+        self.algorithm = algorithm
+        self.limit = limit
+        self.window = window
+        self.window_ms = int(window * 1000)
+        self.key_prefix = key_prefix
+        self.failure_mode = failure_mode
+        self.retry_interval = retry_interval
+        self.fallback = fallback
+        self._script = client.register_script(SCRIPTS[algorithm])
+        self._unavailable_until = 0.0
+
+    @classmethod
+    def from_config(cls, client: Any, config: Optional[Dict[str, Any]] = None) -> 'RedisRateLimiter':
+        """Build a Redis limiter from RATE_LIMIT_CONFIG (or config)"""
+        config = config or RATE_LIMIT_CONFIG
+        redis_config = config['redis']
+        fallback_config = dict(config)
+        # Each worker only sees its share of the traffic while Redis is down
+        fallback_config['limit'] = max(1, config['limit'] // redis_config['local_fallback_divisor'])
+        return cls(
+            client=client,
+            algorithm=config['algorithm'],
+            limit=config['limit'],
+            window=config['window_seconds'],
+            key_prefix=redis_config['key_prefix'],
+            failure_mode=redis_config['failure_mode'],
+            retry_interval=redis_config['retry_interval_seconds'],
+            fallback=create_rate_limiter(fallback_config)
+        )
+
+    async def hit(self, key: str) -> RateLimitResult:
+        """Record one request for key and return whether it is allowed"""
+        if not self._available():
+            return self._fail(key)
+        try:
+            reply = await self._script(keys=[self._key(key)], args=self._args())
+        except RedisError:
+            self._mark_unavailable()
+            return self._fail(key)
+        return self._result(reply)
+
+    async def hit_many(self, keys: Sequence[str]) -> List[RateLimitResult]:
+        """Check a batch of keys in one pipelined round-trip"""
+        if not self._available():
+            return [self._fail(key) for key in keys]
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    await self._script(keys=[self._key(key)], args=self._args(), client=pipe)
+                replies = await pipe.execute()
+        except RedisError:
+            self._mark_unavailable()
+            return [self._fail(key) for key in keys]
+        return [self._result(reply) for reply in replies]
+
+    async def reset(self, key: str) -> None:
+        await self.client.delete(self._key(key))
+
+    def _key(self, key: str) -> str:
+        return f"{self.key_prefix}:{self.algorithm}:{key}"
+
+    def _args(self) -> list:
+        args = [self.limit, self.window_ms]
+        if self.algorithm == 'sliding_window_log':
+            # Unique member so concurrent requests in the same millisecond are all counted
+            args.append(uuid.uuid4().hex)
+        return args
+
+    def _available(self) -> bool:
+        return time.monotonic() >= self._unavailable_until
+
+    def _mark_unavailable(self) -> None:
+        self._unavailable_until = time.monotonic() + self.retry_interval
+
+    def _fail(self, key: str) -> RateLimitResult:
+        if self.failure_mode == 'local' and self.fallback is not None:
+            return self.fallback.hit(key)
+        if self.failure_mode == 'closed':
+            return RateLimitResult(False, self.limit, 0, self.retry_interval, self.retry_interval)
+        return RateLimitResult(True, self.limit, self.limit, self.window)
+
+    def _result(self, reply: list) -> RateLimitResult:
+        allowed = bool(int(reply[0]))
+        if self.algorithm == 'token_bucket':
+            tokens = float(reply[1])
+            rate = self.limit / self.window
+            return RateLimitResult(
+                allowed=allowed,
+                limit=self.limit,
+                remaining=int(tokens),
+                reset_after=(self.limit - tokens) / rate,
+                retry_after=0.0 if allowed else (1.0 - tokens) / rate
+            )
+
+        if self.algorithm == 'sliding_window_log':
+            count, oldest, now = int(reply[1]), float(reply[2]), float(reply[3])
+            reset_after = (oldest + self.window_ms - now) / 1000
+            return RateLimitResult(
+                allowed=allowed,
+                limit=self.limit,
+                remaining=self.limit - count,
+                reset_after=reset_after,
+                retry_after=0.0 if allowed else reset_after
+            )
+
+        previous, current, into = int(reply[1]), int(reply[2]), int(reply[3])
+        estimated = previous * (1 - into / self.window_ms) + current
+        reset_after = (self.window_ms - into) / 1000
+        retry_after = 0.0
+        if not allowed:
+            retry_after = reset_after
+            if previous:
+                needed = estimated - self.limit + 1
+                retry_after = min(reset_after, needed * self.window / previous)
+        return RateLimitResult(
+            allowed=allowed,
+            limit=self.limit,
+            remaining=max(0, int(self.limit - estimated)),
+            reset_after=reset_after,
+            retry_after=retry_after
+        )
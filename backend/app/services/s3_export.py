@@ -0,0 +1,410 @@
+"""
+Resumable upload of GDPR exports to S3 as multipart objects.
+
+The exporter's gzip stream is cut into parts only at gzip member
+boundaries, so the end of every uploaded part is a point the export can
+continue from. Parts upload concurrently while later records are still
+being compressed, each with a checksum S3 verifies on receipt. The
+checkpoint file records the upload and its completed parts; a resumed
+export asks S3 which of them it still holds and continues after the last
+one instead of re-reading the sources from the start. Once the final part
+is uploaded only completing the upload is left, so a resume does just that.
+
+Uploads abandoned without a checkpoint are aborted. Ones left for a resume
+that never comes should be cleaned up by an AbortIncompleteMultipartUpload
+lifecycle rule on the bucket.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from app.core.security_config import GDPR_CONFIG
+from app.services.gdpr_export import ExportCheckpoint, GDPRExporter, ProgressCallback, save_json
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+# S3 rejects parts smaller than this, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+_CHECKSUMS: Dict[str, Callable[[bytes], bytes]] = {
+    'SHA256': lambda data: hashlib.sha256(data).digest(),
+    'SHA1': lambda data: hashlib.sha1(data).digest(),
+    'CRC32': lambda data: zlib.crc32(data).to_bytes(4, 'big'),
+}
+
+# Called with the completed parts, in order, whenever that prefix grows
+PartsCallback = Callable[[List[Dict[str, Any]]], None]
+
+
+class MultipartUploadWriter:
+    """Binary stream that uploads what is written to it as multipart parts.
+
+    A part is cut at a ``mark`` once at least ``part_size`` bytes are
+    buffered, and carries the resume state passed to that mark. Up to
+    ``max_in_flight`` parts upload at once on a thread pool; cutting
+    another blocks until one finishes, which bounds memory use.
+    """
+
+    def __init__(self,
+                 client: Any,
+                 bucket: str,
+                 key: str,
+                 upload_id: str,
+                 part_size: int = 16 * 1024 * 1024,
+                 max_in_flight: int = 4,
+                 checksum_algorithm: Optional[str] = 'SHA256',
+                 max_retries: int = 3,
+                 parts: Optional[List[Dict[str, Any]]] = None,
+                 on_parts: Optional[PartsCallback] = None):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        if checksum_algorithm is not None and checksum_algorithm not in _CHECKSUMS:
+            raise ValueError(f"Unsupported checksum algorithm: {checksum_algorithm}")
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = upload_id
+        self.part_size = part_size
+        self.checksum_algorithm = checksum_algorithm
+        self.max_retries = max_retries
+        self.on_parts = on_parts
+        # Completed parts with no gap before them; parts after a gap wait in _pending
+        self.parts: List[Dict[str, Any]] = list(parts or [])
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._offset = self.parts[-1]['end_offset'] if self.parts else 0
+        self._next_part_number = len(self.parts) + 1
+        self._buffer = bytearray()
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='s3-export')
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset + len(self._buffer)
+
+    def flush(self) -> None:
+        pass
+
+    def mark(self, state: Dict[str, Any]) -> None:
+        """Record a point the export can resume from, cutting a part if enough is buffered"""
+        if len(self._buffer) >= self.part_size:
+            self._cut(state)
+
+    def complete(self, state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Upload the rest of the buffer as the final part and complete the upload.
+
+        state is the resume state of the finished export, recorded on the
+        final part like the state passed to ``mark``.
+        """
+        if self._buffer or self._next_part_number == 1:
+            self._cut(state, final=True)
+        self._pool.shutdown(wait=True)
+        self._raise_failed()
+        field = self._checksum_field()
+        parts = []
+        for part in self.parts:
+            entry = {'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+            if field:
+                entry[field] = part[field]
+            parts.append(entry)
+        return self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+
+    def close(self) -> None:
+        """Wait for the parts in flight, leaving the upload open to be resumed"""
+        self._pool.shutdown(wait=True)
+
+    def abort(self) -> None:
+        """Stop uploading and discard every part already stored"""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except (BotoCoreError, ClientError) as e:
+            logger.warning("Aborting multipart upload of %s failed: %s", self.key, e)
+
+    def _cut(self, state: Optional[Dict[str, Any]], final: bool = False) -> None:
+        # Blocks while max_in_flight parts are still uploading
+        self._slots.acquire()
+        if self._error is not None:
+            self._slots.release()
+            self._raise_failed()
+        body = bytes(self._buffer)
+        self._buffer.clear()
+        self._offset += len(body)
+        part = {
+            'PartNumber': self._next_part_number,
+            'size': len(body),
+            'end_offset': self._offset,
+            'state': state,
+        }
+        if final:
+            part['final'] = True
+        self._next_part_number += 1
+        self._pool.submit(self._upload, part, body)
+
+    def _upload(self, part: Dict[str, Any], body: bytes) -> None:
+        try:
+            kwargs = {
+                'Bucket': self.bucket,
+                'Key': self.key,
+                'UploadId': self.upload_id,
+                'PartNumber': part['PartNumber'],
+                'Body': body,
+            }
+            field = self._checksum_field()
+            if field:
+                kwargs[field] = base64.b64encode(_CHECKSUMS[self.checksum_algorithm](body)).decode('ascii')
+            response = self._upload_part(kwargs)
+            part['ETag'] = response['ETag']
+            if field:
+                part[field] = kwargs[field]
+            self._completed(part)
+        except BaseException as e:
+            logger.warning("Uploading part %d of %s failed: %s", part['PartNumber'], self.key, e)
+            self._error = e
+        finally:
+            self._slots.release()
+
+    def _upload_part(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.upload_part(**kwargs)
+            except (BotoCoreError, ClientError):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(min(0.1 * 2 ** attempt, 2.0))
+
+    def _completed(self, part: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending[part['PartNumber']] = part
+            grew = False
+            while len(self.parts) + 1 in self._pending:
+                self.parts.append(self._pending.pop(len(self.parts) + 1))
+                grew = True
+            # Under the lock so callbacks see the prefix grow in order
+            if grew and self.on_parts is not None:
+                self.on_parts(list(self.parts))
+
+    def _checksum_field(self) -> Optional[str]:
+        return f"Checksum{self.checksum_algorithm}" if self.checksum_algorithm else None
+
+    def _raise_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+
+class S3ExportUploader:
+    """Stream GDPR exports into an S3 bucket and hand out download links"""
+
+    def __init__(self,
+                 client: Any,
+                 bucket: str,
+                 key_prefix: str = 'gdpr-exports',
+                 part_size: int = 16 * 1024 * 1024,
+                 max_in_flight: int = 4,
+                 checksum_algorithm: Optional[str] = 'SHA256',
+                 max_retries: int = 3,
+                 url_expiry: int = 3600):
+        self.client = client
+        self.bucket = bucket
+        self.key_prefix = key_prefix.rstrip('/')
+        self.part_size = part_size
+        self.max_in_flight = max_in_flight
+        self.checksum_algorithm = checksum_algorithm
+        self.max_retries = max_retries
+        self.url_expiry = url_expiry
+
+    @classmethod
+    def from_config(cls, client: Any, bucket: str) -> 'S3ExportUploader':
+        config = GDPR_CONFIG['export']['s3']
+        return cls(
+            client,
+            bucket,
+            key_prefix=config['key_prefix'],
+            part_size=config['part_size_bytes'],
+            max_in_flight=config['max_parts_in_flight'],
+            checksum_algorithm=config['checksum_algorithm'],
+            max_retries=config['max_retries'],
+            url_expiry=config['presigned_url_expiry_seconds']
+        )
+
+    def export(self,
+               exporter: GDPRExporter,
+               user_id: str,
+               checkpoint_path: Optional[str] = None,
+               progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Upload a user's export, resuming from checkpoint_path if present.
+
+        Returns the final progress report with the object's bucket, key and
+        a presigned download URL. The checkpoint is removed once the upload
+        is complete.
+        """
+        resumed = self._resume(checkpoint_path, user_id)
+        if resumed is None:
+            upload = self._start(user_id)
+            if checkpoint_path:
+                save_json(checkpoint_path, upload)
+            checkpoint = ExportCheckpoint(user_id, datetime.fromisoformat(upload['window_end']))
+        else:
+            upload, checkpoint = resumed
+        # Everything was uploaded before; only completing the upload failed
+        uploaded = bool(upload['parts']) and upload['parts'][-1].get('final', False)
+
+        def on_parts(parts: List[Dict[str, Any]]) -> None:
+            upload['parts'] = parts
+            if checkpoint_path:
+                save_json(checkpoint_path, upload)
+
+        writer = MultipartUploadWriter(
+            self.client,
+            self.bucket,
+            upload['key'],
+            upload['upload_id'],
+            part_size=self.part_size,
+            max_in_flight=self.max_in_flight,
+            checksum_algorithm=self.checksum_algorithm,
+            max_retries=self.max_retries,
+            parts=upload['parts'],
+            on_parts=on_parts
+        )
+        try:
+            if not uploaded:
+                exporter.write(writer, checkpoint, lambda checkpoint: writer.mark(checkpoint.to_dict()), progress)
+            writer.complete(checkpoint.to_dict())
+        except BaseException:
+            if checkpoint_path:
+                writer.close()
+            else:
+                writer.abort()
+            raise
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        report = checkpoint.progress(done=True)
+        report.update({
+            'bucket': self.bucket,
+            'key': upload['key'],
+            'url': self.presigned_url(upload['key']),
+            'url_expires_in': self.url_expiry,
+        })
+        if progress is not None:
+            progress(report)
+        return report
+
+    def presigned_url(self, key: str) -> str:
+        """Time-limited download link that saves the object under its own file name"""
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': key,
+                'ResponseContentDisposition': f'attachment; filename="{key.rsplit("/", 1)[-1]}"',
+            },
+            ExpiresIn=self.url_expiry
+        )
+
+    def _start(self, user_id: str) -> Dict[str, Any]:
+        window_end = datetime.utcnow()
+        key = f"{self.key_prefix}/{user_id}/{window_end.strftime('%Y%m%dT%H%M%SZ')}.jsonl.gz"
+        kwargs = {'Bucket': self.bucket, 'Key': key, 'ContentType': 'application/gzip'}
+        if self.checksum_algorithm:
+            kwargs['ChecksumAlgorithm'] = self.checksum_algorithm
+        upload_id = self.client.create_multipart_upload(**kwargs)['UploadId']
+        return {
+            'format_version': FORMAT_VERSION,
+            'user_id': user_id,
+            'bucket': self.bucket,
+            'key': key,
+            'upload_id': upload_id,
+            'window_end': window_end.isoformat(),
+            'parts': [],
+        }
+
+    def _resume(self,
+                checkpoint_path: Optional[str],
+                user_id: str) -> Optional[Tuple[Dict[str, Any], ExportCheckpoint]]:
+        """Load the checkpointed upload, keeping only the parts S3 still holds,
+        and the point the export continues from"""
+        if not checkpoint_path:
+            return None
+        try:
+            with open(checkpoint_path, encoding='utf-8') as checkpoint_file:
+                upload = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+        if (upload.get('format_version') != FORMAT_VERSION
+                or upload.get('user_id') != user_id
+                or upload.get('bucket') != self.bucket):
+            return None
+
+        parts = stored_parts(self.client, self.bucket, upload['key'], upload['upload_id'], upload['parts'])
+        if parts is None:
+            # The upload was aborted, completed or expired; start a new one
+            return None
+        upload['parts'] = parts
+        if not parts:
+            return upload, ExportCheckpoint(user_id, datetime.fromisoformat(upload['window_end']))
+        checkpoint = ExportCheckpoint.from_dict(parts[-1]['state'], user_id)
+        if checkpoint is None:
+            # Saved by an incompatible exporter, so its parts cannot be continued
+            self._abort(upload)
+            return None
+        return upload, checkpoint
+
+    def _abort(self, upload: Dict[str, Any]) -> None:
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=upload['key'], UploadId=upload['upload_id'])
+        except (BotoCoreError, ClientError) as e:
+            logger.warning("Aborting multipart upload of %s failed: %s", upload['key'], e)
+
+
+def stored_parts(client: Any,
+                 bucket: str,
+                 key: str,
+                 upload_id: str,
+                 parts: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    """The leading checkpointed parts S3 still holds unchanged.
+
+    Returns None if the upload no longer exists. A part saved without its
+    resume state ends the prefix, since nothing can be continued from it.
+    """
+    stored = {}
+    try:
+        paginator = client.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+            for part in page.get('Parts', []):
+                stored[part['PartNumber']] = part
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+            return None
+        raise
+
+    kept = []
+    for part in parts:
+        listed = stored.get(part['PartNumber'])
+        if listed is None or listed['ETag'] != part['ETag'] or listed['Size'] != part['size']:
+            break
+        if part['state'] is None:
+            break
+        kept.append(part)
+    return kept
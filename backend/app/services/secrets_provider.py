@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from app.core.aws import get_client
+from app.core.security_config import AWS_SECURITY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class SecretVersions(NamedTuple):
+    """The current value of a secret and, during a rotation, the previous one.
+
+    ``current_since`` is the Unix time the current value became current,
+    when known; the provider uses it to stop accepting ``previous`` once the
+    rotation window is over.
+    """
+    current: str
+    previous: Optional[str] = None
+    current_since: Optional[float] = None
+
+    def values(self) -> List[str]:
+        """Values to accept, current first"""
+        if self.previous is None or self.previous == self.current:
+            return [self.current]
+        return [self.current, self.previous]
+
+
+class SecretsManagerBackend:
+    """Read AWSCURRENT and AWSPREVIOUS versions from AWS Secrets Manager"""
+
+    def fetch(self, name: str) -> SecretVersions:
+        client = get_client('secretsmanager')
+        response = client.get_secret_value(SecretId=name, VersionStage='AWSCURRENT')
+        current = response['SecretString']
+        # Rotation creates the new version just before promoting it to AWSCURRENT
+        created = response.get('CreatedDate')
+        try:
+            previous = client.get_secret_value(SecretId=name, VersionStage='AWSPREVIOUS')['SecretString']
+        except ClientError as e:
+            # A secret that was never rotated has no AWSPREVIOUS version
+            if e.response.get('Error', {}).get('Code') != 'ResourceNotFoundException':
+                raise
+            previous = None
+        return SecretVersions(current, previous, created.timestamp() if created is not None else None)
+
+
+class EnvironmentBackend:
+    """Read secrets from environment variables.
+
+    ``/dynamis/jwt/secret`` is read from ``DYNAMIS_JWT_SECRET`` and its
+    previous value from ``DYNAMIS_JWT_SECRET_PREVIOUS``.
+    """
+
+    @staticmethod
+    def variable_name(name: str) -> str:
+        return re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_').upper()
+
+    def fetch(self, name: str) -> SecretVersions:
+        variable = self.variable_name(name)
+        try:
+            current = os.environ[variable]
+        except KeyError:
+            raise KeyError(f"Secret {name} is not set in ${variable}")
+        return SecretVersions(current, os.environ.get(f"{variable}_PREVIOUS"))
+
+
+class FileBackend:
+    """Read secrets from a local JSON file, for tests and local development.
+
+    The file maps secret names to either a string or an object with
+    ``current`` and optional ``previous`` keys. It is re-read on every
+    fetch, so edits are picked up at the next refresh.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self, name: str) -> SecretVersions:
+        with open(self.path, encoding='utf-8') as secrets_file:
+            value = json.load(secrets_file)[name]
+        if isinstance(value, str):
+            return SecretVersions(value)
+        return SecretVersions(value['current'], value.get('previous'))
+
+
+def create_backend(backend: str, secrets_file: Optional[str] = None) -> Any:
+    if backend == 'aws_secrets_manager':
+        return SecretsManagerBackend()
+    if backend == 'env':
+        return EnvironmentBackend()
+    if backend == 'file':
+        if not secrets_file:
+            raise ValueError("SECRETS_FILE is required for the file secrets backend")
+        return FileBackend(secrets_file)
+    raise ValueError(f"Unknown secrets backend: {backend}")
+
+
+class SecretsProvider:
+    """Cache secrets and refresh them in the background before they go stale.
+
+    The first ``get`` of a secret fetches it synchronously; after that a
+    daemon thread re-fetches each secret every ``ttl`` seconds, spread by
+    ``jitter`` so workers started together do not refresh together. When a
+    refresh fails the last known good value keeps being served and the
+    fetch is retried after ``retry_interval``. Callbacks registered with
+    ``on_change`` run after a secret's value changes.
+
+    The previous value is served for ``previous_window`` seconds after the
+    current value became current: from the backend's version timestamp
+    when it has one, otherwise from when this provider first saw the value.
+    """
+
+    def __init__(self,
+                 backend: Any,
+                 ttl: float = 3600.0,
+                 jitter: float = 0.1,
+                 retry_interval: float = 30.0,
+                 previous_window: float = 3600.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self.previous_window = previous_window
+        # name -> (versions, monotonic time of the next refresh)
+        self._secrets: Dict[str, Tuple[SecretVersions, float]] = {}
+        self._listeners: List[Callable[[str, SecretVersions], None]] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+
+    @classmethod
+    def from_settings(cls) -> 'SecretsProvider':
+        """Build a provider for the backend chosen by SECRETS_BACKEND"""
+        # Settings are read on first use so importing this module needs no environment
+        from app.core.config import settings
+
+        config = AWS_SECURITY_CONFIG['secrets_manager']
+        return cls(
+            create_backend(settings.SECRETS_BACKEND, settings.SECRETS_FILE),
+            ttl=config['cache_ttl_seconds'],
+            jitter=config['refresh_jitter'],
+            retry_interval=config['retry_interval_seconds'],
+            previous_window=config['previous_version_window_seconds']
+        )
+
+    def get(self, name: str) -> SecretVersions:
+        """Return the cached versions of a secret, fetching it on first use"""
+        entry = self._secrets.get(name)
+        if entry is not None:
+            return self._accepted(entry[0])
+        versions = self.backend.fetch(name)
+        with self._wake:
+            if name not in self._secrets:
+                self._secrets[name] = (self._stamp(versions, None), self._next_refresh(self.ttl))
+                self._wake.notify()
+            versions = self._secrets[name][0]
+        self._start()
+        return self._accepted(versions)
+
+    def previous_until(self, versions: SecretVersions) -> Optional[float]:
+        """Unix time after which versions.previous is no longer accepted"""
+        if versions.previous is None or versions.current_since is None:
+            return None
+        return versions.current_since + self.previous_window
+
+    def refresh(self, name: str) -> SecretVersions:
+        """Fetch a secret now, notifying listeners if it changed"""
+        fetched = self.backend.fetch(name)
+        with self._lock:
+            entry = self._secrets.get(name)
+            versions = self._stamp(fetched, entry[0] if entry is not None else None)
+            self._secrets[name] = (versions, self._next_refresh(self.ttl))
+        versions = self._accepted(versions)
+        # Compared as served, so the end of a rotation window is not a change
+        if entry is not None and self._accepted(entry[0])[:2] != versions[:2]:
+            logger.info("Secret %s changed", name)
+            for listener in list(self._listeners):
+                try:
+                    listener(name, versions)
+                except Exception:
+                    logger.exception("Secret change listener failed for %s", name)
+        return versions
+
+    def on_change(self, listener: Callable[[str, SecretVersions], None]) -> None:
+        self._listeners.append(listener)
+
+    def close(self) -> None:
+        """Stop the refresh thread"""
+        with self._wake:
+            self._closed = True
+            self._wake.notify()
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout=5)
+
+    def _stamp(self, fetched: SecretVersions, stored: Optional[SecretVersions]) -> SecretVersions:
+        """Fill in current_since from the stored entry, or now for a value not seen before"""
+        if fetched.current_since is not None:
+            return fetched
+        if stored is not None and stored.current == fetched.current and stored.current_since is not None:
+            return fetched._replace(current_since=stored.current_since)
+        return fetched._replace(current_since=time.time())
+
+    def _accepted(self, versions: SecretVersions) -> SecretVersions:
+        previous_until = self.previous_until(versions)
+        if previous_until is not None and time.time() >= previous_until:
+            return versions._replace(previous=None)
+        return versions
+
+    def _next_refresh(self, delay: float) -> float:
+        return time.monotonic() + delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._closed or (self._worker is not None and self._worker.is_alive()):
+                return
+            self._worker = threading.Thread(target=self._run, name='secrets-refresh', daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._wake:
+                while not self._closed:
+                    now = time.monotonic()
+                    due = [name for name, (_, refresh_at) in self._secrets.items() if refresh_at <= now]
+                    if due:
+                        break
+                    next_at = min((refresh_at for _, refresh_at in self._secrets.values()), default=None)
+                    self._wake.wait(None if next_at is None else next_at - now)
+                if self._closed:
+                    return
+
+            for name in due:
+                try:
+                    self.refresh(name)
+                except Exception as e:
+                    logger.warning("Refreshing secret %s failed, serving the last known value: %s", name, e)
+                    with self._lock:
+                        versions = self._secrets[name][0]
+                        self._secrets[name] = (versions, self._next_refresh(self.retry_interval))
+
+
+_provider: Optional[SecretsProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_secrets_provider() -> SecretsProvider:
+    """Return the process-wide secrets provider, creating it on first use"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = SecretsProvider.from_settings()
+    return _provider
+
+
+def close_secrets_provider() -> None:
+    global _provider
+    with _provider_lock:
+        provider, _provider = _provider, None
+    if provider is not None:
+        provider.close()
@@ -0,0 +1,320 @@
+"""
+Streaming aggregation of security events against the CloudWatch alarm thresholds.
+
+Every security event the audit service logs is counted as it happens.
+Events of the types behind each alarm threshold are counted over a
+sliding window per user, per client IP and overall. The counts live in
+small ring buffers of per-bucket counts, so adding an event is O(1) and
+the window slides without keeping individual events. An alert fires the
+moment a count reaches its threshold. Each event type is counted over
+the same sliding window, and the window counts are published to
+CloudWatch as metrics once per interval, rather than as a log line per
+event. A burst that straddles two publishes is still counted whole.
+
+Usage:
+    python -m app.services.security_aggregator bench --events 500000
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from app.core.security_config import AWS_SECURITY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ('user', 'ip', 'global')
+# PutMetricData accepts at most this many metrics per call
+MAX_METRICS_PER_CALL = 1000
+
+
+class SecurityAlert(NamedTuple):
+    """A sliding-window count that just reached its alarm threshold"""
+    threshold_name: str
+    scope: str  # user, ip or global
+    key: str  # the user id, IP address or threshold name
+    count: int
+    threshold: int
+    window_seconds: float
+    event_type: str  # the event that crossed the threshold
+
+
+class _Window:
+    """Event counts for the last ``len(counts)`` buckets, as a ring buffer"""
+
+    __slots__ = ('counts', 'total', 'bucket')
+
+    def __init__(self, size: int, bucket: int):
+        self.counts = array('I', [0]) * size
+        self.total = 0
+        self.bucket = bucket
+
+    def advance(self, bucket: int) -> None:
+        """Slide the window forward, dropping buckets that fell out of it"""
+        elapsed = bucket - self.bucket
+        if elapsed <= 0:
+            return
+        size = len(self.counts)
+        if elapsed >= size:
+            self.counts = array('I', [0]) * size
+            self.total = 0
+        else:
+            counts = self.counts
+            for expired in range(self.bucket + 1, bucket + 1):
+                index = expired % size
+                self.total -= counts[index]
+                counts[index] = 0
+        self.bucket = bucket
+
+    def add(self, bucket: int) -> int:
+        """Count one event in bucket and return the window total"""
+        if bucket != self.bucket:
+            self.advance(bucket)
+        self.counts[bucket % len(self.counts)] += 1
+        self.total += 1
+        return self.total
+
+
+class SecurityEventAggregator:
+    """Sliding-window counters per user, IP and event type, checked against thresholds.
+
+    ``event_types`` maps each threshold name to the event types it counts.
+    Windows are ``window_seconds`` long with ``bucket_seconds`` resolution;
+    at most ``max_tracked_keys`` users and IPs are tracked per threshold,
+    evicting the longest tracked. Alert listeners run on the thread that
+    recorded the crossing event, outside the aggregator's lock.
+    """
+
+    def __init__(self,
+                 thresholds: Dict[str, int],
+                 event_types: Dict[str, List[str]],
+                 window_seconds: float = 300.0,
+                 bucket_seconds: float = 10.0,
+                 max_tracked_keys: int = 100000,
+                 client: Any = None,
+                 namespace: str = 'Dynamis/Security',
+                 publish_interval: float = 60.0):
+        if bucket_seconds <= 0 or window_seconds < bucket_seconds:
+            raise ValueError("window_seconds must be at least one bucket_seconds")
+        self.thresholds = dict(thresholds)
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.buckets = int(round(window_seconds / bucket_seconds))
+        self.max_tracked_keys = max_tracked_keys
+        self.client = client
+        self.namespace = namespace
+        self.publish_interval = publish_interval
+        self._threshold_of = {
+            event_type: name
+            for name, types in event_types.items() if name in self.thresholds
+            for event_type in types
+        }
+        # threshold name -> scope -> key -> window
+        self._windows: Dict[str, Dict[str, Dict[str, _Window]]] = {
+            name: {scope: {} for scope in SCOPES} for name in self.thresholds
+        }
+        # Sliding-window count of each event type
+        self._event_windows: Dict[str, _Window] = {}
+        # Alerts since the last publish
+        self._alert_counts: Dict[str, int] = {}
+        self._listeners: List[Callable[[SecurityAlert], None]] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, client: Any = None, config: Optional[Dict[str, Any]] = None) -> 'SecurityEventAggregator':
+        """Build from AWS_SECURITY_CONFIG['cloudwatch'] (or config)"""
+        config = config or AWS_SECURITY_CONFIG['cloudwatch']
+        aggregation = config['aggregation']
+        return cls(
+            thresholds=config['alarm_thresholds'],
+            event_types=aggregation['threshold_event_types'],
+            window_seconds=aggregation['window_seconds'],
+            bucket_seconds=aggregation['bucket_seconds'],
+            max_tracked_keys=aggregation['max_tracked_keys'],
+            client=client,
+            namespace=config['metric_namespace'],
+            publish_interval=aggregation['publish_interval_seconds']
+        )
+
+    def on_alert(self, listener: Callable[[SecurityAlert], None]) -> None:
+        self._listeners.append(listener)
+
+    def record(self, event_type: str, user_id: Optional[str] = None, ip_address: Optional[str] = None) -> None:
+        """Count one security event, firing alerts for thresholds it makes reach their limit"""
+        name = self._threshold_of.get(event_type)
+        bucket = int(time.monotonic() / self.bucket_seconds)
+        alerts = []
+        with self._lock:
+            event_window = self._event_windows.get(event_type)
+            if event_window is None:
+                event_window = self._event_windows[event_type] = _Window(self.buckets, bucket)
+            event_window.add(bucket)
+            if name is None:
+                return
+            threshold = self.thresholds[name]
+            windows = self._windows[name]
+            for scope, key in (('user', user_id), ('ip', ip_address), ('global', name)):
+                if key is None:
+                    continue
+                scoped = windows[scope]
+                window = scoped.get(key)
+                if window is None:
+                    if len(scoped) >= self.max_tracked_keys:
+                        del scoped[next(iter(scoped))]
+                    window = scoped[key] = _Window(self.buckets, bucket)
+                # Counts grow by one, so equality fires once per crossing
+                count = window.add(bucket)
+                if count == threshold:
+                    alerts.append(SecurityAlert(
+                        name, scope, str(key), count, threshold, self.window_seconds, event_type
+                    ))
+                    self._alert_counts[name] = self._alert_counts.get(name, 0) + 1
+        for alert in alerts:
+            for listener in self._listeners:
+                try:
+                    listener(alert)
+                except Exception:
+                    logger.exception("Security alert listener failed for %s", alert.threshold_name)
+
+    def count(self, threshold_name: str, scope: str, key: str) -> int:
+        """The current sliding-window count of a threshold for a user, IP or globally"""
+        with self._lock:
+            window = self._windows[threshold_name][scope].get(key)
+            if window is None:
+                return 0
+            window.advance(int(time.monotonic() / self.bucket_seconds))
+            return window.total
+
+    def event_count(self, event_type: str) -> int:
+        """The current sliding-window count of an event type"""
+        with self._lock:
+            window = self._event_windows.get(event_type)
+            if window is None:
+                return 0
+            window.advance(int(time.monotonic() / self.bucket_seconds))
+            return window.total
+
+    def publish(self) -> None:
+        """Send the window counts, and the alerts since the last publish, to CloudWatch as metrics"""
+        bucket = int(time.monotonic() / self.bucket_seconds)
+        with self._lock:
+            event_counts = {}
+            for event_type, window in self._event_windows.items():
+                window.advance(bucket)
+                event_counts[event_type] = window.total
+            alert_counts, self._alert_counts = self._alert_counts, {}
+            self._evict_idle(bucket)
+            window_counts = {}
+            for name, windows in self._windows.items():
+                window = windows['global'].get(name)
+                if window is not None:
+                    window.advance(bucket)
+                    window_counts[name] = window.total
+
+        timestamp = datetime.utcnow()
+        metric_data = [
+            _metric('SecurityEvents', count, timestamp, EventType=event_type)
+            for event_type, count in event_counts.items()
+        ]
+        metric_data += [
+            _metric('SecurityAlarms', count, timestamp, Threshold=name)
+            for name, count in alert_counts.items()
+        ]
+        metric_data += [
+            _metric('ThresholdWindowCount', count, timestamp, Threshold=name)
+            for name, count in window_counts.items()
+        ]
+        if self.client is None or not metric_data:
+            return
+        for start in range(0, len(metric_data), MAX_METRICS_PER_CALL):
+            try:
+                self.client.put_metric_data(
+                    Namespace=self.namespace,
+                    MetricData=metric_data[start:start + MAX_METRICS_PER_CALL]
+                )
+            except (BotoCoreError, ClientError) as e:
+                logger.warning("Publishing %d security metrics failed: %s", len(metric_data), e)
+                return
+
+    async def run_publisher(self) -> None:
+        """Publish metrics every publish_interval; runs until cancelled"""
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            await asyncio.to_thread(self.publish)
+
+    def _evict_idle(self, bucket: int) -> None:
+        # Users and IPs with nothing left in their window no longer need tracking
+        for windows in self._windows.values():
+            for scope in ('user', 'ip'):
+                scoped = windows[scope]
+                idle = [key for key, window in scoped.items() if bucket - window.bucket >= self.buckets]
+                for key in idle:
+                    del scoped[key]
+
+
+def _metric(name: str, value: int, timestamp: datetime, **dimensions: str) -> Dict[str, Any]:
+    return {
+        'MetricName': name,
+        'Dimensions': [{'Name': dimension, 'Value': label} for dimension, label in dimensions.items()],
+        'Timestamp': timestamp,
+        'Value': value,
+        'Unit': 'Count',
+    }
+
+
+def benchmark(events: int, users: int, ips: int) -> Dict[str, float]:
+    """Time record() over a synthetic mix of threshold and unrelated event types"""
+    aggregator = SecurityEventAggregator.from_config()
+    event_types = [
+        event_type
+        for types in AWS_SECURITY_CONFIG['cloudwatch']['aggregation']['threshold_event_types'].values()
+        for event_type in types
+    ] + ['rate_limit_exceeded', 'geo_check']
+    rng = random.Random(0)
+    stream = [
+        (rng.choice(event_types), f"user-{rng.randrange(users)}", f"10.0.{rng.randrange(ips) // 256}.{rng.randrange(256)}")
+        for _ in range(events)
+    ]
+    alerts = []
+    aggregator.on_alert(alerts.append)
+    record = aggregator.record
+    started = time.perf_counter()
+    for event_type, user_id, ip_address in stream:
+        record(event_type, user_id, ip_address)
+    elapsed = time.perf_counter() - started
+    return {
+        'events': events,
+        'seconds': round(elapsed, 3),
+        'events_per_second': round(events / elapsed),
+        'microseconds_per_event': round(elapsed / events * 1e6, 2),
+        'alerts': len(alerts),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the security event aggregator")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help="Measure record() throughput on one thread")
+    bench_parser.add_argument('--events', type=int, default=500000)
+    bench_parser.add_argument('--users', type=int, default=10000)
+    bench_parser.add_argument('--ips', type=int, default=5000)
+    bench_parser.add_argument('--target-rate', type=int, default=50000, help="events per second to compare against")
+    args = parser.parse_args()
+
+    result = benchmark(args.events, args.users, args.ips)
+    for name, value in result.items():
+        print(f"{name}\t{value}")
+    # Share of one core the aggregator would take at the target rate
+    print(f"cpu_share_at_{args.target_rate}_per_second\t{args.target_rate / result['events_per_second']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Background job worker.
+
+Runs queued jobs (GDPR exports and deletions, re-encryption) outside the
+API processes. Start as many worker processes as the load needs; each runs
+at most JOBS_CONFIG concurrency jobs at a time, and on SIGTERM finishes
+its running jobs before exiting.
+
+Usage:
+    python -m app.worker
+    python -m app.worker --concurrency 2
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+from typing import Optional
+
+from app.core.redis import close_redis
+from app.services.audit_service import audit_service
+from app.services.job_handlers import JOB_TYPES
+from app.services.job_queue import JobWorker, get_job_queue
+from app.services.security_service import security_service
+
+logger = logging.getLogger(__name__)
+
+
+async def run(concurrency: Optional[int] = None) -> None:
+    worker = JobWorker.from_config(
+        get_job_queue(),
+        {name: job_type.handler for name, job_type in JOB_TYPES.items()},
+        concurrency=concurrency
+    )
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    try:
+        await asyncio.to_thread(audit_service.warm_up)
+    except Exception as e:
+        # Services retry lazily on first use, so a failed warm-up is not fatal
+        logger.warning("Warm-up of audit_service failed: %s", e)
+    try:
+        await worker.run()
+    finally:
+        await asyncio.to_thread(audit_service.shutdown)
+        await asyncio.to_thread(security_service.shutdown)
+        await close_redis()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run background jobs")
+    parser.add_argument('--concurrency', type=int, default=None, help="jobs run at once (default from JOBS_CONFIG)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    asyncio.run(run(args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import json
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+import boto3
+from botocore.stub import Stubber
+from sqlalchemy import create_engine, text
+
+from app.services.audit_service import AuditService
+from app.services.audit_store import AuditStore
+
+
+class StubShipper:
+    def __init__(self):
+        self.events: List[Tuple[str, str]] = []
+        self.flushes = 0
+
+    def enqueue(self, stream: str, message: str) -> None:
+        self.events.append((stream, message))
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        self.flushes += 1
+        return True
+
+
+class StubStore:
+    def __init__(self, shipper: StubShipper):
+        self.shipper = shipper
+        self.deleted: List[Tuple[str, int]] = []
+
+    def delete_user(self, user_id: str) -> int:
+        # Queued events must reach the store before the delete
+        self.deleted.append((user_id, self.shipper.flushes))
+        return 3
+
+
+def test_user_activity_is_read_through_the_logs_client():
+    service = AuditService()
+    logs = boto3.client('logs', region_name='us-east-1')
+    end_time = datetime(2026, 1, 31)
+    start_time = end_time - timedelta(days=30)
+    expected = {
+        'logGroupName': service.log_group_name,
+        'startTime': int(start_time.timestamp() * 1000),
+        'endTime': int(end_time.timestamp() * 1000),
+        'filterPattern': '{$.user_id = "u1"}',
+    }
+    with Stubber(logs) as stubber:
+        stubber.add_response(
+            'filter_log_events',
+            {'events': [{'message': json.dumps({'n': 1})}], 'nextToken': 'page-2'},
+            expected
+        )
+        stubber.add_response(
+            'filter_log_events',
+            {'events': [{'message': json.dumps({'n': 2})}]},
+            dict(expected, nextToken='page-2')
+        )
+        service._logs = logs
+        events = list(service._filter_log_events('u1', start_time, end_time))
+        stubber.assert_no_pending_responses()
+    assert events == [{'n': 1}, {'n': 2}]
+
+
+def test_deleting_activity_logs_deletes_the_users_stored_events():
+    service = AuditService()
+    shipper = StubShipper()
+    service._shipper = shipper
+    service._store = store = StubStore(shipper)
+
+    service._delete_user_activity_logs('u1')
+
+    assert store.deleted == [('u1', 1)]
+    [(stream, message)] = shipper.events
+    assert stream.startswith('deletion-')
+    assert json.loads(message)['records_deleted'] == 3
+
+
+def test_store_delete_user_removes_only_that_users_rows():
+    engine = create_engine('sqlite://')
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE audit_events (id integer, user_id text)'))
+        connection.execute(
+            text('INSERT INTO audit_events VALUES (:id, :user_id)'),
+            [{'id': 1, 'user_id': 'u1'}, {'id': 2, 'user_id': 'u2'}, {'id': 3, 'user_id': 'u1'}]
+        )
+    store = AuditStore(engine)
+
+    assert store.delete_user('u1') == 2
+    with engine.connect() as connection:
+        assert connection.execute(text('SELECT user_id FROM audit_events')).scalars().all() == ['u2']
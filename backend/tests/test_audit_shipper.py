@@ -0,0 +1,130 @@
+import threading
+from typing import Any, Dict, List
+
+import boto3
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+
+from app.services import audit_shipper
+from app.services.audit_service import AuditService
+from app.services.audit_shipper import AuditLogShipper
+
+LOG_GROUP = '/aws/dynamis/audit'
+
+
+def _logs_client() -> Any:
+    return boto3.client('logs', region_name='us-east-1')
+
+
+def _shipper(client: Any, **options: Any) -> AuditLogShipper:
+    options.setdefault('flush_interval', 60.0)
+    options.setdefault('max_retries', 0)
+    return AuditLogShipper(client, LOG_GROUP, **options)
+
+
+class StubLogsClient:
+    """Records put_log_events batches, raising the queued errors first"""
+
+    def __init__(self, errors: List[Exception]):
+        self.errors = list(errors)
+        self.batches: List[Dict[str, Any]] = []
+
+    def put_log_events(self, **params: Any) -> Dict[str, Any]:
+        if self.errors:
+            raise self.errors.pop(0)
+        self.batches.append(params)
+        return {}
+
+    def create_log_stream(self, **params: Any) -> Dict[str, Any]:
+        return {}
+
+
+def test_audit_service_ships_with_the_logs_client() -> None:
+    service = AuditService()
+    service.store_config = {**service.store_config, 'enabled': False}
+    client = service.shipper.client
+    assert client.meta.service_model.service_name == 'logs'
+    assert hasattr(client, 'put_log_events')
+
+
+def test_missing_stream_is_created_and_the_batch_sent_again() -> None:
+    client = _logs_client()
+    shipper = _shipper(client)
+    with Stubber(client) as stubber:
+        stubber.add_client_error('put_log_events', 'ResourceNotFoundException')
+        stubber.add_response('create_log_stream', {}, {'logGroupName': LOG_GROUP, 'logStreamName': 'security'})
+        stubber.add_response('put_log_events', {}, {
+            'logGroupName': LOG_GROUP,
+            'logStreamName': 'security',
+            'logEvents': [{'timestamp': 2, 'message': 'b'}, {'timestamp': 3, 'message': 'c'}],
+        })
+        shipper.enqueue('security', 'c', timestamp_ms=3)
+        shipper.enqueue('security', 'b', timestamp_ms=2)
+        assert shipper.flush(5)
+        stubber.assert_no_pending_responses()
+    shipper.close()
+    stats = shipper.stats()
+    assert stats['sent'] == 2
+    assert stats['failed'] == 0
+
+
+def test_connection_errors_fail_the_batch_but_keep_the_worker() -> None:
+    client = StubLogsClient([EndpointConnectionError(endpoint_url='https://logs.invalid'), RuntimeError('boom')])
+    shipper = _shipper(client)
+    shipper.enqueue('security', 'first')
+    assert shipper.flush(5)
+    shipper.enqueue('security', 'second')
+    assert shipper.flush(5)
+    shipper.enqueue('security', 'third')
+    assert shipper.flush(5)
+    shipper.close()
+    assert shipper.stats()['failed'] == 2
+    assert shipper.stats()['sent'] == 1
+    assert [batch['logEvents'][0]['message'] for batch in client.batches] == ['third']
+
+
+def test_throttling_is_retried() -> None:
+    throttled = ClientError({'Error': {'Code': 'ThrottlingException'}}, 'PutLogEvents')
+    client = StubLogsClient([throttled, throttled])
+    shipper = _shipper(client, max_retries=2)
+    shipper.enqueue('security', 'event')
+    assert shipper.flush(5)
+    shipper.close()
+    assert shipper.stats()['sent'] == 1
+
+
+def test_dead_worker_is_restarted() -> None:
+    client = StubLogsClient([])
+    shipper = _shipper(client)
+    # Stand in for a worker thread that died
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    shipper._worker = dead
+    shipper.enqueue('security', 'event')
+    assert shipper._worker is not dead and shipper._worker.is_alive()
+    assert shipper.flush(5)
+    shipper.close()
+    assert [batch['logEvents'][0]['message'] for batch in client.batches] == ['event']
+
+
+def test_exit_hook_is_registered_once_across_restarts(monkeypatch) -> None:
+    registered: List[Any] = []
+    monkeypatch.setattr(audit_shipper.atexit, 'register', registered.append)
+    monkeypatch.setattr(audit_shipper.atexit, 'unregister', registered.remove)
+    shipper = _shipper(StubLogsClient([]))
+
+    for _ in range(3):
+        shipper.enqueue('security', 'event')
+        # The worker dies; the next enqueue starts a new one
+        shipper._queue.put((audit_shipper._STOP, None))
+        shipper._worker.join(5)
+    shipper.enqueue('security', 'event')
+    assert registered == [shipper.close]
+
+    shipper.close()
+    assert registered == []
+    # A shipper started again after close needs the hook again
+    shipper.start()
+    assert registered == [shipper.close]
+    shipper.close()
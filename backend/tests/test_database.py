@@ -0,0 +1,28 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.db import database
+
+
+def test_async_get_db_yields_a_session_and_closes_it(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}", poolclass=AsyncAdaptedQueuePool)
+    monkeypatch.setattr(database, 'AsyncSessionLocal', async_sessionmaker(engine, expire_on_commit=False))
+    waits = database.async_pool_metrics.waits
+
+    async def use_dependency():
+        dependency = database.get_db()
+        db = await anext(dependency)
+        assert isinstance(db, AsyncSession)
+        assert (await db.execute(text('SELECT 1'))).scalar_one() == 1
+        # The connection is checked out for the request and returned when the dependency finishes
+        assert engine.pool.checkedout() == 1
+        await dependency.aclose()
+        assert engine.pool.checkedout() == 0
+        assert not db.in_transaction()
+        await engine.dispose()
+
+    asyncio.run(use_dependency())
+    assert database.async_pool_metrics.waits == waits + 1
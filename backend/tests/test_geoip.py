@@ -0,0 +1,145 @@
+import csv
+
+import pytest
+
+from app.services import geoip
+from app.services.geoip import EU_COUNTRIES, GeoIPDatabase, GeoRestriction, build_database
+
+RANGES = """\
+first,last,country
+# Documentation and example ranges
+1.0.0.0,1.0.0.255,AU
+8.8.8.0/24,us
+203.0.113.0,203.0.113.127,FR
+2001:db8::/32,DE
+2a00:1450::,2a00:1450:ffff:ffff:ffff:ffff:ffff:ffff,IE
+"""
+
+
+def build(tmp_path, ranges: str = RANGES) -> str:
+    source = tmp_path / 'ranges.csv'
+    source.write_text(ranges, encoding='utf-8')
+    output = str(tmp_path / 'geoip.bin')
+    with open(source, newline='', encoding='utf-8') as rows:
+        build_database(csv.reader(rows), output)
+    return output
+
+
+@pytest.fixture(params=['little', 'big'])
+def database(request, tmp_path, monkeypatch):
+    # On big-endian hosts IPv4 bounds are read through _UInt32Column instead of a memoryview
+    monkeypatch.setattr(geoip.sys, 'byteorder', request.param)
+    database = GeoIPDatabase(build(tmp_path))
+    yield database
+    database.close()
+
+
+def test_build_counts_ranges_per_family(tmp_path):
+    source = tmp_path / 'ranges.csv'
+    source.write_text(RANGES, encoding='utf-8')
+    with open(source, newline='', encoding='utf-8') as rows:
+        assert build_database(csv.reader(rows), str(tmp_path / 'geoip.bin')) == (3, 2)
+
+
+@pytest.mark.parametrize('address, country', [
+    ('1.0.0.0', 'AU'),
+    ('1.0.0.255', 'AU'),
+    ('0.255.255.255', None),
+    ('1.0.1.0', None),
+    ('8.8.7.255', None),
+    ('8.8.8.0', 'US'),
+    ('8.8.8.255', 'US'),
+    ('203.0.113.127', 'FR'),
+    ('203.0.113.128', None),
+    ('0.0.0.0', None),
+    ('255.255.255.255', None),
+])
+def test_ipv4_range_edges(database, address, country):
+    assert database.lookup(address) == country
+
+
+@pytest.mark.parametrize('address, country', [
+    ('2001:db8::', 'DE'),
+    ('2001:db8:ffff:ffff:ffff:ffff:ffff:ffff', 'DE'),
+    ('2001:db7:ffff:ffff:ffff:ffff:ffff:ffff', None),
+    ('2001:db9::', None),
+    ('2a00:1450::', 'IE'),
+    ('2a00:1450:ffff:ffff:ffff:ffff:ffff:ffff', 'IE'),
+    ('2a00:1451::', None),
+    ('::1', None),
+    ('ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff', None),
+])
+def test_ipv6_range_edges(database, address, country):
+    assert database.lookup(address) == country
+
+
+@pytest.mark.parametrize('address, country', [
+    ('::ffff:8.8.8.8', 'US'),
+    ('::ffff:1.0.0.255', 'AU'),
+    ('::ffff:203.0.113.128', None),
+])
+def test_ipv4_mapped_addresses_use_the_ipv4_ranges(database, address, country):
+    assert database.lookup(address) == country
+
+
+@pytest.mark.parametrize('address', ['', 'not-an-ip', '1.2.3', '2001:db8::g'])
+def test_invalid_addresses_are_misses(database, address):
+    assert database.lookup(address) is None
+
+
+def test_misses_are_cached(database, monkeypatch):
+    assert database.lookup('192.0.2.1') is None
+    monkeypatch.setattr(database, '_lookup', lambda address: pytest.fail("lookup was not cached"))
+    assert database.lookup('192.0.2.1') is None
+
+
+def test_overlapping_ranges_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match="overlapping ranges for AU and NZ"):
+        build(tmp_path, "1.0.0.0,1.0.0.255,AU\n1.0.0.128/25,NZ\n")
+
+
+def test_invalid_rows_report_their_line(tmp_path):
+    with pytest.raises(ValueError, match="line 2: invalid country code"):
+        build(tmp_path, "1.0.0.0,1.0.0.255,AU\n2.0.0.0,2.0.0.255,AUS\n")
+
+
+def test_truncated_database_is_rejected(tmp_path):
+    path = build(tmp_path)
+    with open(path, 'r+b') as database:
+        database.truncate(geoip.HEADER.size + 4)
+    with pytest.raises(ValueError, match="truncated or corrupt"):
+        GeoIPDatabase(path)
+
+
+def test_eu_expands_to_member_states(database):
+    restriction = GeoRestriction(database, allowed_countries=['eu'], mode='enforce')
+
+    assert EU_COUNTRIES <= restriction.allowed
+    assert restriction.check('203.0.113.1') == (True, 'FR')
+    assert restriction.check('2001:db8::1') == (True, 'DE')
+    assert restriction.check('8.8.8.8') == (False, 'US')
+    assert restriction.check('192.0.2.1') == (True, None)
+
+
+def test_blocked_countries_win_over_allowed(database):
+    restriction = GeoRestriction(database, allowed_countries=['EU'], blocked_countries=['fr'],
+                                 unknown_country='block')
+
+    assert restriction.check('203.0.113.1') == (False, 'FR')
+    assert restriction.check('2a00:1450::1') == (True, 'IE')
+    assert restriction.check('192.0.2.1') == (False, None)
+
+
+def test_close_releases_the_mapping(tmp_path):
+    database = GeoIPDatabase(build(tmp_path))
+    assert database.lookup('1.0.0.1') == 'AU'
+
+    # Closing the mmap raises BufferError while memoryviews of the IPv4 columns are alive
+    database.close()
+
+    assert database._buffer.closed
+    assert database._views == []
+    build(tmp_path, "1.0.0.0,1.0.0.255,NZ\n")
+    reopened = GeoIPDatabase(database.path)
+    assert reopened.lookup('1.0.0.1') == 'NZ'
+    reopened.close()
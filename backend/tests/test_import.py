@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Generous for slow CI machines; importing used to take seconds of AWS calls
+IMPORT_BUDGET_SECONDS = 5.0
+
+_IMPORT_WITHOUT_NETWORK = '''
+import socket
+import time
+
+
+def _refuse(*args, **kwargs):
+    raise AssertionError(f"network access during import: {args!r}")
+
+
+socket.socket.connect = _refuse
+socket.socket.connect_ex = _refuse
+socket.create_connection = _refuse
+socket.getaddrinfo = _refuse
+
+started = time.perf_counter()
+import app.main  # noqa: E402,F401
+print(time.perf_counter() - started)
+'''
+
+
+def test_importing_the_app_does_no_network_io() -> None:
+    # A fresh interpreter, so modules imported by other tests do not hide import-time work
+    result = subprocess.run(
+        [sys.executable, '-c', _IMPORT_WITHOUT_NETWORK],
+        cwd=BACKEND_DIR,
+        env=dict(os.environ),
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert float(result.stdout.strip().splitlines()[-1]) < IMPORT_BUDGET_SECONDS
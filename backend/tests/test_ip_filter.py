@@ -0,0 +1,59 @@
+import asyncio
+
+from app.services.ip_filter import IPFilter, IPLists
+
+
+def file_config(tmp_path):
+    return {
+        'source': 'file',
+        'blocklist_path': str(tmp_path / 'blocked.txt'),
+        'allowlist_path': '',
+        'redis_blocklist_key': 'blocked',
+        'redis_allowlist_key': 'allowed',
+        'reload_interval_seconds': 0.01,
+    }
+
+
+def test_prefixes_and_mapped_addresses_match():
+    feed = IPFilter.from_lines(['10.0.0.0/8  # private', '192.0.2.7', '2001:db8::/32', 'not an ip'])
+
+    assert '10.200.3.4' in feed
+    assert '192.0.2.7' in feed
+    assert '192.0.2.8' not in feed
+    assert '::ffff:10.1.2.3' in feed
+    assert '2001:db8:1::1' in feed
+    assert '2001:db9::1' not in feed
+    assert feed.rejected == 1
+
+
+def test_watch_keeps_the_last_good_lists_and_keeps_polling(tmp_path):
+    (tmp_path / 'blocked.txt').write_text('203.0.113.0/24\n')
+    lists = IPLists(config=file_config(tmp_path))
+    lists.reload_files()
+    reload_files = lists.reload_files
+    attempts = []
+
+    def failing_once():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('feed parser bug')
+        return reload_files()
+
+    lists.reload_files = failing_once
+
+    async def run():
+        watcher = asyncio.create_task(lists.watch())
+        await asyncio.sleep(0.05)
+        assert not watcher.done()
+        assert lists.is_blocked('203.0.113.9')
+        (tmp_path / 'blocked.txt').write_text('198.51.100.0/24\n')
+        for _ in range(100):
+            if lists.is_blocked('198.51.100.1'):
+                break
+            await asyncio.sleep(0.01)
+        watcher.cancel()
+
+    asyncio.run(run())
+    assert len(attempts) > 2
+    assert lists.is_blocked('198.51.100.1')
+    assert not lists.is_blocked('203.0.113.9')
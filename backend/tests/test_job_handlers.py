@@ -0,0 +1,168 @@
+import functools
+import json
+import os
+from typing import Any, Dict, List
+
+import pytest
+
+from app.core.config import settings
+from app.services import job_handlers
+from app.services.audit_service import AuditService
+from app.services.job_queue import JobContext, PermanentJobError, _is_permanent
+from app.services.s3_export import MIN_PART_SIZE, MultipartUploadWriter
+from app.services.security_service import DecryptionError
+from test_s3_export import BUCKET, StubS3
+
+RECORD_SIZE = 1024 * 1024
+RECORDS = 12
+PAYLOAD = {'data_type': 'user', 'source_key': 'records.jsonl', 'destination_key': 'records.reencrypted.jsonl'}
+
+
+class StubBody:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.closed = False
+
+    def iter_lines(self):
+        return iter(self.data.splitlines())
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class SourceS3(StubS3):
+    def get_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        return {'Body': StubBody(self.objects[Key])}
+
+
+class FlakySecurityService:
+    """Tags each record as re-encrypted; raises on the record numbered fail_at, once"""
+
+    def __init__(self, fail_at: int = -1):
+        self.fail_at = fail_at
+        self.seen: List[int] = []
+
+    def reencrypt_sensitive_data(self, data: Dict[str, Any], data_type: str) -> Dict[str, Any]:
+        if data['n'] == self.fail_at:
+            self.fail_at = -1
+            raise Exception("KMS unavailable")
+        self.seen.append(data['n'])
+        return {**data, 'reencrypted': True}
+
+
+@pytest.fixture
+def client(monkeypatch) -> SourceS3:
+    client = SourceS3()
+    client.objects[PAYLOAD['source_key']] = b''.join(
+        (json.dumps({'n': n, 'padding': 'x' * RECORD_SIZE}) + '\n').encode('utf-8') for n in range(RECORDS)
+    )
+    monkeypatch.setattr(settings, 'AWS_S3_BUCKET', BUCKET)
+    monkeypatch.setattr(job_handlers, 'get_client', lambda service, endpoint_url=None: client)
+    # The smallest part S3 accepts, so a dozen records span several parts
+    monkeypatch.setattr(job_handlers, 'MultipartUploadWriter',
+                        functools.partial(MultipartUploadWriter, part_size=MIN_PART_SIZE))
+    return client
+
+
+def run(tmp_path, attempt: int) -> Dict[str, Any]:
+    context = JobContext({'id': 'job-1', 'attempts': attempt}, str(tmp_path))
+    return job_handlers.reencrypt_records(dict(PAYLOAD), context)
+
+
+def output_records(client: SourceS3) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in client.objects[PAYLOAD['destination_key']].splitlines()]
+
+
+def test_retry_continues_after_uploaded_parts(client, tmp_path, monkeypatch):
+    service = FlakySecurityService(fail_at=8)
+    monkeypatch.setattr(job_handlers, 'security_service', service)
+
+    with pytest.raises(Exception, match="KMS unavailable"):
+        run(tmp_path, 1)
+    assert os.path.exists(os.path.join(tmp_path, 'job-1.json'))
+    assert client.aborted == []
+
+    result = run(tmp_path, 2)
+
+    assert result['records'] == RECORDS
+    # Records 0-4 made up the first part and were not re-encrypted again
+    assert service.seen == list(range(8)) + list(range(5, RECORDS))
+    records = output_records(client)
+    assert [record['n'] for record in records] == list(range(RECORDS))
+    assert all(record['reencrypted'] for record in records)
+    assert not os.path.exists(os.path.join(tmp_path, 'job-1.json'))
+
+
+def test_invalid_record_aborts_the_upload(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_handlers, 'security_service', FlakySecurityService())
+    client.objects[PAYLOAD['source_key']] += b'not json\n'
+
+    with pytest.raises(PermanentJobError, match=f"Record {RECORDS} is not valid JSON"):
+        run(tmp_path, 1)
+
+    assert client.aborted == ['upload-1']
+    assert PAYLOAD['destination_key'] not in client.objects
+    assert not os.path.exists(os.path.join(tmp_path, 'job-1.json'))
+
+
+def test_undecryptable_record_aborts_the_upload(client, tmp_path, monkeypatch):
+    class CorruptSecurityService:
+        def reencrypt_sensitive_data(self, data: Dict[str, Any], data_type: str) -> Dict[str, Any]:
+            raise DecryptionError("Decryption failed: ciphertext authentication failed")
+
+    monkeypatch.setattr(job_handlers, 'security_service', CorruptSecurityService())
+
+    with pytest.raises(PermanentJobError, match="Record 0 cannot be decrypted"):
+        run(tmp_path, 1)
+
+    assert client.aborted == ['upload-1']
+    assert not os.path.exists(os.path.join(tmp_path, 'job-1.json'))
+
+
+def test_export_result_names_unavailable_sources(tmp_path, monkeypatch):
+    class ExportingAuditService:
+        def export_user_data_to_s3(self, user_id, checkpoint_path, progress):
+            return {'bucket': BUCKET, 'key': f'gdpr-exports/{user_id}.jsonl.gz', 'url': 'https://example',
+                    'url_expires_in': 3600, 'records': {'activity_logs': 3},
+                    'unavailable_sources': ['personal_info']}
+
+    monkeypatch.setattr(job_handlers, 'audit_service', ExportingAuditService())
+    context = JobContext({'id': 'job-1', 'attempts': 1}, str(tmp_path))
+
+    result = job_handlers.export_user_data({'user_id': 'u1'}, context)
+
+    assert result['unavailable_sources'] == ['personal_info']
+
+
+def test_deletion_runs_implemented_steps_and_names_the_rest(tmp_path, monkeypatch):
+    service = AuditService()
+    deleted: List[str] = []
+    events: List[Dict[str, Any]] = []
+    monkeypatch.setattr(service, '_delete_user_activity_logs', lambda user_id: deleted.append('activity_logs'))
+    monkeypatch.setattr(service, '_delete_user_consent_records', lambda user_id: deleted.append('consent_records'))
+    monkeypatch.setattr(service, 'log_gdpr_event', lambda **event: events.append(event))
+    monkeypatch.setattr(job_handlers, 'audit_service', service)
+    context = JobContext({'id': 'job-1', 'attempts': 1}, str(tmp_path))
+
+    result = job_handlers.delete_user_data({'user_id': 'u1'}, context)
+
+    # _delete_user_personal_info is still a stub, which must not stop the other stores being erased
+    assert deleted == ['activity_logs', 'consent_records']
+    assert result == {'user_id': 'u1', 'completed_steps': ['activity_logs', 'consent_records'],
+                      'unavailable_steps': ['personal_info']}
+    assert events[-1]['details']['unavailable_steps'] == ['personal_info']
+
+
+def test_deletion_step_failure_is_retried(tmp_path, monkeypatch):
+    service = AuditService()
+
+    def timed_out(user_id):
+        raise Exception("Timed out flushing queued audit events before deletion")
+
+    monkeypatch.setattr(service, '_delete_user_activity_logs', timed_out)
+    monkeypatch.setattr(job_handlers, 'audit_service', service)
+    context = JobContext({'id': 'job-1', 'attempts': 1}, str(tmp_path))
+
+    with pytest.raises(Exception, match="Failed to delete user data: Timed out") as raised:
+        job_handlers.delete_user_data({'user_id': 'u1'}, context)
+    assert not _is_permanent(raised.value)
@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app.core.security_config import ENCRYPTION_CONFIG
+from app.services.security_service import SecurityService
+
+PAGE_SIZE = 1000
+
+
+class StubKMS:
+    """Local KMS holding many keys, only one of them tagged Application=Dynamis"""
+
+    def __init__(self, keys: int, application_key_index: int, alias: Optional[str] = None):
+        self.key_ids = [f"key-{i:05d}" for i in range(keys)]
+        self.application_key = self.key_ids[application_key_index]
+        self.aliases: Dict[str, str] = {}
+        if alias is not None:
+            self.aliases[alias] = self.application_key
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] += 1
+
+    def describe_key(self, KeyId: str) -> Dict[str, Any]:
+        self._call('describe_key')
+        key_id = self.aliases.get(KeyId, KeyId)
+        if key_id not in self.key_ids:
+            raise ClientError({'Error': {'Code': 'NotFoundException'}}, 'DescribeKey')
+        return {'KeyMetadata': {'KeyId': key_id, 'KeyState': 'Enabled'}}
+
+    def list_keys(self, Marker: Optional[str] = None, Limit: int = PAGE_SIZE) -> Dict[str, Any]:
+        self._call('list_keys')
+        start = int(Marker or 0)
+        end = start + min(Limit, PAGE_SIZE)
+        page: Dict[str, Any] = {'Keys': [{'KeyId': key_id} for key_id in self.key_ids[start:end]]}
+        if end < len(self.key_ids):
+            page.update(Truncated=True, NextMarker=str(end))
+        else:
+            page['Truncated'] = False
+        return page
+
+    def get_paginator(self, operation: str) -> 'StubPaginator':
+        assert operation == 'list_keys'
+        return StubPaginator(self)
+
+    def list_resource_tags(self, KeyId: str) -> Dict[str, Any]:
+        self._call('list_resource_tags')
+        tags: List[Dict[str, str]] = []
+        if KeyId == self.application_key:
+            tags.append({'TagKey': 'Application', 'TagValue': 'Dynamis'})
+        return {'Tags': tags}
+
+    def create_alias(self, AliasName: str, TargetKeyId: str) -> Dict[str, Any]:
+        self._call('create_alias')
+        self.aliases[AliasName] = TargetKeyId
+        return {}
+
+    def create_key(self, **params: Any) -> Dict[str, Any]:
+        self._call('create_key')
+        raise AssertionError("an existing key must be found instead of creating one")
+
+
+class StubPaginator:
+    def __init__(self, kms: StubKMS):
+        self.kms = kms
+
+    def paginate(self) -> Any:
+        marker = None
+        while True:
+            page = self.kms.list_keys(Marker=marker)
+            yield page
+            if not page['Truncated']:
+                return
+            marker = page['NextMarker']
+
+
+@pytest.fixture(autouse=True)
+def key_id_cache(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> str:
+    path = str(tmp_path / 'kms-key.json')
+    monkeypatch.setitem(ENCRYPTION_CONFIG, 'key_id_cache', {**ENCRYPTION_CONFIG['key_id_cache'], 'path': path})
+    return path
+
+
+def test_alias_resolves_the_key_in_one_round_trip() -> None:
+    kms = StubKMS(keys=5000, application_key_index=4321, alias=ENCRYPTION_CONFIG['key_alias'])
+    assert SecurityService(kms_client=kms).key_id == kms.application_key
+    assert kms.calls == Counter(describe_key=1)
+
+
+def test_tag_scan_pages_past_the_first_page_and_creates_the_alias() -> None:
+    kms = StubKMS(keys=5000, application_key_index=4321)
+    assert SecurityService(kms_client=kms).key_id == kms.application_key
+    assert kms.calls['list_keys'] == 5
+    # Tags are checked a page at a time, so the scan stops within the matching page
+    assert kms.calls['list_resource_tags'] <= 5 * PAGE_SIZE
+    assert kms.calls['create_alias'] == 1
+    assert kms.aliases[ENCRYPTION_CONFIG['key_alias']] == kms.application_key
+
+
+def test_later_resolutions_skip_discovery(key_id_cache: str) -> None:
+    kms = StubKMS(keys=5000, application_key_index=4321)
+    SecurityService(kms_client=kms).key_id
+    kms.calls.clear()
+
+    # The key id cache file answers a restart without any KMS call
+    assert SecurityService(kms_client=kms).key_id == kms.application_key
+    assert sum(kms.calls.values()) == 0
+
+    # Without the cache file the alias created by the scan is a single call
+    os.remove(key_id_cache)
+    assert SecurityService(kms_client=kms).key_id == kms.application_key
+    assert kms.calls == Counter(describe_key=1)
@@ -0,0 +1,43 @@
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from app.db.database import PoolMetrics
+
+
+def make_engine(tmp_path):
+    return create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", poolclass=QueuePool, pool_size=2, max_overflow=3
+    )
+
+
+def test_checkouts_within_pool_size_are_not_overflow(tmp_path):
+    engine = make_engine(tmp_path)
+    metrics = PoolMetrics()
+    metrics.instrument(engine)
+    for _ in range(5):
+        with engine.connect():
+            pass
+    held = [engine.connect() for _ in range(2)]
+    for connection in held:
+        connection.close()
+
+    snapshot = metrics.snapshot(engine)
+    assert snapshot['checkouts'] == 7
+    assert snapshot['overflow_events'] == 0
+
+
+def test_each_checkout_past_pool_size_counts_once(tmp_path):
+    engine = make_engine(tmp_path)
+    metrics = PoolMetrics()
+    metrics.instrument(engine)
+    held = [engine.connect() for _ in range(4)]
+    assert metrics.snapshot(engine)['overflow'] == 2
+    for connection in held:
+        connection.close()
+    # Reconnecting after the burst reuses pooled connections without overflowing
+    with engine.connect():
+        pass
+
+    snapshot = metrics.snapshot(engine)
+    assert snapshot['checkouts'] == 5
+    assert snapshot['overflow_events'] == 2
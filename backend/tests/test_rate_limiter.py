@@ -0,0 +1,117 @@
+from typing import Any, Dict, List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import JWTError
+
+from app.middleware.security import RateLimitMiddleware, SecurityMiddleware
+from app.services.audit_service import audit_service
+from app.middleware import security
+from app.services.rate_limiter import ALGORITHMS, RateLimiter, SlidingWindowCounterLimiter
+
+
+@pytest.mark.parametrize('algorithm', sorted(ALGORITHMS))
+def test_limit_is_enforced_per_key(algorithm: str) -> None:
+    limiter = ALGORITHMS[algorithm](3, 60.0)
+    results = [limiter.hit('ip:a', now=1000.0) for _ in range(4)]
+    assert [bool(result) for result in results] == [True, True, True, False]
+    assert [result.remaining for result in results[:3]] == [2, 1, 0]
+    assert limiter.hit('ip:b', now=1000.0)
+
+    rejected = results[-1]
+    headers = rejected.headers()
+    assert headers['X-RateLimit-Limit'] == '3'
+    assert headers['X-RateLimit-Remaining'] == '0'
+    assert 1 <= int(headers['Retry-After']) <= 60
+    assert 'Retry-After' not in results[0].headers()
+
+
+@pytest.mark.parametrize('algorithm', sorted(ALGORITHMS))
+def test_requests_are_allowed_again_after_the_window(algorithm: str) -> None:
+    limiter = ALGORITHMS[algorithm](2, 60.0)
+    limiter.hit('ip:a', now=1000.0)
+    limiter.hit('ip:a', now=1000.0)
+    assert not limiter.hit('ip:a', now=1001.0)
+    assert limiter.hit('ip:a', now=1000.0 + 121.0)
+
+
+@pytest.mark.parametrize('algorithm', sorted(ALGORITHMS))
+def test_idle_keys_are_evicted(algorithm: str) -> None:
+    limiter = ALGORITHMS[algorithm](10, 60.0)
+    for i in range(100):
+        limiter.hit(f"ip:{i}", now=1000.0)
+    assert len(limiter) == 100
+    limiter.hit('ip:late', now=1000.0 + 1000.0)
+    assert len(limiter) == 1
+
+
+def test_base_limiter_cannot_be_instantiated() -> None:
+    with pytest.raises(TypeError):
+        RateLimiter(10, 60.0)
+
+
+def test_tracked_keys_are_bounded() -> None:
+    limiter = SlidingWindowCounterLimiter(10, 60.0, max_keys=50)
+    for i in range(1000):
+        limiter.hit(f"ip:{i}", now=1000.0)
+    assert len(limiter) == 50
+
+
+@pytest.fixture
+def audited(monkeypatch: pytest.MonkeyPatch) -> List[Dict[str, Any]]:
+    events: List[Dict[str, Any]] = []
+    monkeypatch.setattr(audit_service, 'log_security_event', lambda **event: events.append(event))
+    return events
+
+
+def _client(limit: int, key_by: str = 'ip') -> TestClient:
+    rate_limiter = RateLimitMiddleware()
+    rate_limiter.limiter = SlidingWindowCounterLimiter(limit, 60.0)
+    rate_limiter.key_by = key_by
+    app = FastAPI()
+
+    @app.get('/ping')
+    async def ping() -> Dict[str, str]:
+        return {'status': 'ok'}
+
+    app.add_middleware(SecurityMiddleware, rate_limiter=rate_limiter)
+    return TestClient(app)
+
+
+def test_security_middleware_enforces_the_limit(audited: List[Dict[str, Any]]) -> None:
+    client = _client(limit=2)
+    first = client.get('/ping')
+    assert first.status_code == 200
+    assert first.headers['X-RateLimit-Limit'] == '2'
+    assert first.headers['X-RateLimit-Remaining'] == '1'
+    assert first.headers['X-Content-Type-Options'] == 'nosniff'
+
+    assert client.get('/ping').status_code == 200
+    rejected = client.get('/ping')
+    assert rejected.status_code == 429
+    assert int(rejected.headers['Retry-After']) >= 1
+    assert rejected.headers['X-RateLimit-Remaining'] == '0'
+    assert rejected.headers['X-Frame-Options'] == 'DENY'
+    assert [event['event_type'] for event in audited] == ['rate_limit_exceeded']
+    assert audited[0]['ip_address'] == 'testclient'
+
+
+def test_user_limits_are_keyed_by_the_verified_token(audited: List[Dict[str, Any]],
+                                                     monkeypatch: pytest.MonkeyPatch) -> None:
+    def verify_token(token: str):
+        if token != 'valid':
+            raise JWTError("bad signature")
+        return {'sub': 'user-1'}, 0
+
+    monkeypatch.setattr(security.rbac_middleware, 'verify_token', verify_token)
+    client = _client(limit=1, key_by='user')
+
+    assert client.get('/ping', headers={'Authorization': 'Bearer valid'}).status_code == 200
+    rejected = client.get('/ping', headers={'Authorization': 'Bearer valid'})
+    assert rejected.status_code == 429
+    assert audited[-1]['user_id'] == 'user-1'
+    # Anonymous and invalid tokens fall back to the client address, which has its own budget
+    assert client.get('/ping').status_code == 200
+    assert client.get('/ping', headers={'Authorization': 'Bearer forged'}).status_code == 429
+    assert audited[-1]['user_id'] is None
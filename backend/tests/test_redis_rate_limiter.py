@@ -0,0 +1,129 @@
+import asyncio
+import time
+from typing import Any, Dict, List
+
+import pytest
+from fakeredis import FakeServer, aioredis
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from redis.asyncio import Redis
+
+from app.core.security_config import RATE_LIMIT_CONFIG
+from app.middleware.security import RateLimitMiddleware, SecurityMiddleware
+from app.services.audit_service import audit_service
+from app.services.rate_limiter import SlidingWindowCounterLimiter
+from app.services.redis_rate_limiter import SCRIPTS, RedisRateLimiter
+
+
+def _limiter(client: Any, algorithm: str, limit: int = 3, window: float = 60.0, **options: Any) -> RedisRateLimiter:
+    return RedisRateLimiter(client, algorithm, limit, window, key_prefix='test', **options)
+
+
+def _unreachable() -> Redis:
+    # Nothing listens on port 1, so every command fails with a ConnectionError
+    return Redis(host='127.0.0.1', port=1, socket_connect_timeout=0.1)
+
+
+@pytest.mark.parametrize('algorithm', sorted(SCRIPTS))
+def test_scripts_enforce_the_limit(algorithm: str) -> None:
+    async def run() -> None:
+        limiter = _limiter(aioredis.FakeRedis(), algorithm)
+        results = [await limiter.hit('ip:a') for _ in range(4)]
+        assert [bool(result) for result in results] == [True, True, True, False]
+        assert [result.remaining for result in results[:3]] == [2, 1, 0]
+        assert results[-1].retry_after > 0
+        assert 'Retry-After' in results[-1].headers()
+        assert await limiter.hit('ip:b')
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('algorithm', sorted(SCRIPTS))
+def test_workers_share_counters(algorithm: str) -> None:
+    async def run() -> None:
+        server = FakeServer()
+        workers = [_limiter(aioredis.FakeRedis(server=server), algorithm) for _ in range(3)]
+        results = [await worker.hit('ip:a') for worker in workers]
+        assert all(results)
+        assert not await workers[0].hit('ip:a')
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('algorithm', sorted(SCRIPTS))
+def test_keys_expire_with_the_window(algorithm: str) -> None:
+    async def run() -> None:
+        client = aioredis.FakeRedis()
+        limiter = _limiter(client, algorithm, limit=1, window=0.2)
+        assert await limiter.hit('ip:a')
+        assert not await limiter.hit('ip:a')
+        assert await client.pttl(limiter._key('ip:a')) > 0
+        await asyncio.sleep(0.45)
+        assert await limiter.hit('ip:a')
+
+    asyncio.run(run())
+
+
+def test_hit_many_pipelines_a_batch() -> None:
+    async def run() -> None:
+        limiter = _limiter(aioredis.FakeRedis(), 'sliding_window_counter', limit=2)
+        results = await limiter.hit_many(['ip:a', 'ip:a', 'ip:b', 'ip:a'])
+        assert [bool(result) for result in results] == [True, True, True, False]
+
+    asyncio.run(run())
+
+
+def test_local_fallback_while_redis_is_unreachable() -> None:
+    async def run() -> None:
+        limiter = _limiter(_unreachable(), 'token_bucket', limit=2, fallback=SlidingWindowCounterLimiter(2, 60.0))
+        results = [await limiter.hit('ip:a') for _ in range(3)]
+        assert [bool(result) for result in results] == [True, True, False]
+        # Redis is skipped for retry_interval after the failure
+        assert not limiter._available()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('failure_mode, allowed', [('open', True), ('closed', False)])
+def test_open_and_closed_failure_modes(failure_mode: str, allowed: bool) -> None:
+    async def run() -> None:
+        limiter = _limiter(_unreachable(), 'sliding_window_log', failure_mode=failure_mode, retry_interval=30.0)
+        results = await limiter.hit_many(['ip:a'] * 5)
+        assert [bool(result) for result in results] == [allowed] * 5
+        if not allowed:
+            assert results[0].headers()['Retry-After'] == '30'
+
+    asyncio.run(run())
+
+
+def test_redis_is_retried_after_the_retry_interval() -> None:
+    async def run() -> None:
+        limiter = _limiter(_unreachable(), 'token_bucket', failure_mode='closed', retry_interval=0.05)
+        assert not await limiter.hit('ip:a')
+        limiter.client = aioredis.FakeRedis()
+        limiter._script = limiter.client.register_script(SCRIPTS['token_bucket'])
+        assert not await limiter.hit('ip:a')
+        time.sleep(0.06)
+        assert await limiter.hit('ip:a')
+
+    asyncio.run(run())
+
+
+def test_security_middleware_uses_the_redis_backend(monkeypatch: pytest.MonkeyPatch) -> None:
+    events: List[Dict[str, Any]] = []
+    monkeypatch.setattr(audit_service, 'log_security_event', lambda **event: events.append(event))
+    monkeypatch.setitem(RATE_LIMIT_CONFIG, 'backend', 'redis')
+    rate_limiter = RateLimitMiddleware()
+    app = FastAPI()
+
+    @app.get('/ping')
+    async def ping() -> Dict[str, str]:
+        return {'status': 'ok'}
+
+    app.add_middleware(SecurityMiddleware, rate_limiter=rate_limiter)
+    with TestClient(app) as client:
+        # Created on the test client's event loop
+        rate_limiter._distributed_limiter = _limiter(aioredis.FakeRedis(), 'sliding_window_counter', limit=1)
+        assert client.get('/ping').status_code == 200
+        assert client.get('/ping').status_code == 429
+    assert [event['event_type'] for event in events] == ['rate_limit_exceeded']
@@ -0,0 +1,194 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app.services import s3_export
+from app.services.gdpr_export import GDPRExporter
+from app.services.s3_export import S3ExportUploader
+
+BUCKET = 'exports'
+
+
+def client_error(code: str, operation: str) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class StubPaginator:
+    def __init__(self, client: 'StubS3'):
+        self.client = client
+
+    def paginate(self, Bucket: str, Key: str, UploadId: str):
+        if UploadId not in self.client.uploads:
+            raise client_error('NoSuchUpload', 'ListParts')
+        parts = self.client.uploads[UploadId]['parts']
+        yield {'Parts': [
+            {'PartNumber': number, 'ETag': etag, 'Size': len(body)}
+            for number, (etag, body) in sorted(parts.items())
+        ]}
+
+
+class StubS3:
+    """In-memory multipart uploads; complete_multipart_upload fails the first fail_completes times"""
+
+    def __init__(self, fail_completes: int = 0):
+        self.fail_completes = fail_completes
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self.objects: Dict[str, bytes] = {}
+        self.aborted: List[str] = []
+        self.uploaded_parts = 0
+        self.completed_parts = 0
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {'key': Key, 'parts': {}}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes,
+                    **kwargs: Any) -> Dict[str, Any]:
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        self.uploads[UploadId]['parts'][PartNumber] = (etag, Body)
+        self.uploaded_parts += 1
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str,
+                                  MultipartUpload: Dict[str, Any]) -> Dict[str, Any]:
+        if self.fail_completes:
+            self.fail_completes -= 1
+            raise client_error('InternalError', 'CompleteMultipartUpload')
+        parts = self.uploads.pop(UploadId)['parts']
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(parts)
+        self.objects[Key] = b''.join(parts[number][1] for number in numbers)
+        self.completed_parts = len(numbers)
+        return {'Key': Key}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> Dict[str, Any]:
+        self.uploads.pop(UploadId, None)
+        self.aborted.append(UploadId)
+        return {}
+
+    def get_paginator(self, operation: str) -> StubPaginator:
+        assert operation == 'list_parts'
+        return StubPaginator(self)
+
+    def generate_presigned_url(self, operation: str, Params: Dict[str, Any], ExpiresIn: int) -> str:
+        return f"https://{Params['Bucket']}.example/{Params['Key']}"
+
+
+class CountingSources:
+    def __init__(self, records: int):
+        self.records = records
+        self.reads = 0
+
+    def __call__(self, window_end: datetime) -> Dict[str, Any]:
+        def activity():
+            self.reads += 1
+            for index in range(self.records):
+                yield {'n': index, 'noise': hashlib.sha256(str(index).encode()).hexdigest()}
+        return {'activity_logs': activity}
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    monkeypatch.setattr(s3_export, 'MIN_PART_SIZE', 1024)
+
+
+def uploader(client: StubS3) -> S3ExportUploader:
+    return S3ExportUploader(client, BUCKET, part_size=1024, max_in_flight=2)
+
+
+def exported_lines(data: bytes) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in gzip.decompress(data).splitlines()]
+
+
+def test_failed_completion_is_retried_without_re_exporting(tmp_path):
+    client = StubS3(fail_completes=1)
+    sources = CountingSources(records=200)
+    exporter = GDPRExporter(sources, checkpoint_every=20)
+    checkpoint_path = str(tmp_path / 'export.json')
+
+    with pytest.raises(ClientError):
+        uploader(client).export(exporter, 'u1', checkpoint_path)
+    saved = json.loads(open(checkpoint_path).read())
+    assert saved['parts'][-1]['final'] is True
+    assert saved['parts'][-1]['state'] is not None
+    parts_before = client.uploaded_parts
+
+    report = uploader(client).export(exporter, 'u1', checkpoint_path)
+
+    assert sources.reads == 1
+    assert client.uploaded_parts == parts_before
+    assert report['records'] == {'activity_logs': 200}
+    assert not os.path.exists(checkpoint_path)
+    lines = exported_lines(client.objects[report['key']])
+    assert [line['data']['n'] for line in lines if 'source' in line] == list(range(200))
+    assert lines[-1]['type'] == 'summary'
+
+
+def test_interrupted_export_resumes_after_the_last_part(tmp_path):
+    client = StubS3()
+    sources = CountingSources(records=200)
+    checkpoint_path = str(tmp_path / 'export.json')
+
+    class Interrupt(Exception):
+        pass
+
+    calls = {'marks': 0}
+    write = GDPRExporter.write
+
+    def interrupted_write(self, output, checkpoint, on_checkpoint=None, progress=None):
+        def on_mark(checkpoint):
+            on_checkpoint(checkpoint)
+            calls['marks'] += 1
+            if calls['marks'] == 6:
+                raise Interrupt()
+        return write(self, output, checkpoint, on_mark, progress)
+
+    exporter = GDPRExporter(sources, checkpoint_every=20)
+    exporter.write = interrupted_write.__get__(exporter)
+    with pytest.raises(Interrupt):
+        uploader(client).export(exporter, 'u1', checkpoint_path)
+    resumed_from = len(json.loads(open(checkpoint_path).read())['parts'])
+    assert resumed_from
+    parts_before = client.uploaded_parts
+
+    report = uploader(client).export(GDPRExporter(sources, checkpoint_every=20), 'u1', checkpoint_path)
+
+    lines = exported_lines(client.objects[report['key']])
+    assert [line['data']['n'] for line in lines if 'source' in line] == list(range(200))
+    assert sum(1 for line in lines if line.get('type') == 'header') == 1
+    # Only the parts after the checkpointed ones were uploaded again
+    assert client.uploaded_parts - parts_before == client.completed_parts - resumed_from
+
+
+def test_checkpoint_from_an_incompatible_exporter_starts_a_new_upload(tmp_path):
+    client = StubS3()
+    checkpoint_path = str(tmp_path / 'export.json')
+    stale = client.create_multipart_upload(Bucket=BUCKET, Key='gdpr-exports/u1/old.jsonl.gz')['UploadId']
+    etag = client.upload_part(Bucket=BUCKET, Key='gdpr-exports/u1/old.jsonl.gz', UploadId=stale,
+                              PartNumber=1, Body=b'x' * 2048)['ETag']
+    with open(checkpoint_path, 'w') as checkpoint_file:
+        json.dump({
+            'format_version': s3_export.FORMAT_VERSION,
+            'user_id': 'u1',
+            'bucket': BUCKET,
+            'key': 'gdpr-exports/u1/old.jsonl.gz',
+            'upload_id': stale,
+            'window_end': datetime(2026, 1, 1).isoformat(),
+            'parts': [{
+                'PartNumber': 1, 'ETag': etag, 'size': 2048, 'end_offset': 2048,
+                'state': {'format_version': 0, 'user_id': 'u1'},
+            }],
+        }, checkpoint_file)
+
+    report = uploader(client).export(GDPRExporter(CountingSources(records=50)), 'u1', checkpoint_path)
+
+    assert client.aborted == [stale]
+    assert report['key'] != 'gdpr-exports/u1/old.jsonl.gz'
+    assert report['records'] == {'activity_logs': 50}
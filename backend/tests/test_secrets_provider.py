@@ -0,0 +1,85 @@
+import time
+
+import pytest
+from jose import JWTError, jwt
+
+from app.middleware.security import RBACMiddleware
+from app.services.secrets_provider import SecretsProvider, SecretVersions
+
+NAME = '/dynamis/jwt/secret'
+
+
+class StubBackend:
+    def __init__(self, versions):
+        self.versions = versions
+
+    def fetch(self, name):
+        return self.versions
+
+
+@pytest.fixture
+def make_provider():
+    providers = []
+
+    def make(backend, previous_window):
+        provider = SecretsProvider(backend, ttl=3600, previous_window=previous_window)
+        providers.append(provider)
+        return provider
+
+    yield make
+    for provider in providers:
+        provider.close()
+
+
+def rotate(provider, backend, current, previous):
+    backend.versions = SecretVersions(current, previous)
+    return provider.refresh(NAME)
+
+
+def test_previous_secret_is_dropped_after_the_window(make_provider):
+    backend = StubBackend(SecretVersions('old'))
+    provider = make_provider(backend, previous_window=0.2)
+    changes = []
+    provider.on_change(lambda name, versions: changes.append(versions.values()))
+    assert provider.get(NAME).values() == ['old']
+
+    rotate(provider, backend, 'new', 'old')
+    assert provider.get(NAME).values() == ['new', 'old']
+    # Refreshing the same versions keeps the time the rotation was first seen
+    first_seen = provider.get(NAME).current_since
+    provider.refresh(NAME)
+    assert provider.get(NAME).current_since == first_seen
+
+    time.sleep(0.25)
+    assert provider.get(NAME).values() == ['new']
+    provider.refresh(NAME)
+    assert provider.get(NAME).values() == ['new']
+    assert changes == [['new', 'old']]
+
+
+def test_backend_version_time_starts_the_window(make_provider):
+    # Secrets Manager reports when AWSCURRENT was created, so a worker that
+    # starts long after the rotation does not reopen the window
+    rotated_at = time.time() - 7200
+    provider = make_provider(StubBackend(SecretVersions('new', 'old', rotated_at)), previous_window=3600)
+    assert provider.get(NAME).values() == ['new']
+
+
+def test_tokens_signed_with_the_previous_secret_expire_with_the_window(make_provider):
+    backend = StubBackend(SecretVersions('old'))
+    provider = make_provider(backend, previous_window=0.3)
+    provider.get(NAME)
+    rotate(provider, backend, 'new', 'old')
+    rbac = RBACMiddleware()
+    rbac._secrets = provider
+    old_token = jwt.encode({'sub': '1', 'exp': time.time() + 3600}, 'old', algorithm='HS256')
+    new_token = jwt.encode({'sub': '2', 'exp': time.time() + 3600}, 'new', algorithm='HS256')
+
+    assert rbac.verify_token(old_token)[0]['sub'] == '1'
+    assert rbac.verify_token(new_token)[0]['sub'] == '2'
+
+    time.sleep(0.35)
+    # The cached verification ended with the window too
+    with pytest.raises(JWTError):
+        rbac.verify_token(old_token)
+    assert rbac.verify_token(new_token)[0]['sub'] == '2'
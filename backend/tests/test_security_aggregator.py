@@ -0,0 +1,94 @@
+import json
+from typing import Any, Dict, List
+
+import pytest
+
+from app.services import security_aggregator
+from app.services.audit_service import AuditService
+from app.services.security_aggregator import SecurityEventAggregator
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class StubCloudWatch:
+    def __init__(self):
+        self.metrics: List[Dict[str, Any]] = []
+
+    def put_metric_data(self, Namespace: str, MetricData: List[Dict[str, Any]]) -> None:
+        self.metrics.extend(MetricData)
+
+    def value(self, name: str, dimension: str) -> int:
+        [metric] = [metric for metric in self.metrics
+                    if metric['MetricName'] == name and metric['Dimensions'][0]['Value'] == dimension]
+        return metric['Value']
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(security_aggregator.time, 'monotonic', clock)
+    return clock
+
+
+def aggregator(client: Any = None) -> SecurityEventAggregator:
+    return SecurityEventAggregator(
+        thresholds={'failed_login_attempts': 5},
+        event_types={'failed_login_attempts': ['login_failed']},
+        window_seconds=300,
+        bucket_seconds=10,
+        client=client
+    )
+
+
+def test_burst_across_a_publish_is_counted_whole(clock):
+    client = StubCloudWatch()
+    events = aggregator(client)
+    alerts = []
+    events.on_alert(alerts.append)
+
+    for _ in range(3):
+        events.record('login_failed', 'user-1', '10.0.0.1')
+    events.publish()
+    clock.now += 60
+    for _ in range(2):
+        events.record('login_failed', 'user-1', '10.0.0.1')
+
+    assert [(alert.scope, alert.count) for alert in alerts] == [('user', 5), ('ip', 5), ('global', 5)]
+    client.metrics.clear()
+    events.publish()
+    assert client.value('SecurityEvents', 'login_failed') == 5
+
+
+def test_events_leave_the_window(clock):
+    events = aggregator()
+    events.record('login_failed', 'user-1', '10.0.0.1')
+    clock.now += 200
+    events.record('login_failed', 'user-1', '10.0.0.1')
+    assert events.event_count('login_failed') == 2
+    clock.now += 150
+    assert events.event_count('login_failed') == 1
+    assert events.count('failed_login_attempts', 'user', 'user-1') == 1
+
+
+def test_remote_events_are_logged_only_for_accepted_types():
+    service = AuditService()
+    logged: List[Dict[str, Any]] = []
+    service.log_security_event = lambda **event: logged.append(event)
+    accepted = frozenset(['login_failed'])
+
+    service.log_remote_event(json.dumps({'event_type': 'login_failed', 'user_id': '7', 'ip_address': '10.0.0.1',
+                                         'action': 'login', 'resource': 'auth'}), accepted)
+    service.log_remote_event(json.dumps({'event_type': 'security_alarm'}), accepted)
+    service.log_remote_event(b'not json', accepted)
+    service.log_remote_event(json.dumps({'user_id': '7'}), accepted)
+
+    assert logged == [{
+        'event_type': 'login_failed', 'user_id': '7', 'action': 'login', 'resource': 'auth',
+        'changes': None, 'ip_address': '10.0.0.1', 'user_agent': None,
+    }]
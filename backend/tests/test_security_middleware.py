@@ -0,0 +1,99 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import JWTError
+
+from app.core.security_config import RATE_LIMIT_CONFIG
+from app.middleware import security
+from app.middleware.security import RateLimitMiddleware, RBACMiddleware, RequestAuditor, SecurityMiddleware
+from app.services.ip_filter import IPLists
+from app.services.rate_limiter import create_rate_limiter
+
+CLIENT_IP = '100.64.0.7'
+
+
+@pytest.fixture
+def events(monkeypatch) -> List[Dict[str, Any]]:
+    events: List[Dict[str, Any]] = []
+    monkeypatch.setattr(security.audit_service, 'log_security_event', lambda **event: events.append(event))
+    return events
+
+
+def middleware(app) -> SecurityMiddleware:
+    rate_limiter = RateLimitMiddleware()
+    rate_limiter.limiter = create_rate_limiter({**RATE_LIMIT_CONFIG, 'backend': 'local'})
+    rate_limiter._distributed_limiter = None
+    auditor = RequestAuditor(mode='off')
+    return SecurityMiddleware(app, auditor=auditor, lists=IPLists(), rate_limiter=rate_limiter)
+
+
+def request(handler) -> List[Dict[str, Any]]:
+    sent: List[Dict[str, Any]] = []
+    scope = {'type': 'http', 'method': 'GET', 'path': '/api/v1/jobs/1', 'client': (CLIENT_IP, 50000),
+             'headers': [], 'state': {}}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(handler(scope, receive, send))
+    return sent
+
+
+def respond(status: int):
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': status, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+    return app
+
+
+def api_errors(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [event for event in events if event['event_type'] == 'api_error']
+
+
+def test_server_error_responses_are_audited(events):
+    request(middleware(respond(200)))
+    request(middleware(respond(404)))
+    assert api_errors(events) == []
+
+    request(middleware(respond(503)))
+
+    [event] = api_errors(events)
+    assert event['ip_address'] == CLIENT_IP
+    assert event['changes'] == {'status': 503, 'method': 'GET', 'path': '/api/v1/jobs/1'}
+
+
+def test_unhandled_exception_is_audited_as_server_error(events):
+    async def app(scope, receive, send):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        request(middleware(app))
+
+    [event] = api_errors(events)
+    assert event['changes']['status'] == 500
+
+
+def test_rbac_events_carry_client_ip(events, monkeypatch):
+    rbac = RBACMiddleware()
+    credentials = HTTPAuthorizationCredentials(scheme='Bearer', credentials='token')
+
+    monkeypatch.setattr(rbac, 'verify_token', lambda token: ({'sub': 'user-1'}, 0))
+    assert not asyncio.run(rbac.verify_permissions(credentials, ['manage_compliance'], ip_address=CLIENT_IP))
+
+    def invalid(token):
+        raise JWTError("bad signature")
+
+    monkeypatch.setattr(rbac, 'verify_token', invalid)
+    with pytest.raises(HTTPException):
+        asyncio.run(rbac.verify_permissions(credentials, ['manage_compliance'], ip_address=CLIENT_IP))
+
+    assert [(event['event_type'], event['ip_address']) for event in events] == [
+        ('permission_denied', CLIENT_IP),
+        ('unauthorized_access', CLIENT_IP),
+    ]
@@ -0,0 +1,150 @@
+import base64
+import itertools
+import os
+from typing import Any, Dict
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app.core.cache import TTLCache
+from app.services.security_service import _HEADER, NONCE_SIZE, DecryptionError, SecurityService
+
+
+class StubKMS:
+    """Issues random data keys wrapped as opaque handles, and unwraps only handles it issued"""
+
+    def __init__(self):
+        self.keys: Dict[bytes, bytes] = {}
+        self.generated = 0
+        self.decrypted = 0
+        self._handles = itertools.count(1)
+        self.error_code = None
+
+    def generate_data_key(self, **params: Any) -> Dict[str, Any]:
+        self.generated += 1
+        wrapped = b'wrapped-%d' % next(self._handles)
+        self.keys[wrapped] = os.urandom(32)
+        return {'Plaintext': self.keys[wrapped], 'CiphertextBlob': wrapped}
+
+    def decrypt(self, CiphertextBlob: bytes, **params: Any) -> Dict[str, Any]:
+        self.decrypted += 1
+        if self.error_code is not None:
+            raise ClientError({'Error': {'Code': self.error_code}}, 'Decrypt')
+        if CiphertextBlob not in self.keys:
+            raise ClientError({'Error': {'Code': 'InvalidCiphertextException'}}, 'Decrypt')
+        return {'Plaintext': self.keys[CiphertextBlob]}
+
+
+@pytest.fixture
+def kms() -> StubKMS:
+    return StubKMS()
+
+
+def service_for(kms: StubKMS) -> SecurityService:
+    service = SecurityService(kms_client=kms)
+    # Skip key discovery and the on-disk key id cache
+    service._key_id = 'test-key'
+    return service
+
+
+def wrapped_key(encrypted_value: str) -> bytes:
+    envelope = base64.b64decode(encrypted_value)
+    _, wrapped_length = _HEADER.unpack_from(envelope)
+    return envelope[_HEADER.size:_HEADER.size + wrapped_length]
+
+
+def tampered(encrypted_value: str, position: int) -> str:
+    envelope = bytearray(base64.b64decode(encrypted_value))
+    envelope[position] ^= 0x01
+    return base64.b64encode(bytes(envelope)).decode('ascii')
+
+
+def test_round_trip(kms):
+    service = service_for(kms)
+    values = ['4111 1111 1111 1111', 'Zoë Ångström', '', 12345]
+    encrypted = [service._encrypt_value(value) for value in values]
+
+    assert [service._decrypt_value(value) for value in encrypted] == [str(value) for value in values]
+    assert len(set(encrypted)) == len(encrypted)
+    # Another instance unwraps the data key through KMS once
+    reader = service_for(kms)
+    assert [reader._decrypt_value(value) for value in encrypted] == [str(value) for value in values]
+    assert kms.decrypted == 1
+
+
+def test_tampered_ciphertext_or_nonce_is_rejected(kms):
+    service = service_for(kms)
+    encrypted = service._encrypt_value('secret')
+    nonce_at = _HEADER.size + len(wrapped_key(encrypted))
+
+    for position in (nonce_at, nonce_at + NONCE_SIZE, len(base64.b64decode(encrypted)) - 1):
+        with pytest.raises(DecryptionError, match="authentication failed"):
+            service._decrypt_value(tampered(encrypted, position))
+
+
+def test_unknown_version_is_rejected(kms):
+    service = service_for(kms)
+    envelope = bytearray(base64.b64decode(service._encrypt_value('secret')))
+    envelope[0] = 2
+
+    with pytest.raises(DecryptionError, match="unsupported envelope version 2"):
+        service._decrypt_value(base64.b64encode(bytes(envelope)).decode('ascii'))
+
+
+@pytest.mark.parametrize('value', ['not base64!', '', base64.b64encode(b'\x01').decode(),
+                                   base64.b64encode(_HEADER.pack(1, 200) + b'short').decode()])
+def test_malformed_value_is_rejected(kms, value):
+    with pytest.raises(DecryptionError, match="malformed ciphertext"):
+        service_for(kms)._decrypt_value(value)
+
+
+def test_unknown_wrapped_key_is_corrupt_data_but_kms_outage_is_not(kms):
+    encrypted = service_for(kms)._encrypt_value('secret')
+    kms.keys.clear()
+    with pytest.raises(DecryptionError):
+        service_for(kms)._decrypt_value(encrypted)
+
+    kms.error_code = 'KMSInternalException'
+    with pytest.raises(Exception, match="Decryption failed") as raised:
+        service_for(kms)._decrypt_value(encrypted)
+    assert not isinstance(raised.value, DecryptionError)
+
+
+def test_data_key_rotates_after_max_uses(kms):
+    service = service_for(kms)
+    service.data_key_max_uses = 3
+
+    keys = [wrapped_key(service._encrypt_value(n)) for n in range(7)]
+
+    assert kms.generated == 3
+    assert keys[0] == keys[1] == keys[2] != keys[3]
+    assert keys[3] == keys[4] == keys[5] != keys[6]
+
+
+def test_data_key_rotates_after_max_age(kms):
+    service = service_for(kms)
+    first = wrapped_key(service._encrypt_value('a'))
+    assert wrapped_key(service._encrypt_value('b')) == first
+
+    service._data_key.created_at -= service.data_key_max_age
+    rotated = wrapped_key(service._encrypt_value('c'))
+
+    assert rotated != first
+    assert kms.generated == 2
+
+
+def test_unwrapped_key_cache_is_bounded(kms):
+    writer = service_for(kms)
+    writer.data_key_max_uses = 1
+    encrypted = [writer._encrypt_value(n) for n in range(5)]
+    reader = service_for(kms)
+    reader._unwrapped_keys = TTLCache(maxsize=2)
+
+    assert [reader._decrypt_value(value) for value in encrypted] == ['0', '1', '2', '3', '4']
+    assert len(reader._unwrapped_keys) == 2
+    assert kms.decrypted == 5
+    # The most recent keys are still cached; the evicted first key goes back to KMS
+    reader._decrypt_value(encrypted[4])
+    assert kms.decrypted == 5
+    reader._decrypt_value(encrypted[0])
+    assert kms.decrypted == 6
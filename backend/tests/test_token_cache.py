@@ -0,0 +1,97 @@
+import time
+
+import pytest
+from jose import JWTError, jwt
+
+from app.core.cache import TTLCache
+from app.core.permissions import permission_claims
+from app.core.security_config import JWT_CONFIG, UserRole
+from app.middleware import security
+from app.middleware.security import RBACMiddleware
+from app.services.secrets_provider import SecretsProvider, SecretVersions
+
+NAME = security.AWS_SECURITY_CONFIG['secrets_manager']['jwt_secret_name']
+
+
+class StubBackend:
+    def __init__(self, secret: str):
+        self.versions = SecretVersions(secret)
+
+    def fetch(self, name):
+        return self.versions
+
+
+@pytest.fixture
+def backend():
+    return StubBackend('secret-1')
+
+
+@pytest.fixture
+def rbac(backend):
+    provider = SecretsProvider(backend, ttl=3600)
+    yield RBACMiddleware(provider)
+    provider.close()
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    calls = []
+    decode = security.jwt.decode
+
+    def counting_decode(token, *args, **kwargs):
+        calls.append(token)
+        return decode(token, *args, **kwargs)
+
+    monkeypatch.setattr(security.jwt, 'decode', counting_decode)
+    return calls
+
+
+def token(subject: str, secret: str = 'secret-1', expires_in: float = 3600) -> str:
+    claims = {'sub': subject, 'exp': time.time() + expires_in, **permission_claims(UserRole.TEAM_MEMBER)}
+    return jwt.encode(claims, secret, algorithm=JWT_CONFIG['algorithm'])
+
+
+def test_verified_token_is_served_from_the_cache(rbac, decodes):
+    value = token('user-1')
+    first = rbac.verify_token(value)
+    assert rbac.verify_token(value) == first
+    assert decodes == [value]
+
+
+def test_cached_token_expires_at_its_exp(rbac, decodes):
+    value = token('user-1', expires_in=0.5)
+    rbac.verify_token(value)
+    rbac.verify_token(value)
+    assert len(decodes) == 1
+
+    # Past exp the token is verified again, so jose's own expiry check applies
+    time.sleep(0.6)
+    try:
+        rbac.verify_token(value)
+    except JWTError:
+        pass
+    assert len(decodes) == 2
+
+
+def test_cache_is_bounded(rbac, decodes):
+    rbac._token_cache = TTLCache(maxsize=2)
+    values = [token(f"user-{n}") for n in range(3)]
+    for value in values:
+        rbac.verify_token(value)
+    assert len(rbac._token_cache) == 2
+
+    # The least recently used token was evicted and is decoded again
+    rbac.verify_token(values[0])
+    assert decodes == values + [values[0]]
+
+
+def test_secret_rotation_drops_cached_tokens(rbac, backend, decodes):
+    value = token('user-1')
+    rbac.verify_token(value)
+
+    backend.versions = SecretVersions('secret-2')
+    rbac.secrets.refresh(NAME)
+
+    with pytest.raises(JWTError):
+        rbac.verify_token(value)
+    assert rbac.verify_token(token('user-1', secret='secret-2'))[0]['sub'] == 'user-1'
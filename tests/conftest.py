@@ -0,0 +1,16 @@
+import os
+
+# Settings requires these at import; tests use fake Redis and SQLite and never reach real services
+_TEST_ENVIRONMENT = {
+    "SECRET_KEY": "test-secret-key",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_USER": "dynamis",
+    "DB_PASSWORD": "dynamis",
+    "DB_NAME": "dynamis_test",
+    "SMTP_USER": "noreply@example.com",
+    "SMTP_PASSWORD": "testing",
+}
+
+for _name, _value in _TEST_ENVIRONMENT.items():
+    os.environ.setdefault(_name, _value)
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from typing import Optional
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.core import aws
+from app.core.health import HealthChecker, HealthProbe
+
+
+class CountingCheck:
+    def __init__(self, delay: float = 0.0, error: Optional[Exception] = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+
+
+def test_concurrent_probes_share_one_check():
+    check = CountingCheck(delay=0.05)
+    probe = HealthProbe("postgresql", check, timeout=1, ttl=60)
+
+    async def run():
+        results = await asyncio.gather(*(probe.run() for _ in range(20)))
+        return results + [await probe.run()]
+
+    results = asyncio.run(run())
+
+    assert check.calls == 1
+    assert all(result["status"] == "healthy" for result in results)
+
+
+def test_result_is_checked_again_after_the_ttl():
+    check = CountingCheck()
+    probe = HealthProbe("redis", check, timeout=1, ttl=0)
+
+    async def run():
+        await probe.run()
+        await probe.run()
+
+    asyncio.run(run())
+    assert check.calls == 2
+
+
+def test_slow_and_failing_checks_are_reported():
+    slow = HealthProbe("kms", CountingCheck(delay=1), timeout=0.01, ttl=60)
+    failing = HealthProbe("redis", CountingCheck(error=ConnectionError("refused")), timeout=1, ttl=60)
+
+    assert asyncio.run(slow.run())["status"] == "error: timed out after 0.01s"
+    assert asyncio.run(failing.run())["status"] == "error: refused"
+
+
+def checker(*errors) -> HealthChecker:
+    checker = HealthChecker()
+    for n, error in enumerate(errors):
+        checker.register(f"service_{n}", CountingCheck(error=error), timeout=1, ttl=60)
+    return checker
+
+
+def test_liveness_never_runs_the_dependency_checks(monkeypatch):
+    failing = checker(ConnectionError("refused"))
+    monkeypatch.setattr(main, "health_checker", failing)
+
+    response = TestClient(main.app).get("/health/live")
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "alive"}
+    assert failing.probes[0].check.calls == 0
+
+
+def test_readiness_fails_when_any_dependency_fails(monkeypatch):
+    monkeypatch.setattr(main, "health_checker", checker(None, None))
+    ready = TestClient(main.app).get("/health/ready")
+    assert ready.status_code == 200
+    assert ready.json()["status"] == "healthy"
+
+    monkeypatch.setattr(main, "health_checker", checker(None, ConnectionError("refused")))
+    not_ready = TestClient(main.app).get("/health/ready")
+    assert not_ready.status_code == 503
+    assert not_ready.json()["services"]["service_0"]["status"] == "healthy"
+    assert not_ready.json()["services"]["service_1"]["status"] == "error: refused"
+
+
+def test_aws_clients_are_created_once_per_service(monkeypatch):
+    created = []
+
+    def client(service_name, **options):
+        created.append(service_name)
+        return object()
+
+    monkeypatch.setattr(aws.boto3, "client", client)
+    monkeypatch.setattr(aws, "_clients", {})
+    start = threading.Barrier(8)
+    clients = []
+
+    def get():
+        start.wait()
+        clients.append(aws.get_client("kms"))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created == ["kms"]
+    assert len({id(client) for client in clients}) == 1
+    assert aws.get_client("secretsmanager") is not clients[0]
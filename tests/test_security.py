@@ -0,0 +1,48 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fakeredis import aioredis
+
+from app import main
+from app.core import security
+
+
+def test_wrong_password_publishes_login_failed(monkeypatch):
+    client = aioredis.FakeRedis()
+    monkeypatch.setattr(security, "get_redis", lambda: client)
+    user = SimpleNamespace(id=7, hashed_password=security.get_password_hash("right"))
+
+    async def run():
+        async with client.pubsub() as pubsub:
+            await pubsub.subscribe(security.settings.SECURITY_EVENTS_CHANNEL)
+            await pubsub.get_message(timeout=1)
+            assert await security.authenticate_password(user, "right", ip_address="10.0.0.1")
+            assert not await security.authenticate_password(user, "wrong", ip_address="10.0.0.1")
+            return await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+
+    message = asyncio.run(run())
+    security.shutdown_password_hasher()
+
+    event = json.loads(message["data"])
+    assert event["event_type"] == "login_failed"
+    assert event["user_id"] == "7"
+    assert event["ip_address"] == "10.0.0.1"
+
+
+def test_saturated_hasher_sheds_with_a_domain_error(monkeypatch):
+    monkeypatch.setattr(security.settings, "PASSWORD_HASH_MAX_PENDING", 0)
+
+    with pytest.raises(security.HashingOverloaded):
+        asyncio.run(security.verify_password_async("password", "hash"))
+
+
+def test_overloaded_hasher_maps_to_503_with_retry_after():
+    assert main.app.exception_handlers[security.HashingOverloaded] is main.hashing_overloaded_handler
+
+    response = asyncio.run(main.hashing_overloaded_handler(None, security.HashingOverloaded("busy")))
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert json.loads(response.body) == {"detail": "busy"}
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+from fakeredis import aioredis
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.core.database import Base
+from app.models.user import User
+from app.services import user_cache as user_cache_module
+from app.services.user_cache import UserCache
+
+EMAIL = "ada@example.com"
+
+
+def new_cache() -> UserCache:
+    return UserCache(local_size=100, local_ttl=30, redis_ttl=300, negative_ttl=30)
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = aioredis.FakeRedis()
+    monkeypatch.setattr(user_cache_module.settings, "REDIS_URL", "redis://fake")
+    monkeypatch.setattr(user_cache_module, "get_redis", lambda: client)
+    return client
+
+
+@pytest.fixture
+def cache(monkeypatch) -> UserCache:
+    cache = new_cache()
+    # Commits invalidate the module's cache through the Session events
+    monkeypatch.setattr(user_cache_module, "user_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'users.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def seed():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with sessions() as db:
+            db.add(User(id=1, email=EMAIL, hashed_password="hash", full_name="Ada"))
+            await db.commit()
+
+    asyncio.run(seed())
+    yield sessions
+    asyncio.run(engine.dispose())
+
+
+async def rename(sessions, full_name: str) -> None:
+    async with sessions() as db:
+        user = await db.get(User, 1)
+        user.full_name = full_name
+        await db.commit()
+
+
+def test_second_lookup_is_a_local_hit(cache, sessions, redis_client):
+    async def run():
+        async with sessions() as db:
+            first = await cache.get_by_id(db, 1)
+            second = await cache.get_by_email(db, EMAIL)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first == second
+    assert first["full_name"] == "Ada"
+    assert "hashed_password" not in first
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["local_hits"] == 1
+
+
+def test_other_worker_is_served_from_redis(cache, sessions, redis_client):
+    other_worker = new_cache()
+
+    async def run():
+        async with sessions() as db:
+            await cache.get_by_id(db, 1)
+            return await other_worker.get_by_email(db, EMAIL)
+
+    assert asyncio.run(run())["id"] == 1
+    assert other_worker.stats()["redis_hits"] == 1
+    assert other_worker.stats()["misses"] == 0
+
+
+def test_commit_invalidates_both_tiers(cache, sessions, redis_client):
+    async def run():
+        async with sessions() as db:
+            await cache.get_by_id(db, 1)
+        assert await redis_client.exists("user:id:1", f"user:email:{EMAIL}") == 2
+
+        await rename(sessions, "Ada Lovelace")
+        await cache.wait_for_invalidations()
+        assert await redis_client.exists("user:id:1", f"user:email:{EMAIL}") == 0
+        assert "user:id:1" not in cache.local
+
+        async with sessions() as db:
+            return await cache.get_by_id(db, 1)
+
+    assert asyncio.run(run())["full_name"] == "Ada Lovelace"
+    assert cache.stats()["misses"] == 2
+
+
+def test_unknown_email_is_cached_until_the_user_is_created(cache, sessions, redis_client):
+    async def run():
+        async with sessions() as db:
+            assert await cache.get_by_email(db, "grace@example.com") is None
+            assert await cache.get_by_email(db, "grace@example.com") is None
+            db.add(User(id=2, email="grace@example.com", hashed_password="hash"))
+            await db.commit()
+        await cache.wait_for_invalidations()
+        async with sessions() as db:
+            return await cache.get_by_email(db, "grace@example.com")
+
+    assert asyncio.run(run())["id"] == 2
+    assert cache.stats()["negative_hits"] == 1
+
+
+@pytest.mark.parametrize("with_redis", [True, False])
+def test_fill_that_raced_a_commit_is_rejected(cache, sessions, monkeypatch, with_redis):
+    client = aioredis.FakeRedis()
+    monkeypatch.setattr(user_cache_module.settings, "REDIS_URL", "redis://fake" if with_redis else None)
+    monkeypatch.setattr(user_cache_module, "get_redis", lambda: client if with_redis else None)
+
+    async def run():
+        async with sessions() as db:
+            read = db.execute
+
+            async def read_then_commit_elsewhere(statement):
+                # Another request commits a change after this lookup read the old row
+                result = await read(statement)
+                await rename(sessions, "Ada Lovelace")
+                await cache.wait_for_invalidations()
+                return result
+
+            db.execute = read_then_commit_elsewhere
+            stale = await cache.get_by_id(db, 1)
+            db.execute = read
+            assert not await client.exists("user:id:1")
+            return stale, await cache.get_by_id(db, 1)
+
+    stale, fresh = asyncio.run(run())
+
+    assert stale["full_name"] == "Ada"
+    assert fresh["full_name"] == "Ada Lovelace"
+    assert cache.stats()["stale_fills"] == 1
+    assert cache.stats()["misses"] == 2
@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.api.deps import get_current_superuser
+from app.core.database import Base, get_db
+from app.main import app
+from app.models.user import User
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def client(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'users.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def seed():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with sessions() as db:
+            # Pairs of users share a created_at, so pages must break ties on id
+            db.add_all(
+                User(
+                    id=n,
+                    email=f"user_{n}@example.com" if n % 5 else f"user%{n}@example.com",
+                    hashed_password="x",
+                    full_name=f"User {n}",
+                    is_active=n % 3 != 0,
+                    is_superuser=n == 1,
+                    created_at=START + timedelta(minutes=n // 2),
+                )
+                for n in range(1, 13)
+            )
+            await db.commit()
+
+    async def override_get_db():
+        async with sessions() as db:
+            yield db
+
+    asyncio.run(seed())
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_current_superuser] = lambda: {"id": 1, "is_superuser": True}
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+        asyncio.run(engine.dispose())
+
+
+def all_pages(client, **params):
+    ids, cursor = [], None
+    while True:
+        response = client.get("/api/v1/users", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        ids.extend(user["id"] for user in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def test_pages_cover_every_user_newest_first_once(client):
+    assert all_pages(client, limit=5) == list(range(12, 0, -1))
+    assert all_pages(client, limit=2) == list(range(12, 0, -1))
+
+
+def test_filters_apply_across_pages(client):
+    assert all_pages(client, limit=2, is_active="false") == [12, 9, 6, 3]
+    assert all_pages(client, limit=2, is_superuser="true") == [1]
+
+
+def test_prefix_search_matches_wildcards_literally(client):
+    assert all_pages(client, q="user%") == [10, 5]
+    assert all_pages(client, q="User 1") == [12, 11, 10, 1]
+
+
+def test_malformed_cursor_is_rejected(client):
+    assert client.get("/api/v1/users", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_created_at_is_required():
+    assert User.__table__.c.created_at.nullable is False